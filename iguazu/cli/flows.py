@@ -10,10 +10,12 @@ import sys
 import click
 import pandas as pd
 import prefect
-from prefect.engine.executors import LocalExecutor, SynchronousExecutor, DaskExecutor
+from prefect.engine.executors import LocalExecutor, LocalDaskExecutor, SynchronousExecutor, DaskExecutor
 
+from iguazu.core import tracing
 from iguazu.core.files import parse_data_url
 from iguazu.core.flows import execute_flow, REGISTRY
+from iguazu.core.state_cache import flow_state_cache
 from iguazu.core.tasks import Task
 
 logger = logging.getLogger(__name__)
@@ -76,6 +78,13 @@ def info(flow_name, output, show):
     tr = task_report(flow)
     click.secho(tr.to_string(index=False))
 
+    # Print recommended executor parameters
+    click.secho(f'Recommended executor parameters for {flow_name}:', fg='green')
+    for executor_type in ('processes', 'threads'):
+        defaults = flow_class.executor_defaults(executor_type)
+        options = ' '.join(f'--{k.replace("_", "-")} {v}' for k, v in defaults.items())
+        click.secho(f'--executor-type {executor_type} {options}')
+
     if output:
         # Handle output, prefect requires it to be without the .pdf extension
         path = pathlib.Path(output)
@@ -99,6 +108,22 @@ def info(flow_name, output, show):
         path.with_suffix('').unlink()
 
 
+@flows_group.command(name='compact-cache')
+@click.option('--temp-dir', required=True,
+              type=click.Path(file_okay=False, dir_okay=True, exists=True),
+              help='Temporary directory of the flows whose cache will be compacted.')
+def compact_cache(temp_dir):
+    """Remove the expired task states of the cache of a temporary directory"""
+    cache = flow_state_cache(temp_dir)
+    if not cache.path.exists():
+        raise click.ClickException(f'There is no cache at {cache.path}')
+    before = cache.path.stat().st_size
+    removed = cache.compact()
+    after = cache.path.stat().st_size
+    click.secho(f'Removed {removed} expired states from {cache.path}, '
+                f'{cache.size()} states remain ({before} -> {after} bytes)', fg='green')
+
+
 class RunFlowGroup(click.core.Group):
     """A regular click group, but with a custom error
 
@@ -141,10 +166,21 @@ class RunFlowGroup(click.core.Group):
 #               required=False, help='Path where temporary files with processed data are saved. ')
 # @click.option('--output-dir', default=None, #type=click.Path(file_okay=False, dir_okay=True, exists=False),
 #               required=False, help='Path where final files with processed data are saved. ')
-@click.option('--executor-type', type=click.Choice(['local', 'synchronous', 'dask']),
-              default='local', help='Type of executor to run the flow. Default is local.')
+@click.option('--executor-type', type=click.Choice(['local', 'synchronous', 'dask', 'processes', 'threads']),
+              default='local', help='Type of executor to run the flow. Default is local. '
+                                    'Use processes for CPU-bound flows (a local dask cluster) '
+                                    'and threads for I/O-bound flows (a local thread pool).')
 @click.option('--executor-address', required=False,
               help='Address for a remote executor. Only used when --executor-type=dask.')
+@click.option('--workers', type=click.INT, required=False,
+              help='Number of workers of the processes or threads executors. '
+                   'By default, the recommended value of the flow.')
+@click.option('--threads-per-worker', type=click.INT, required=False,
+              help='Number of threads of each worker of the processes executor. '
+                   'By default, the recommended value of the flow.')
+@click.option('--memory-limit', required=False,
+              help='Memory limit of each worker of the processes executor, such as 4GB or auto. '
+                   'By default, the recommended value of the flow.')
 # @click.option('--report', type=click.Path(dir_okay=False),  # report will now default to temp_dir/report-id.csv
 #               required=False,
 #               help='Output CSV report of the execution')
@@ -157,8 +193,13 @@ class RunFlowGroup(click.core.Group):
               help='When this flag is set, a flow execution that is not successful will '
                    'not make the program exit with a non-zero exit code. By default, '
                    'flows that are not successful have an exit code of -1.')
+@click.option('--trace', required=False, type=click.Path(dir_okay=False),
+              help='Output JSON file where the timeline of the task runs and their file '
+                   'operations will be saved, in the Chrome trace format. Open it with '
+                   'https://ui.perfetto.dev or chrome://tracing.')
 @click.pass_context
-def run_group(ctx, temp_url, output_url, temp_dir, executor_type, executor_address, force, cache, allow_flow_failure):
+def run_group(ctx, temp_url, output_url, temp_dir, executor_type, executor_address,
+              workers, threads_per_worker, memory_limit, force, cache, allow_flow_failure, trace):
     """Run the flow registered as FLOW_NAME
 
     Use command `iguazu flows run --help` to get a list of all available flows.
@@ -170,9 +211,13 @@ def run_group(ctx, temp_url, output_url, temp_dir, executor_type, executor_addre
         'temp_dir': temp_dir,
         'executor_type': executor_type,
         'executor_address': executor_address,
+        'workers': workers,
+        'threads_per_worker': threads_per_worker,
+        'memory_limit': memory_limit,
         'force': force,
         'cache': cache,
         'allow_flow_failure': allow_flow_failure,
+        'trace': trace,
     }
 
     ctx.obj.update(opts)
@@ -194,6 +239,10 @@ def prepare_prefect_context_args():
         else:
             context_args['forced_tasks'] = forced_tasks
 
+    # Handle --trace
+    if ctx.obj.get('trace', None):
+        context_args['trace'] = True
+
     # Handle secrets:
     # - Slack secret
     if 'SLACK_WEBHOOK_URL' in os.environ:
@@ -247,10 +296,17 @@ def run_flow(flow_class, **kwargs):
     ctx.obj = ctx.obj or {}
     executor_type = ctx.obj.get('executor_type', None)
     executor_address = ctx.obj.get('executor_address', None)
-    executor = prepare_executor(executor_type, executor_address)
+    executor_kwargs = flow_class.executor_defaults(executor_type)
+    for k in ('workers', 'threads_per_worker', 'memory_limit'):
+        if ctx.obj.get(k, None) is not None:
+            executor_kwargs[k] = ctx.obj[k]
+    executor = prepare_executor(executor_type, executor_address, **executor_kwargs)
 
     # Prepare prefect context
     context_args = prepare_prefect_context_args()
+    trace = ctx.obj.get('trace', None)
+    if trace:
+        tracing.enable()
 
     ###
     # Flow execution
@@ -264,6 +320,11 @@ def run_flow(flow_class, **kwargs):
         click.secho(f'Flow state was an exception: {flow_state.result}', fg='red')
         ctx.fail(f'Flow run failed: {flow_state.result}.')
 
+    # Save the timeline of the flow
+    if trace:
+        count = tracing.write_chrome_trace(tracing.flow_spans(flow_state), trace)
+        click.secho(f'Saved trace of {count} spans on {trace}', fg='blue')
+
     # Create dataframe report and save to CSV
     df = state_report(flow_state, flow)
     report = ctx.obj.get('csv_report', None)
@@ -272,8 +333,9 @@ def run_flow(flow_class, **kwargs):
         tmpfile.close()
         report = tmpfile.name
     if not df.empty:
-        df = df[['status', 'task class', 'task name', 'message', 'exception']]
-        df_upper = df.drop(columns='exception')
+        details = ['quetzal calls', 'quetzal seconds', 'quetzal operations', *PROFILE_COLUMNS]
+        df = df[['status', 'task class', 'task name', 'message', 'exception', *details]]
+        df_upper = df.drop(columns=['exception', *details])
         df_upper.columns = [col.upper() for col in df_upper.columns]
         click.secho(df_upper.to_string())
         df.to_csv(report, index=False)
@@ -306,13 +368,33 @@ def _init_run_group():
         run_group.add_command(run_cmd)
 
 
-def prepare_executor(executor_type, executor_address=None):
-    """Instantiate a prefect executor"""
+def prepare_executor(executor_type, executor_address=None, *,
+                     workers=None, threads_per_worker=None, memory_limit=None):
+    """Instantiate a prefect executor
+
+    The `workers`, `threads_per_worker` and `memory_limit` parameters size the
+    local cluster of the ``processes`` and ``dask`` (without address)
+    executors. The ``threads`` executor only uses `workers`. Parameters set to
+    ``None`` keep the dask defaults.
+    """
+    cluster_kwargs = dict(n_workers=workers,
+                          threads_per_worker=threads_per_worker,
+                          memory_limit=memory_limit)
+    cluster_kwargs = {k: v for k, v in cluster_kwargs.items() if v is not None}
+
     if executor_type == 'dask':
         if executor_address is not None:
             executor = DaskExecutor(executor_address)
         else:
-            executor = DaskExecutor(local_processes=True)
+            executor = DaskExecutor(local_processes=True, **cluster_kwargs)
+    elif executor_type == 'processes':
+        executor = DaskExecutor(local_processes=True, **cluster_kwargs)
+    elif executor_type == 'threads':
+        if threads_per_worker is not None or memory_limit is not None:
+            logger.warning('The threads executor ignores the threads per worker '
+                           'and memory limit parameters')
+        thread_kwargs = {'num_workers': workers} if workers is not None else {}
+        executor = LocalDaskExecutor(scheduler='threads', **thread_kwargs)
     elif executor_type == "synchronous":
         executor = SynchronousExecutor()
     elif executor_type == 'local':
@@ -322,6 +404,7 @@ def prepare_executor(executor_type, executor_address=None):
         # kept for completeness
         raise ValueError(f'Unknown executor type "{executor_type}".')
 
+    logger.debug('Prepared %s executor with %s', executor_type, cluster_kwargs)
     return executor
 
 
@@ -337,6 +420,8 @@ def state_report(flow_state, flow=None):
             'message': state.message,
             'exception': extract_state_exception(state),
             'order': (sorted_tasks.index(task) if task in sorted_tasks else sys.maxsize, task.name, -1),
+            **quetzal_calls_report(state),
+            **profile_report(state),
         })
         if state.is_mapped():
             for i, mapped_state in enumerate(state.map_states):
@@ -347,6 +432,8 @@ def state_report(flow_state, flow=None):
                     'message': mapped_state.message,
                     'exception': extract_state_exception(mapped_state),
                     'order': (sorted_tasks.index(task) if task in sorted_tasks else sys.maxsize, task.name, i),
+                    **quetzal_calls_report(mapped_state),
+                    **profile_report(mapped_state),
                 })
 
     df = (
@@ -370,6 +457,52 @@ def task_report(flow):
     return pd.DataFrame.from_records(rows)
 
 
+def quetzal_calls_report(state):
+    """Get the report columns of the Quetzal calls made by the task of a state
+
+    The calls are saved on the states by
+    :py:class:`iguazu.core.runners.IguazuTaskRunner`. States of other runners
+    have empty columns.
+    """
+    calls = getattr(state, 'quetzal_calls', None)
+    if calls is None:
+        return {'quetzal calls': None, 'quetzal seconds': None, 'quetzal operations': None}
+    return {
+        'quetzal calls': sum(c['count'] for c in calls.values()),
+        'quetzal seconds': sum(c['seconds'] for c in calls.values()),
+        'quetzal operations': ', '.join(f'{op}={c["count"]}' for op, c in calls.items()),
+    }
+
+
+PROFILE_COLUMNS = ('wall seconds', 'cpu seconds', 'peak rss delta', 'read bytes', 'written bytes', 'rows',
+                   'phases')
+
+
+def profile_report(state):
+    """Get the report columns of the profile of the task run of a state
+
+    The profiles are saved on the states by
+    :py:class:`iguazu.core.runners.IguazuTaskRunner` (see
+    :py:mod:`iguazu.core.profiling`). States of other runners have empty
+    columns.
+    """
+    profile = getattr(state, 'task_profile', None)
+    if profile is None:
+        return dict.fromkeys(PROFILE_COLUMNS)
+    total = profile.get('total', {})
+    phases = {name: measures for name, measures in profile.items() if name != 'total'}
+    return {
+        'wall seconds': total.get('wall_seconds'),
+        'cpu seconds': total.get('cpu_seconds'),
+        'peak rss delta': total.get('peak_rss_delta'),
+        'read bytes': total.get('read_bytes'),
+        'written bytes': total.get('written_bytes'),
+        'rows': total.get('rows'),
+        'phases': ', '.join(f'{name}={m["wall_seconds"]:.2f}s/{m["cpu_seconds"]:.2f}cpu'
+                            for name, m in phases.items()),
+    }
+
+
 def extract_state_exception(state):
     """Get the formatted traceback string of a prefect state exception"""
     if not state.is_failed():
@@ -116,6 +116,32 @@ def version():
     click.echo(f'Iguazu version {__version__}.')
 
 
+@cli.command('quetzal-server')
+@click.option('--host', default='127.0.0.1', show_default=True,
+              help='Address where the server listens.')
+@click.option('--port', type=click.INT, default=0,
+              help='Port where the server listens. By default, a free port.')
+@click.option('--latency', type=click.FLOAT, default=0, show_default=True,
+              help='Seconds added to each request.')
+@click.option('--bandwidth', type=click.FLOAT, default=0,
+              help='Bytes per second of the uploads and downloads. By default, no limit.')
+def quetzal_server(host, port, latency, bandwidth):
+    """Run a local stand-in Quetzal server for tests and benchmarks"""
+    from iguazu.core.quetzal_server import LocalQuetzalServer
+
+    server = LocalQuetzalServer(host, port, latency=latency, bandwidth=bandwidth)
+    click.secho('Set the following environment variables to use this server:', fg='blue')
+    for name, value in server.environment.items():
+        click.echo(f'export {name}={value}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        click.echo(f'Server statistics: {server.stats()}')
+        server.stop()
+
+
 cli.add_command(deploy_group)
 cli.add_command(flows_group)
 
@@ -0,0 +1,383 @@
+"""
+Dataframe helpers used by the automatic input management of Iguazu tasks
+
+This module holds the process-wide cache of decoded dataframes used by
+:py:meth:`iguazu.core.tasks.Task.prepare_inputs`. Several tasks of the same
+flow usually read the same HDF5 keys of the same file (for example, all the
+feature tasks read the standard events of a file). When these tasks run on the
+same process, such as a dask worker, the cache avoids decoding the same
+dataframe several times.
+
+It also holds the functions used to read a subset of a HDF5 node, so that
+tasks that only need some columns or some time range of a large signal do
+not need to read and decode all of it.
+"""
+
+import collections
+import contextlib
+import logging
+import os
+import pathlib
+import threading
+from dataclasses import dataclass
+from typing import (
+    Any, Dict, Hashable, Iterator, Optional, Sequence, Tuple, Union,
+)
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class DataFrameCache:
+    """Memory-bounded, least-recently-used cache of dataframes
+
+    Entries are evicted in least-recently-used order when the total estimated
+    memory of the cached dataframes exceeds :py:attr:`max_bytes`. A dataframe
+    larger than the budget is never cached.
+
+    An entry can also be added on behalf of an *owner* (e.g. a task) with its
+    own budget: the entries of an owner are bounded by the budget of that
+    owner, and evict each other first. This lets tasks with different budgets
+    share the same cache without changing the budget of the others. Any entry
+    can be retrieved regardless of its owner. The whole cache stays bounded:
+    when its total memory exceeds :py:attr:`max_bytes` or, when it is zero,
+    the largest budget of the owners of its entries, the least-recently-used
+    entries of any owner are evicted.
+
+    Dataframes are copied when they are added and when they are retrieved, so
+    that a task that modifies its inputs in-place does not corrupt the cached
+    version for the next task.
+
+    This class is thread-safe, since a dask worker may run several tasks at
+    the same time on different threads.
+
+    Parameters
+    ----------
+    max_bytes
+        Memory budget of the cache, in bytes. Zero disables the cache.
+
+    """
+
+    def __init__(self, max_bytes: int = 0):
+        self._entries = collections.OrderedDict()
+        self._sizes = {}
+        self._owners = {}
+        self._owner_bytes = collections.Counter()
+        self._budgets = {}
+        self._lock = threading.RLock()
+        self._max_bytes = max(int(max_bytes), 0)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def max_bytes(self) -> int:
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, value: int):
+        with self._lock:
+            self._max_bytes = max(int(value), 0)
+            self._evict(None, self._max_bytes)
+            self._evict_total()
+
+    def get(self, key: Hashable) -> Optional[pd.DataFrame]:
+        """Get a copy of a cached dataframe, or ``None`` on a cache miss"""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key].copy()
+
+    def put(self, key: Hashable, dataframe: pd.DataFrame,
+            owner: Optional[Hashable] = None, max_bytes: Optional[int] = None) -> bool:
+        """Add a copy of a dataframe to the cache
+
+        Parameters
+        ----------
+        key
+            Key of the dataframe.
+        dataframe
+            Dataframe to add.
+        owner
+            Owner of the entry. When set, the entry is bounded by the budget
+            of its owner, `max_bytes`, instead of :py:attr:`max_bytes`.
+        max_bytes
+            Memory budget, in bytes, of the entries of `owner`.
+
+        Returns
+        -------
+        ``True`` when the dataframe was added, ``False`` when it was not
+        because it is larger than the budget.
+
+        """
+        budget = self._max_bytes if owner is None else max(int(max_bytes or 0), 0)
+        size = _estimate_size(dataframe)
+        with self._lock:
+            if size > budget:
+                logger.debug('Dataframe of %d bytes does not fit in a cache of '
+                             '%d bytes, not caching it', size, budget)
+                return False
+            self._remove(key)
+            self._entries[key] = dataframe.copy()
+            self._sizes[key] = size
+            self._owners[key] = owner
+            self._owner_bytes[owner] += size
+            self._budgets[owner] = budget
+            self.total_bytes += size
+            self._evict(owner, budget)
+            self._evict_total()
+            return key in self._entries
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._owners.clear()
+            self._owner_bytes.clear()
+            self._budgets.clear()
+            self.total_bytes = 0
+
+    def stats(self) -> dict:
+        """Summary of the cache usage, useful for logging"""
+        with self._lock:
+            return dict(
+                entries=len(self._entries),
+                total_bytes=self.total_bytes,
+                max_bytes=self._max_bytes,
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+            )
+
+    def _remove(self, key: Hashable) -> None:
+        if key in self._entries:
+            del self._entries[key]
+            size = self._sizes.pop(key)
+            owner = self._owners.pop(key)
+            self._owner_bytes[owner] -= size
+            if not self._owner_bytes[owner]:
+                del self._owner_bytes[owner]
+                self._budgets.pop(owner, None)
+            self.total_bytes -= size
+
+    def _evict(self, owner: Optional[Hashable], budget: int) -> None:
+        # Entries are iterated from the least to the most recently used
+        for key in [k for k in self._entries if self._owners[k] == owner]:
+            if self._owner_bytes[owner] <= budget:
+                break
+            self._remove(key)
+            self.evictions += 1
+            logger.debug('Evicted dataframe %s from cache', key)
+
+    def _evict_total(self) -> None:
+        limit = self._max_bytes or max(self._budgets.values(), default=0)
+        while self._entries and self.total_bytes > limit:
+            key = next(iter(self._entries))
+            self._remove(key)
+            self.evictions += 1
+            logger.debug('Evicted dataframe %s from cache to respect its total budget', key)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+@dataclass
+class SelectionInfo:
+    """Information on how a selection was read from a HDF5 store"""
+
+    table_format: bool = False
+    """Whether the store node is in table format, where the selection can be
+    done by PyTables without reading all the node contents."""
+
+    rows_total: int = 0
+    """Number of rows of the node on the HDF5 store"""
+
+    rows_read: int = 0
+    """Number of rows that were read from the HDF5 store"""
+
+    bytes_avoided: int = 0
+    """Estimated number of bytes that were not read from the HDF5 store
+    thanks to the selection."""
+
+
+def read_hdf_selection(store: pd.HDFStore,
+                       key: str,
+                       *args,
+                       columns: Optional[Sequence[str]] = None,
+                       where: Optional[Union[str, Sequence[str]]] = None,
+                       time_range: Optional[Tuple[Any, Any]] = None,
+                       **kwargs) -> Tuple[Any, SelectionInfo]:
+    """Read a subset of rows and columns of a HDF5 node
+
+    When the node is stored in table format, the row selection given by
+    `where` and `time_range` is pushed down to PyTables, so that only the
+    selected rows are read from disk. Nodes in fixed format cannot be queried,
+    so they are read completely and then the selection is done with pandas.
+
+    Parameters
+    ----------
+    store
+        An open HDF5 store.
+    key
+        Name of the node to read.
+    args
+        Any additional positional arguments for :py:func:`pandas.read_hdf`.
+    columns
+        List of columns to keep. ``None`` keeps all columns.
+    where
+        A PyTables condition, or list of conditions, such as
+        ``'index >= "2020-01-01"'``. On fixed-format nodes, this condition
+        is evaluated with :py:meth:`pandas.DataFrame.query`, so it should
+        be an expression that is valid on both.
+    time_range
+        A ``(begin, end)`` tuple of timestamps used to select rows whose index
+        is between `begin` and `end`, inclusive. Either can be ``None`` to
+        leave the range open on that side.
+    kwargs
+        Any additional keyword arguments for :py:func:`pandas.read_hdf`.
+
+    Returns
+    -------
+    A tuple with the read object and the information of the selection.
+
+    """
+    storer = store.get_storer(key)
+    info = SelectionInfo(table_format=bool(getattr(storer, 'is_table', False)),
+                         rows_total=int(getattr(storer, 'nrows', None) or 0))
+
+    conditions = []
+    if isinstance(where, str):
+        conditions.append(where)
+    elif where is not None:
+        conditions.extend(where)
+    begin, end = time_range or (None, None)
+
+    if info.table_format:
+        if begin is not None:
+            conditions.append(f'index >= "{pd.Timestamp(begin).isoformat()}"')
+        if end is not None:
+            conditions.append(f'index <= "{pd.Timestamp(end).isoformat()}"')
+        obj = pd.read_hdf(store, key, *args,
+                          columns=columns, where=conditions or None,
+                          **kwargs)
+        info.rows_read = len(obj)
+        row_size = getattr(getattr(storer, 'table', None), 'rowsize', 0) or 0
+        info.bytes_avoided = max(info.rows_total - info.rows_read, 0) * row_size
+        return obj, info
+
+    # Fixed format: read everything, then select with pandas
+    obj = pd.read_hdf(store, key, *args, **kwargs)
+    info.rows_total = info.rows_read = len(obj)
+    if isinstance(obj, pd.DataFrame):
+        if columns is not None:
+            obj = obj[list(columns)]
+        for condition in conditions:
+            obj = obj.query(condition)
+        if begin is not None or end is not None:
+            mask = np.ones(obj.shape[0], dtype=bool)
+            if begin is not None:
+                mask &= obj.index >= pd.Timestamp(begin)
+            if end is not None:
+                mask &= obj.index <= pd.Timestamp(end)
+            obj = obj.loc[mask]
+    return obj, info
+
+
+_shared = threading.local()
+
+
+@contextlib.contextmanager
+def shared_dataframes() -> Iterator[Dict[Tuple[str, str], pd.DataFrame]]:
+    """Context manager where written dataframes are kept in memory
+
+    Inside this context, any dataframe saved with :py:func:`share_dataframe`
+    can be obtained again with :py:func:`get_shared_dataframe` without reading
+    it from its HDF5 file. This is used by
+    :py:class:`iguazu.core.pipelines.FusedPipeline` to hand over the results of
+    one stage to the next one. The shared dataframes are only visible on the
+    thread that created the context.
+    """
+    previous = getattr(_shared, 'registry', None)
+    _shared.registry = {}
+    try:
+        yield _shared.registry
+    finally:
+        _shared.registry = previous
+
+
+def share_dataframe(path: Union[str, os.PathLike], key: str, dataframe: pd.DataFrame) -> None:
+    """Keep a dataframe saved in a HDF5 file in memory, if possible
+
+    This function does nothing outside a :py:func:`shared_dataframes` context.
+    """
+    registry = getattr(_shared, 'registry', None)
+    if registry is None or not isinstance(dataframe, pd.DataFrame):
+        return
+    registry[_shared_key(path, key)] = dataframe
+
+
+def get_shared_dataframe(path: Union[str, os.PathLike], key: str) -> Optional[pd.DataFrame]:
+    """Get a copy of a dataframe kept with :py:func:`share_dataframe`
+
+    Returns ``None`` when there is no such dataframe or outside a
+    :py:func:`shared_dataframes` context.
+    """
+    registry = getattr(_shared, 'registry', None)
+    if registry is None:
+        return None
+    dataframe = registry.get(_shared_key(path, key), None)
+    if dataframe is None:
+        return None
+    return dataframe.copy()
+
+
+def current_shared_dataframes() -> Optional[Dict[Tuple[str, str], pd.DataFrame]]:
+    """Get the registry of the current :py:func:`shared_dataframes` context
+
+    Returns ``None`` outside a :py:func:`shared_dataframes` context.
+    """
+    return getattr(_shared, 'registry', None)
+
+
+def _shared_key(path: Union[str, os.PathLike], key: str) -> Tuple[str, str]:
+    # Normalize the HDF5 key because pandas accepts keys with or without the
+    # leading slash
+    return str(pathlib.Path(path).resolve()), '/' + str(key).lstrip('/')
+
+
+def _estimate_size(dataframe: pd.DataFrame) -> int:
+    # deep=True is needed to account for the object columns, such as the
+    # annotation dataframes that have strings
+    return int(dataframe.memory_usage(index=True, deep=True).sum())
+
+
+def freeze(obj: Any) -> Hashable:
+    """Convert an object with lists and dicts to a hashable version
+
+    This is used to create cache keys from the arguments of
+    :py:func:`pandas.read_hdf`.
+    """
+    if isinstance(obj, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in obj.items()))
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        items = tuple(freeze(v) for v in obj)
+        return tuple(sorted(items, key=repr)) if isinstance(obj, (set, frozenset)) else items
+    try:
+        hash(obj)
+    except TypeError:
+        return repr(obj)
+    return obj
+
+
+DATAFRAME_CACHE = DataFrameCache()
+"""Process-wide cache used by the managed inputs of all Iguazu tasks"""
@@ -34,3 +34,18 @@ class GracefulFailWithResults(IguazuError):
     def __init__(self, results, *args):
         super().__init__(*args)
         self.results = results
+
+    def __reduce__(self):
+        # Needed to pickle this exception, for example to send it from a
+        # subprocess, because its constructor has an extra parameter
+        return self.__class__, (self.results, ) + self.args
+
+
+class SubprocessFailed(IguazuError):
+    """Use when a task isolated in a subprocess did not finish correctly"""
+    pass
+
+
+class SubprocessTimeout(SubprocessFailed):
+    """Use when a task isolated in a subprocess exceeds its timeout"""
+    pass
@@ -4,6 +4,12 @@ from typing import Optional, Dict, Any
 
 from quetzal.client.utils import get_readable_info
 
+from iguazu.core import tracing
+from iguazu.core.files.checksums import file_checksum
+
+_TRACED_METHODS = ('download_data', 'download_metadata', 'upload_data', 'upload_metadata', 'delete')
+_TRACED_STATIC_METHODS = ('find', 'retrieve', 'find_many', 'retrieve_many', 'prefetch_metadata')
+
 
 class FileAdapter(abc.ABC):
     """Abstract class for accessing files
@@ -28,8 +34,24 @@ class FileAdapter(abc.ABC):
     dynamically which tasks will be executed, or simply to keep track of how a
     file was generated.
 
+    The I/O methods of each implementation are recorded on the timeline of
+    the flow when tracing is enabled (see :py:mod:`iguazu.core.tracing`).
+
     """
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for name in _TRACED_METHODS:
+            if name in cls.__dict__:
+                method = tracing.traced('io', name=f'{cls.__name__}.{name}',
+                                        describe=_describe_file)(cls.__dict__[name])
+                setattr(cls, name, method)
+        for name in _TRACED_STATIC_METHODS:
+            if isinstance(cls.__dict__.get(name, None), staticmethod):
+                method = tracing.traced('io', name=f'{cls.__name__}.{name}',
+                                        describe=_describe_search)(cls.__dict__[name].__func__)
+                setattr(cls, name, staticmethod(method))
+
     @abc.abstractmethod
     def __init__(self, *, filename, path, temporary, **kwargs):
         """ Create a new FileAdapter with empty data and metadata
@@ -223,6 +245,20 @@ class FileAdapter(abc.ABC):
         f_checksum, f_size = get_readable_info(stream)
         return (size, checksum) == (f_size, f_checksum)
 
+    def checksum_local(self, local_path: pathlib.Path) -> bool:
+        """ Check if the file metadata match the contents of a local file
+
+        Unlike :py:meth:`checksum`, the local file is not read when its size
+        differs from the metadata or when its checksum is already known by the
+        checksum index (see :py:mod:`iguazu.core.files.checksums`).
+        """
+        size = self.metadata['base']['size']
+        checksum = self.metadata['base']['checksum']
+        if local_path.stat().st_size != size:
+            return False
+        f_checksum, f_size = file_checksum(local_path)
+        return (size, checksum) == (f_size, f_checksum)
+
     @abc.abstractmethod
     def __getstate__(self):
         """ Serialize this instance (used by pickle) """
@@ -232,3 +268,13 @@ class FileAdapter(abc.ABC):
     def __setstate__(self, state):
         """ Create an instance by deserialization (used by pickle) """
         pass
+
+
+def _describe_file(file, *args, **kwargs):
+    # Do not use repr, which may download the metadata
+    local_path = getattr(file, '_local_path', None)
+    return {'file': getattr(local_path, 'name', None)}
+
+
+def _describe_search(*args, **kwargs):
+    return {'file': kwargs.get('filename', None) or kwargs.get('file_id', None)}
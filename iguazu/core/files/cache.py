@@ -0,0 +1,302 @@
+""" Node-local cache of downloaded files shared by all processes
+
+Without this cache, each Quetzal file is downloaded to its local path when a
+task needs it. Tasks of different processes of the same machine (e.g. dask
+workers) can download the same file at the same time, and a task that cleans
+its files (see :py:attr:`iguazu.core.options.TaskOptions.auto_clean_files`)
+can delete a file that a task of another process is still reading.
+
+When this cache is enabled, downloads are saved in a content-addressed
+directory, where files are named after their MD5 checksum:
+
+* Only one process downloads a file, while the others wait for it, using a
+  lock file per checksum.
+* Files are hard-linked from the cache to the local path where the tasks
+  expect them, which does not use more disk space. When the local path is on
+  another file system, the file is copied instead. Cached files are
+  read-only.
+* Each process counts the references to each local path. Cleaning a file
+  only removes its local path when no process references it anymore.
+  References of processes that died are ignored.
+* When the cache exceeds its size budget, the least recently used files that
+  are not referenced are evicted.
+
+The cache is disabled by default. It is enabled by setting the
+``IGUAZU_DOWNLOAD_CACHE`` environment variable to a directory, which should be
+on the same file system as the Quetzal data directory and the ``temp_dir`` of
+the flows. Its budget, in bytes, is set with ``IGUAZU_DOWNLOAD_CACHE_BUDGET``
+(zero, the default, means no limit).
+"""
+
+import contextlib
+import errno
+import fcntl
+import logging
+import os
+import pathlib
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    checksum TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS refs (
+    path TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    checksum TEXT,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (path, pid)
+);
+"""
+
+
+class DownloadCache:
+    """ Content-addressed cache of downloaded files
+
+    Parameters
+    ----------
+    root
+        Directory of the cache. It is created if it does not exist.
+    budget
+        Maximum size, in bytes, of the cached files. Zero means no limit. The
+        cache may exceed it while the files are referenced.
+
+    """
+
+    def __init__(self, root: Union[str, pathlib.Path], budget: int = 0):
+        self.root = pathlib.Path(root)
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    def fetch(self, checksum: str, size: int, destination: pathlib.Path,
+              download: Callable[[pathlib.Path], None]) -> pathlib.Path:
+        """ Make a file available on a local path, downloading it if needed
+
+        The local path is referenced by this process until :py:meth:`release`
+        is called.
+
+        Parameters
+        ----------
+        checksum
+            MD5 checksum of the file contents.
+        size
+            Size of the file, in bytes.
+        destination
+            Local path where the file is needed.
+        download
+            Function that downloads the file to the path that it receives,
+            verifying its checksum. It is only called when the cache does not
+            have the file.
+
+        Returns
+        -------
+        pathlib.Path
+            The `destination` path.
+
+        """
+        destination = pathlib.Path(destination)
+        obj = self._object_path(checksum)
+        with self._file_lock(checksum):
+            if not obj.exists() or obj.stat().st_size != size:
+                logger.debug('Download cache miss for %s', destination)
+                obj.parent.mkdir(parents=True, exist_ok=True)
+                partial = obj.with_name(obj.name + '.partial')
+                download(partial)
+                # Cached files are shared by hard links: make sure that
+                # nobody modifies them through their local path
+                os.chmod(str(partial), 0o444)
+                partial.replace(obj)
+                new_object = True
+            else:
+                logger.debug('Download cache hit for %s', destination)
+                new_object = False
+            self._execute('INSERT OR REPLACE INTO objects VALUES (?, ?, ?)',
+                          (checksum, size, time.time()))
+            if not destination.exists():
+                _link_or_copy(obj, destination)
+            self._add_reference(destination, checksum)
+
+        if new_object and self.budget > 0:
+            self.evict(self.budget)
+        return destination
+
+    def acquire(self, path: pathlib.Path) -> None:
+        """Reference a local path that already exists, so that it is not removed"""
+        self._add_reference(path, None)
+
+    def _add_reference(self, path, checksum):
+        key, pid = str(path), os.getpid()
+        self._execute('INSERT OR IGNORE INTO refs VALUES (?, ?, ?, 0)', (key, pid, checksum))
+        self._execute('UPDATE refs SET count = count + 1, checksum = COALESCE(?, checksum) '
+                      'WHERE path = ? AND pid = ?', (checksum, key, pid))
+
+    def release(self, path: pathlib.Path, referenced: bool = True, remove: bool = True) -> bool:
+        """ Release a reference to a local path and remove it when unused
+
+        Parameters
+        ----------
+        path
+            Local path obtained with :py:meth:`fetch` or :py:meth:`acquire`.
+        referenced
+            Whether the caller had a reference to `path`. When ``False``, the
+            path is only removed if no process references it.
+        remove
+            When ``False``, only release the reference and never remove the
+            local path.
+
+        Returns
+        -------
+        bool
+            Whether the local path was removed.
+
+        """
+        key = str(path)
+        pid = os.getpid()
+        if referenced:
+            self._execute('UPDATE refs SET count = count - 1 WHERE path = ? AND pid = ?',
+                          (key, pid))
+            self._execute('DELETE FROM refs WHERE path = ? AND pid = ? AND count <= 0',
+                          (key, pid))
+        if not remove:
+            return False
+        users = [
+            row_pid for row_pid, in self._execute('SELECT pid FROM refs WHERE path = ?', (key, ))
+            if _is_alive(row_pid)
+        ]
+        if users:
+            logger.debug('Not removing %s, still used by processes %s', path, users)
+            return False
+        self._execute('DELETE FROM refs WHERE path = ?', (key, ))
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(key)
+        return True
+
+    def evict(self, budget: int) -> int:
+        """ Remove the least recently used files until the cache fits a budget
+
+        Files that are referenced are never removed.
+
+        Returns
+        -------
+        int
+            Number of bytes freed.
+
+        """
+        self._forget_dead_processes()
+        total, = self._execute('SELECT COALESCE(SUM(size), 0) FROM objects')[0]
+        candidates = self._execute(
+            'SELECT checksum, size FROM objects WHERE checksum NOT IN '
+            '(SELECT checksum FROM refs WHERE checksum IS NOT NULL) '
+            'ORDER BY last_used'
+        )
+        freed = 0
+        for checksum, size in candidates:
+            if total - freed <= budget:
+                break
+            with self._file_lock(checksum):
+                with contextlib.suppress(FileNotFoundError):
+                    self._object_path(checksum).unlink()
+                self._execute('DELETE FROM objects WHERE checksum = ?', (checksum, ))
+            freed += size
+            logger.debug('Evicted %s (%d bytes) from download cache', checksum, size)
+        return freed
+
+    def _forget_dead_processes(self) -> None:
+        pids = {pid for pid, in self._execute('SELECT DISTINCT pid FROM refs')}
+        for pid in pids:
+            if not _is_alive(pid):
+                self._execute('DELETE FROM refs WHERE pid = ?', (pid, ))
+
+    def _object_path(self, checksum: str) -> pathlib.Path:
+        return self.root / 'objects' / checksum[:2] / checksum
+
+    @contextlib.contextmanager
+    def _file_lock(self, checksum: str):
+        lock_file = self.root / 'locks' / f'{checksum}.lock'
+        lock_file.parent.mkdir(parents=True, exist_ok=True)
+        with lock_file.open('a') as fd:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _execute(self, sql, parameters=()):
+        with self._lock:
+            connection = self._connect()
+            rows = connection.execute(sql, parameters).fetchall()
+            connection.commit()
+            return rows
+
+    def _connect(self) -> sqlite3.Connection:
+        # SQLite connections cannot be shared with a forked child process
+        if self._connection is None or self._pid != os.getpid():
+            self.root.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(str(self.root / 'cache.sqlite3'),
+                                               timeout=60, check_same_thread=False)
+            self._connection.executescript(_SCHEMA)
+            self._pid = os.getpid()
+        return self._connection
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_connection'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+def _link_or_copy(source: pathlib.Path, destination: pathlib.Path) -> None:
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(str(source), str(destination))
+    except OSError as exc:
+        if exc.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        logger.debug('Cannot link %s to %s (%s), copying it', source, destination, exc)
+        partial = destination.with_name(destination.name + '.partial')
+        shutil.copyfile(str(source), str(partial))
+        partial.replace(destination)
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+_default_cache = None
+
+
+def default_cache() -> Optional[DownloadCache]:
+    """ Get the download cache of this machine
+
+    Returns ``None`` when the cache is not enabled with the
+    ``IGUAZU_DOWNLOAD_CACHE`` environment variable.
+    """
+    global _default_cache
+    root = os.environ.get('IGUAZU_DOWNLOAD_CACHE', '')
+    if not root:
+        return None
+    budget = int(os.environ.get('IGUAZU_DOWNLOAD_CACHE_BUDGET', '0'))
+    if _default_cache is None or _default_cache.root != pathlib.Path(root):
+        _default_cache = DownloadCache(root, budget)
+    _default_cache.budget = budget
+    return _default_cache
@@ -0,0 +1,234 @@
+""" Persistent index of the checksums of local files
+
+Retrieving a file adapter verifies that any existing local copy of the file
+matches its metadata, which requires the checksum of the local copy. Computing
+it reads the whole file, which takes several seconds on large HDF5 files and
+happens each time that a file adapter is created.
+
+This module keeps the checksums already computed in a SQLite database, keyed
+by the absolute path of the file and its stat signature (size, modification
+time and inode). A checksum is only computed again when this signature
+changes, that is, when the file was written, replaced or moved.
+
+The index is shared by all processes of the same machine. Its location is
+``.iguazu/checksums.sqlite3`` in the Quetzal data directory, or the path set
+in the ``IGUAZU_CHECKSUM_INDEX`` environment variable. Setting this variable
+to an empty string disables the index.
+"""
+
+import logging
+import os
+import pathlib
+import sqlite3
+import threading
+from typing import Optional, Tuple, Union
+
+from quetzal.client.utils import get_data_dir, get_readable_info
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checksums (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    checksum TEXT NOT NULL
+)
+"""
+
+
+class ChecksumIndex:
+    """ Checksums of local files indexed by their stat signature
+
+    Parameters
+    ----------
+    path
+        Location of the SQLite database of the index. It is created if it does
+        not exist. ``None`` creates an index in memory that is not persisted.
+
+    Attributes
+    ----------
+    hits: int
+        Number of checksums obtained from the index.
+    misses: int
+        Number of checksums computed because the index did not have them or
+        because the file changed.
+
+    """
+
+    def __init__(self, path: Optional[Union[str, pathlib.Path]] = None):
+        self.path = None if path is None else pathlib.Path(path)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    def checksum(self, filename: Union[str, pathlib.Path]) -> Tuple[str, int]:
+        """ Get the checksum and size of a local file
+
+        The checksum is the same as :py:func:`quetzal.client.utils.get_readable_info`,
+        which is only called when the index does not have the checksum of this
+        version of the file.
+
+        Returns
+        -------
+        tuple
+            The MD5 checksum (as an hexadecimal string) and the size in bytes.
+
+        """
+        filename = pathlib.Path(filename).resolve()
+        stat = filename.stat()
+        signature = _signature(stat)
+        key = str(filename)
+
+        rows = self._execute('SELECT size, mtime_ns, inode, checksum FROM checksums WHERE path = ?',
+                             (key, ))
+        row = rows[0] if rows else None
+        if row is not None and tuple(row[:3]) == signature:
+            self.hits += 1
+            return row[3], stat.st_size
+
+        self.misses += 1
+        logger.debug('Computing checksum of %s', filename)
+        with filename.open('rb') as fd:
+            checksum, size = get_readable_info(fd)
+        # Only save the checksum if the file did not change while it was read
+        if _signature(filename.stat()) == signature:
+            self._execute('INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?)',
+                          (key, ) + signature + (checksum, ), commit=True)
+        return checksum, size
+
+    def record(self, filename: Union[str, pathlib.Path], checksum: str,
+               signature: Optional[Tuple[int, int, int]] = None) -> bool:
+        """ Save the checksum of a local file computed elsewhere
+
+        Use this when the checksum of a file is known without reading it
+        again, for example when it was computed while the file was written.
+
+        Parameters
+        ----------
+        filename
+            Local file.
+        checksum
+            MD5 checksum of the file contents.
+        signature
+            Stat signature (see :py:func:`stat_signature`) of the file when
+            `checksum` was computed. When set, the checksum is not saved if the
+            file changed since then.
+
+        Returns
+        -------
+        bool
+            Whether the checksum was saved.
+
+        """
+        filename = pathlib.Path(filename).resolve()
+        current = stat_signature(filename)
+        if signature is not None and tuple(signature) != current:
+            logger.debug('File %s changed since its checksum was computed', filename)
+            return False
+        self._execute('INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?)',
+                      (str(filename), ) + current + (checksum, ), commit=True)
+        return True
+
+    def forget(self, filename: Union[str, pathlib.Path]) -> None:
+        """Remove a file from the index"""
+        key = str(pathlib.Path(filename).resolve())
+        self._execute('DELETE FROM checksums WHERE path = ?', (key, ), commit=True)
+
+    def _execute(self, sql, parameters, commit=False):
+        with self._lock:
+            connection = self._connect()
+            rows = connection.execute(sql, parameters).fetchall()
+            if commit:
+                connection.commit()
+            return rows
+
+    def _connect(self) -> sqlite3.Connection:
+        # SQLite connections cannot be shared with a forked child process
+        if self._connection is None or self._pid != os.getpid():
+            if self.path is None:
+                database = ':memory:'
+            else:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                database = str(self.path)
+            self._connection = sqlite3.connect(database, timeout=30, check_same_thread=False)
+            self._connection.execute(_SCHEMA)
+            self._connection.commit()
+            self._pid = os.getpid()
+        return self._connection
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_connection'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+def stat_signature(filename: Union[str, pathlib.Path]) -> Tuple[int, int, int]:
+    """Get the size, modification time (in nanoseconds) and inode of a file"""
+    return _signature(os.stat(filename))
+
+
+def _signature(stat: os.stat_result) -> Tuple[int, int, int]:
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+_default_index = None
+
+
+def default_index() -> Optional[ChecksumIndex]:
+    """ Get the checksum index of this machine
+
+    Returns ``None`` when the index is disabled with the
+    ``IGUAZU_CHECKSUM_INDEX`` environment variable.
+    """
+    global _default_index
+    path = os.environ.get('IGUAZU_CHECKSUM_INDEX', None)
+    if path is None:
+        path = pathlib.Path(get_data_dir()) / '.iguazu' / 'checksums.sqlite3'
+    elif not path:
+        return None
+    if _default_index is None or _default_index.path != pathlib.Path(path):
+        _default_index = ChecksumIndex(path)
+    return _default_index
+
+
+def file_checksum(filename: Union[str, pathlib.Path]) -> Tuple[str, int]:
+    """ Get the checksum and size of a local file, using the index when possible
+
+    If the index cannot be used (for example, on a read-only file system), the
+    checksum is computed as if the index was disabled.
+    """
+    index = default_index()
+    if index is not None:
+        try:
+            return index.checksum(filename)
+        except (sqlite3.Error, OSError):
+            logger.warning('Checksum index %s failed, computing checksum of %s',
+                           index.path, filename, exc_info=True)
+    with open(filename, 'rb') as fd:
+        return get_readable_info(fd)
+
+
+def record_checksum(filename: Union[str, pathlib.Path], checksum: str,
+                    signature: Optional[Tuple[int, int, int]] = None) -> None:
+    """ Save the checksum of a local file on the index, if it is enabled
+
+    See :py:meth:`ChecksumIndex.record`. Errors are ignored: the checksum will
+    be computed again when needed.
+    """
+    index = default_index()
+    if index is None:
+        return
+    try:
+        index.record(filename, checksum, signature)
+    except (sqlite3.Error, OSError):
+        logger.warning('Could not save checksum of %s on index %s',
+                       filename, index.path, exc_info=True)
@@ -5,9 +5,10 @@ import pathlib
 from typing import Dict, Any, Optional
 
 from prefect import context
-from quetzal.client.utils import get_data_dir, get_readable_info
+from quetzal.client.utils import get_data_dir
 
 from iguazu.core.files import FileAdapter, LocalURL
+from iguazu.core.files.checksums import file_checksum
 from iguazu.utils import mapping_issubset
 
 # Notice the quetzal import just above: Even if we are on local file,
@@ -136,8 +137,7 @@ class LocalFile(FileAdapter):
         # ...finally, just check that the instance _local_path is not pointing
         # to old data to avoid confusion
         if instance._local_path.exists():
-            with instance._local_path.open('rb') as fd:
-                local_is_valid = instance.checksum(fd)
+            local_is_valid = instance.checksum_local(instance._local_path)
             if not local_is_valid:
                 logger.debug('File %s already exists locally in %s,'
                              'but its size and checksum differ from its accompanying '
@@ -347,8 +347,7 @@ class LocalFile(FileAdapter):
             base_meta['id'] = self._file_id
         if 'size' not in base_meta or 'checksum' not in base_meta:
             if self._local_path.exists():
-                with self._local_path.open('rb') as f:
-                    checksum, size = get_readable_info(f)
+                checksum, size = file_checksum(self._local_path)
                 base_meta['size'] = size
                 base_meta['checksum'] = checksum
 
@@ -0,0 +1,201 @@
+""" Write-behind buffer of file metadata updates
+
+The metadata of a file is often uploaded several times by the same task: the
+outputs are uploaded by :py:meth:`iguazu.core.tasks.Task.handle_outputs`, then
+again with different metadata on a graceful fail, some tasks upload their
+parent files, etc. Each upload is a request to Quetzal, and since each upload
+sends the complete metadata of the file instance, two instances of the same
+file can overwrite each other's changes.
+
+Inside a :py:func:`buffered_metadata` context, the metadata uploads of a
+:py:class:`iguazu.core.files.QuetzalFile` are not sent immediately. Instead,
+the changes of the metadata since it was downloaded are merged per file and
+sent with one request per file when the context ends or when
+:py:meth:`MetadataWriter.flush` is called. Iguazu tasks use this context for
+each execution, unless their
+:py:attr:`iguazu.core.options.TaskOptions.buffer_metadata` option is not set,
+and flush it at the end of
+:py:meth:`iguazu.core.tasks.Task.handle_outputs` (or of the graceful fail), so
+that upload errors are managed like any other error of the outputs.
+
+Changes are merged key by key, recursively, so that two instances of the same
+file that change different keys do not overwrite each other. Keys removed from
+the metadata are not detected as changes.
+"""
+
+import contextlib
+import copy
+import logging
+import threading
+from typing import Any, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+_state = threading.local()
+_totals_lock = threading.Lock()
+_totals = dict(requested=0, sent=0)
+
+
+class MetadataWriter:
+    """ Buffer of metadata changes, merged per file
+
+    Attributes
+    ----------
+    requested: int
+        Number of metadata uploads requested to this buffer.
+    sent: int
+        Number of metadata uploads actually sent to the backend.
+    saved: int
+        Number of metadata uploads that were merged into another upload, or
+        discarded, instead of being sent.
+
+    """
+
+    def __init__(self):
+        self.requested = 0
+        self.sent = 0
+        self.saved = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def add(self, file, changes: Dict[str, Dict[str, Any]]) -> None:
+        """ Buffer the metadata changes of a file
+
+        Parameters
+        ----------
+        file
+            A :py:class:`iguazu.core.files.QuetzalFile` known to Quetzal.
+        changes
+            Metadata keys that changed, by family. See :py:func:`diff`.
+
+        """
+        key = (file._workspace_id, str(file._file_id))
+        with _totals_lock:
+            _totals['requested'] += 1
+        with self._lock:
+            self.requested += 1
+            entry = self._pending.setdefault(key, {'files': [], 'changes': {}, 'requests': 0})
+            entry['requests'] += 1
+            if not any(f is file for f in entry['files']):
+                entry['files'].append(file)
+            _merge(entry['changes'], copy.deepcopy(changes))
+
+    def discard(self, file) -> None:
+        """Forget the buffered changes of a file, e.g. because it was deleted"""
+        with self._lock:
+            entry = self._pending.pop((file._workspace_id, str(file._file_id)), None)
+            if entry is not None:
+                self.saved += entry['requests']
+
+    def flush(self) -> int:
+        """ Send the buffered metadata changes, one request per file
+
+        Returns
+        -------
+        int
+            Number of requests sent.
+
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        count = merged = 0
+        for entry in pending.values():
+            # The most recent instance has the most recent values of the keys
+            # that are not changed (but that must be sent in full, because the
+            # backend only merges the first level of each family)
+            latest = entry['files'][-1]
+            metadata = {}
+            for family, family_changes in entry['changes'].items():
+                current = latest.metadata.get(family, {})
+                metadata[family] = {}
+                for name, value in family_changes.items():
+                    metadata[family][name] = _merge(copy.deepcopy(current.get(name, None)), value)
+            latest._send_metadata(metadata)
+            for file in entry['files']:
+                file._metadata_uploaded()
+            count += 1
+            merged += entry['requests'] - 1
+
+        with self._lock:
+            self.sent += count
+            self.saved += merged
+        with _totals_lock:
+            _totals['sent'] += count
+        if count:
+            logger.debug('Flushed metadata of %d files', count)
+        return count
+
+
+def diff(new: Dict, old: Optional[Dict]) -> Dict:
+    """ Get the keys of a nested dictionary that were added or changed """
+    if old is None:
+        return copy.deepcopy(new)
+    result = {}
+    for key, value in new.items():
+        previous = old.get(key, _MISSING)
+        if isinstance(value, dict) and isinstance(previous, dict):
+            nested = diff(value, previous)
+            if nested:
+                result[key] = nested
+        elif previous is _MISSING or value != previous:
+            result[key] = copy.deepcopy(value)
+    return result
+
+
+def _merge(dest: Any, src: Any) -> Any:
+    if not isinstance(src, dict) or not isinstance(dest, dict):
+        return src
+    for key, value in src.items():
+        dest[key] = _merge(dest.get(key, None), value)
+    return dest
+
+
+@contextlib.contextmanager
+def buffered_metadata() -> Iterator[MetadataWriter]:
+    """ Buffer the metadata uploads until the end of this context
+
+    The buffered changes are sent when the context ends, even when it ends
+    with an exception. Contexts can be nested: the inner context sends its
+    changes when it ends.
+    """
+    previous = getattr(_state, 'writer', None)
+    writer = MetadataWriter()
+    _state.writer = writer
+    error = False
+    try:
+        yield writer
+    except BaseException:
+        error = True
+        raise
+    finally:
+        _state.writer = previous
+        try:
+            writer.flush()
+            if writer.requested:
+                logger.debug('Sent %d metadata requests instead of %d',
+                             writer.sent, writer.requested)
+        except Exception:
+            if not error:
+                raise
+            # Do not hide the original exception
+            logger.warning('Failed to send buffered metadata', exc_info=True)
+
+
+def current_metadata_writer() -> Optional[MetadataWriter]:
+    """Get the writer of the current :py:func:`buffered_metadata` context, if any"""
+    return getattr(_state, 'writer', None)
+
+
+def metadata_writer_stats() -> Dict[str, int]:
+    """ Get the number of metadata uploads requested and sent by this process
+
+    Only the uploads inside :py:func:`buffered_metadata` contexts are
+    counted. Uploads that are still buffered count as saved until they are
+    sent.
+    """
+    with _totals_lock:
+        stats = dict(_totals)
+    stats['saved'] = stats['requested'] - stats['sent']
+    return stats
@@ -1,9 +1,15 @@
 import collections
+import contextlib
 import copy
 import functools
+import hashlib
 import logging
+import os
 import pathlib
-from typing import Optional, Dict, Any
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional
 
 from prefect import context
 from prefect.client import Secret
@@ -11,10 +17,21 @@ from quetzal.client import helpers, Configuration
 from quetzal.client.utils import get_data_dir
 
 from iguazu.core.files import FileAdapter, QuetzalURL
+from iguazu.core.files.cache import default_cache
+from iguazu.core.files.checksums import record_checksum, stat_signature
+from iguazu.core.files.metadata import current_metadata_writer, diff as metadata_diff
+from iguazu.core.quetzal_client import api_call, get_client
 from iguazu.utils import mapping_issubset
 
 logger = logging.getLogger(__name__)
 
+METADATA_PREFETCH_BATCH_SIZE = 500
+"""Number of file ids requested on each query of
+:py:meth:`QuetzalFile.prefetch_metadata`."""
+
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+"""Number of bytes read from the network at once when downloading a file."""
+
 
 class QuetzalFile(FileAdapter):
     # """
@@ -64,6 +81,15 @@ class QuetzalFile(FileAdapter):
         self._workspace_id = workspace_id
         self._temporary = temporary
         self._metadata = collections.defaultdict(dict, metadata or {})
+        # Whether the metadata was prefetched, in which case it is sent along
+        # with the pickled file (e.g. to a dask worker)
+        self._metadata_prefetched = False
+        # Metadata as it was downloaded, used to send only its changes when
+        # metadata uploads are buffered (see iguazu.core.files.metadata)
+        self._metadata_snapshot = None
+        # Whether this instance holds a reference to its local path on the
+        # download cache (see iguazu.core.files.cache)
+        self._cache_referenced = False
         if temporary:
             self._root = context.temp_dir
             self._url = context.temp_url
@@ -77,9 +103,16 @@ class QuetzalFile(FileAdapter):
         logger.debug('Searching Quetzal file on workspace %s '
                      'with filename %s path %s and metadata %s',
                      workspace_id or 'global', filename, path, metadata)
+        recorded = getattr(_recorded_finds, 'requests', None)
+        if recorded is not None:
+            recorded.append(dict(filename=filename, path=path, metadata=metadata,
+                                 workspace_id=workspace_id))
+            return None
+
         client = quetzal_client_from_secret()
-        candidates = helpers.file.find(client, wid=workspace_id,
-                                       filename=filename, path=path)
+        with api_call('find'):
+            candidates = helpers.file.find(client, wid=workspace_id,
+                                           filename=filename, path=path)
 
         if candidates:
             most_recent_detail = max(candidates, key=lambda d: d.date)
@@ -113,7 +146,100 @@ class QuetzalFile(FileAdapter):
         logger.debug('Attempting to retrieve Quetzal file %s from workspace %s',
                      file_id, workspace_id)
         client = quetzal_client_from_secret()
-        meta = helpers.file.metadata(client, file_id, wid=workspace_id)
+        with api_call('retrieve'):
+            meta = helpers.file.metadata(client, file_id, wid=workspace_id)
+        return QuetzalFile.from_metadata(meta, workspace_id=workspace_id)
+
+    @staticmethod
+    def retrieve_many(*, file_ids: Iterable[str], workspace_id=None,
+                      batch_size: int = METADATA_PREFETCH_BATCH_SIZE) -> Dict[str, Optional['QuetzalFile']]:
+        """ Retrieve many Quetzal files with one query per batch
+
+        This is equivalent to calling :py:meth:`retrieve` for each file id,
+        but the metadata of `batch_size` files is obtained with a single query.
+        Since a query only sees the metadata of the last scan of a workspace,
+        the files modified since then (see :py:func:`file_modified_since_scan`)
+        are not retrieved.
+
+        Returns
+        -------
+        dict
+            Retrieved files (or ``None`` for deleted files, as in
+            :py:meth:`retrieve`) by their id. Ids that were not found or that
+            were modified since the last scan are absent from this dictionary.
+
+        """
+        client = quetzal_client_from_secret()
+        file_ids = [str(file_id) for file_id in file_ids
+                    if not file_modified_since_scan(workspace_id, file_id)]
+        return {
+            str(meta['base']['id']): QuetzalFile.from_metadata(meta, workspace_id=workspace_id)
+            for meta in _query_metadata(client, workspace_id, file_ids, batch_size)
+        }
+
+    @staticmethod
+    def find_many(requests: List[Dict[str, Any]],
+                  batch_size: int = METADATA_PREFETCH_BATCH_SIZE) -> List[Optional['QuetzalFile']]:
+        """ Find many Quetzal files with one query per batch
+
+        This is equivalent to calling :py:meth:`find` for each request, but
+        the candidates of `batch_size` filenames of the same workspace are
+        obtained with a single query. Since a query only sees the files of
+        the last scan of a workspace, a file that is not found here may still
+        be found by :py:meth:`find`.
+
+        Parameters
+        ----------
+        requests
+            Keyword arguments of :py:meth:`find`, one dictionary per file,
+            such as the ones recorded by :py:func:`record_finds`.
+        batch_size
+            Maximum number of filenames per query.
+
+        Returns
+        -------
+        list
+            The file found for each request, or ``None``.
+
+        """
+        filenames = collections.defaultdict(set)
+        for request in requests:
+            filenames[request['workspace_id']].add(request['filename'])
+        if not filenames:
+            return []
+
+        client = quetzal_client_from_secret()
+        candidates = collections.defaultdict(list)
+        for workspace_id, names in filenames.items():
+            for meta in _query_metadata(client, workspace_id, sorted(names), batch_size, key='filename'):
+                base = meta['base']
+                candidates[workspace_id, _normalize_path(base.get('path')), base.get('filename')].append(meta)
+
+        results = []
+        for request in requests:
+            key = (request['workspace_id'], _normalize_path(request['path']), request['filename'])
+            instance = None
+            if candidates[key]:
+                # Like find: only the most recent candidate is considered
+                meta = max(candidates[key], key=lambda m: str(m['base'].get('date', '')))
+                instance = QuetzalFile.from_metadata(copy.deepcopy(meta),
+                                                     workspace_id=request['workspace_id'])
+                if instance is not None and not mapping_issubset(request['metadata'], instance.metadata):
+                    instance = None
+            results.append(instance)
+        logger.debug('Found %d of %d files with batched queries',
+                     sum(r is not None for r in results), len(results))
+        return results
+
+    @staticmethod
+    def from_metadata(meta: Dict[str, Dict[str, Any]], *, workspace_id=None) -> Optional['QuetzalFile']:
+        """ Create a Quetzal file instance from its complete metadata
+
+        Use this when the metadata of the file is already known, for example
+        from the results of a query that selects all the metadata families,
+        to avoid requesting it again. Returns ``None`` for deleted files.
+        """
+        file_id = meta['base']['id']
         filename = meta['base']['filename']
         path = meta['base']['path']
         state = meta['base']['state']
@@ -127,12 +253,12 @@ class QuetzalFile(FileAdapter):
         # ...and then complete its file_id and metadata
         instance._file_id = file_id
         instance._metadata.update(meta)  # Re-use previous results to avoid an extra request
+        instance._metadata_snapshot = copy.deepcopy(meta)
 
         # ...finally, just check that the instance _local_path is not pointing
         # to old data to avoid confusion
         if instance._local_path.exists():
-            with instance._local_path.open('rb') as fd:
-                local_is_valid = instance.checksum(fd)
+            local_is_valid = instance.checksum_local(instance._local_path)
             if not local_is_valid:
                 logger.debug('File %s already exists locally in %s,'
                              'but its size and checksum differ from Quetzal '
@@ -140,10 +266,75 @@ class QuetzalFile(FileAdapter):
                 instance._local_path.unlink()
         return instance
 
+    @staticmethod
+    def prefetch_metadata(files: Iterable['QuetzalFile'],
+                          batch_size: int = METADATA_PREFETCH_BATCH_SIZE) -> int:
+        """ Download the metadata of many files with one query per batch
+
+        Accessing the :py:attr:`metadata` of a file downloads its metadata
+        with one request per file. Use this function before accessing the
+        metadata of many files to download them with one query for each
+        `batch_size` files of the same workspace instead.
+
+        Prefetched metadata is kept when the file is pickled, so that it
+        reaches the workers of a mapped task. Files whose metadata has local
+        changes that were not uploaded yet are skipped, so that these changes
+        are not lost. Since a query only sees the metadata of the last scan of
+        a workspace, the files modified since then (see
+        :py:func:`file_modified_since_scan`) are skipped as well: they
+        download their own metadata when it is needed.
+
+        Parameters
+        ----------
+        files
+            Files whose metadata will be downloaded. Anything else than a
+            :py:class:`QuetzalFile` known to Quetzal is ignored.
+        batch_size
+            Maximum number of file ids per query.
+
+        Returns
+        -------
+        int
+            Number of files whose metadata was downloaded.
+
+        """
+        files_by_workspace = collections.defaultdict(lambda: collections.defaultdict(list))
+        for file in files:
+            if isinstance(file, QuetzalFile) and file._file_id is not None:
+                files_by_workspace[file._workspace_id][str(file._file_id)].append(file)
+        if not files_by_workspace:
+            return 0
+
+        client = quetzal_client_from_secret()
+        prefetched = set()
+        for workspace_id, files_by_id in files_by_workspace.items():
+            file_ids = [file_id for file_id in files_by_id
+                        if not file_modified_since_scan(workspace_id, file_id)]
+            for meta in _query_metadata(client, workspace_id, file_ids, batch_size):
+                for file in files_by_id.get(str(meta['base']['id']), []):
+                    if file._metadata and metadata_diff(dict(file._metadata), file._metadata_snapshot):
+                        logger.debug('Metadata of %s has local changes, not prefetching it', file)
+                        continue
+                    file._metadata.clear()
+                    file._metadata.update(copy.deepcopy(meta))
+                    file._metadata_prefetched = True
+                    file._metadata_snapshot = copy.deepcopy(meta)
+                    prefetched.add(id(file))
+
+        logger.debug('Prefetched metadata of %d files', len(prefetched))
+        return len(prefetched)
+
     @property
     def file(self) -> pathlib.Path:
         if not self._local_path.exists():
             self.download_data()
+        elif self._file_id is not None and not self._cache_referenced:
+            # Downloaded by another instance or process: make sure that it is
+            # not removed while this instance uses it
+            cache = default_cache()
+            if cache is not None:
+                cache.acquire(self._local_path)
+                self._cache_referenced = True
         return self._local_path
 
     @property
@@ -194,20 +385,36 @@ class QuetzalFile(FileAdapter):
             raise RuntimeError('Cannot upload if file does not exist')
         else:
             logger.debug('Uploading file %s to Quetzal', self._local_path)
+            signature = stat_signature(self._local_path)
             with self._local_path.open('rb') as fd:
                 if self._url.path:
                     fullpath = '/'.join([self._url.path, self.dirname])
                 else:
                     fullpath = self.dirname
-                details = helpers.workspace.upload(self.client, self.workspace_id, fd,
-                                                   path=fullpath,
-                                                   temporary=self._temporary)
+                with api_call('upload'):
+                    details = helpers.workspace.upload(self.client, self.workspace_id, fd,
+                                                       path=fullpath,
+                                                       temporary=self._temporary)
+            mark_workspace_modified(self.workspace_id)
             self._file_id = details.id
+            # Quetzal computed the checksum of the uploaded bytes: save it so
+            # that the local copy is not read again to verify it
+            if details.checksum and details.size == signature[0]:
+                record_checksum(self._local_path, details.checksum, signature)
             logger.debug('File was successfully uploaded and now is id=%s', self._file_id)
 
     def upload_metadata(self):
+        writer = current_metadata_writer()
+        if writer is not None and self._file_id is not None:
+            logger.debug('Buffering metadata of file %s', self._file_id)
+            writer.add(self, metadata_diff(self.metadata, self._metadata_snapshot))
+            self._metadata_snapshot = copy.deepcopy(dict(self._metadata))
+            return
         logger.debug('Uploading metadata of file %s', self._file_id)
-        metadata = copy.deepcopy(self.metadata)
+        self._send_metadata(copy.deepcopy(self.metadata))
+        self._metadata_uploaded()
+
+    def _send_metadata(self, metadata: Dict[str, Dict[str, Any]]):
         for family in metadata:
             if 'id' in metadata[family]:
                 # The id metadata is not modifyable
@@ -215,9 +422,15 @@ class QuetzalFile(FileAdapter):
             if family == 'base':
                 # The base family only admits changes in path and filename
                 metadata[family] = {k: v for k, v in metadata[family].items() if k in ('path', 'filename')}
-        helpers.workspace.update_metadata(self.client, self._workspace_id, self._file_id, metadata)
+        with api_call('update_metadata'):
+            helpers.workspace.update_metadata(self.client, self._workspace_id, self._file_id, metadata)
+        mark_file_modified(self._workspace_id, self._file_id)
+
+    def _metadata_uploaded(self):
         # unset the metadata so that next time it is refreshed
         self._metadata.clear()
+        self._metadata_prefetched = False
+        self._metadata_snapshot = None
 
     def delete(self):
         logger.debug('Deleting file %s from Quetzal', self)
@@ -226,52 +439,142 @@ class QuetzalFile(FileAdapter):
                          self._local_path)
             self._local_path.unlink()
         if self._file_id is not None:
+            writer = current_metadata_writer()
+            if writer is not None:
+                writer.discard(self)
             logger.debug('Sending request to delete to workspace %s', self._workspace_id)
-            helpers.file.delete(self.client, self._file_id, self._workspace_id)
+            with api_call('delete'):
+                helpers.file.delete(self.client, self._file_id, self._workspace_id)
+            mark_workspace_modified(self._workspace_id)
             self._file_id = None
         self._metadata.clear()
+        self._metadata_prefetched = False
+        self._metadata_snapshot = None
 
     def clean(self):
         logger.debug('Cleaning file %s from disk', self)
-        if self._local_path.exists():
+        cache = default_cache()
+        if cache is not None:
+            # Other instances or processes may still use the local file
+            removed = cache.release(self._local_path, referenced=self._cache_referenced)
+            self._cache_referenced = False
+            logger.debug('File %s %s', self._local_path,
+                         'deleted' if removed else 'kept because it is still used')
+        elif self._local_path.exists():
             logger.debug('Deleting file %s', self._local_path.resolve())
             self._local_path.unlink()
         else:
             logger.debug('No need to delete file %s : it does not exist',
                          self._local_path.resolve())
 
+    def detach(self):
+        """ Release the download cache reference of this instance
+
+        Unlike :py:meth:`clean`, the local file is kept, but it may be removed
+        when other instances that use it are cleaned. This does nothing when
+        the download cache is disabled.
+        """
+        cache = default_cache()
+        if cache is not None and self._cache_referenced:
+            cache.release(self._local_path, remove=False)
+        self._cache_referenced = False
+
     def download_data(self):
         if self._file_id is not None:  # Just a debug message
             logger.debug('Attempting to download file %s', self._file_id)
         if self._file_id is not None and not self._local_path.exists():
             # File exists in quetzal
             logger.debug('Downloading %s -> %s', self._file_id, self._local_path)
-            helpers.file.download(self.client,
-                                  self._file_id,
-                                  self._workspace_id,
-                                  output=self._local_path)
+            base = self.metadata['base']
+            cache = default_cache()
+            if cache is not None:
+                cache.fetch(base['checksum'], base['size'], self._local_path,
+                            self._stream_download)
+                self._cache_referenced = True
+            else:
+                self._stream_download(self._local_path)
+            record_checksum(self._local_path, base['checksum'])
             logger.debug('Downloaded %s -> %s', self._file_id, self._local_path)
         else:
             # File does not exist in quetzal, it is probably a new file
             # ... here, just create the directory structure
             self._local_path.parent.mkdir(parents=True, exist_ok=True)
 
+    def _stream_download(self, target: pathlib.Path):
+        """ Download the file contents, verifying them while they are written
+
+        Unlike :py:func:`quetzal.client.helpers.file.download`, the contents
+        are not held in memory and the file is not read again to verify its
+        checksum. The contents are written to a temporary file, which is only
+        renamed to `target` when its checksum is correct. Each download has its
+        own temporary file, so that concurrent downloads of the same file
+        (e.g. by a prefetch thread and another process) do not overwrite each
+        other.
+        """
+        base = self.metadata['base']
+        if self._workspace_id is None:
+            func = functools.partial(self.client.public_file_details, uuid=self._file_id)
+        else:
+            func = functools.partial(self.client.workspace_file_details,
+                                     wid=self._workspace_id, uuid=self._file_id)
+
+        target.parent.mkdir(parents=True, exist_ok=True)
+        md5 = hashlib.md5()
+        size = 0
+        fd = tempfile.NamedTemporaryFile(dir=str(target.parent), prefix=target.name + '.',
+                                         suffix='.partial', delete=False)
+        partial = pathlib.Path(fd.name)
+        try:
+            with fd, api_call('download'):
+                response = func(_accept='application/octet-stream', _preload_content=False)
+                try:
+                    for chunk in response.stream(DOWNLOAD_CHUNK_SIZE):
+                        md5.update(chunk)
+                        size += len(chunk)
+                        fd.write(chunk)
+                finally:
+                    response.release_conn()
+        except BaseException:
+            partial.unlink()
+            raise
+
+        if (md5.hexdigest(), size) != (base['checksum'], base['size']):
+            partial.unlink()
+            logger.warning('File %s was downloaded in %s but is corrupted',
+                           self._file_id, target)
+            raise ValueError('Download resulted in corrupted local file')
+        # Temporary files are only readable by their owner
+        os.chmod(str(partial), 0o644)
+        partial.replace(target)
+
     def download_metadata(self):
         if self._file_id is not None:
-            quetzal_metadata = helpers.file.metadata(self.client, self._file_id, self._workspace_id)
+            with api_call('retrieve'):
+                quetzal_metadata = helpers.file.metadata(self.client, self._file_id, self._workspace_id)
             self._metadata.clear()
             self._metadata.update(quetzal_metadata)
+            self._metadata_snapshot = copy.deepcopy(quetzal_metadata)
 
     def __getstate__(self):
         state = self.__dict__.copy()
         del state['_client']
-        del state['_metadata']
+        # Metadata is not pickled, so that it is downloaded again when needed,
+        # unless it was prefetched
+        if state.pop('_metadata_prefetched', False):
+            state['_metadata'] = dict(self._metadata)
+        else:
+            del state['_metadata']
+            state.pop('_metadata_snapshot', None)
         return state
 
     def __setstate__(self, state):
+        metadata = state.pop('_metadata', {})
+        state.setdefault('_metadata_snapshot', None)
         self.__dict__.update(state)
         self._client = None
-        self._metadata = collections.defaultdict(dict)
+        self._metadata = collections.defaultdict(dict, metadata)
+        self._metadata_prefetched = False
+        self._cache_referenced = False
 
     def __repr__(self):
         base_metadata = self.metadata.get('base', {})
@@ -290,6 +593,50 @@ class QuetzalFile(FileAdapter):
         return (self._file_id, self._workspace_id) == (other._file_id, other._workspace_id)
 
 
+def _query_metadata(client, workspace_id, values, batch_size, key='id'):
+    """Get the metadata of many files, with one query for each batch of base `key` values"""
+    values = [str(v) for v in values]
+    for start in range(0, len(values), batch_size):
+        batch = values[start:start + batch_size]
+        value_list = ', '.join("'" + v.replace("'", "''") + "'" for v in batch)
+        query = f"SELECT * FROM metadata WHERE base->>'{key}' IN ({value_list})"
+        logger.debug('Querying metadata of %d files from workspace %s',
+                     len(batch), workspace_id or 'global')
+        # Ids are unique: the results fit in as many rows as the batch, so
+        # they are not requested in pages of the default size
+        limit = len(batch) if key == 'id' else None
+        with api_call('query'):
+            rows, _ = helpers.query(client, workspace_id, query, 'postgresql_json', limit=limit)
+        for row in rows:
+            meta = {family: values for family, values in row.items() if values is not None}
+            if 'id' in meta.get('base', {}):
+                yield meta
+
+
+def _normalize_path(path: Optional[str]) -> str:
+    return str(path or '').strip('/')
+
+
+_recorded_finds = threading.local()
+
+
+@contextlib.contextmanager
+def record_finds() -> Iterator[List[Dict[str, Any]]]:
+    """ Record the calls to :py:meth:`QuetzalFile.find` of this thread
+
+    Inside this context, :py:meth:`QuetzalFile.find` does not send any
+    request and always returns ``None``. Its keyword arguments are appended
+    to the list returned by this context, so that they can be sent later as
+    a batch with :py:meth:`QuetzalFile.find_many`.
+    """
+    previous = getattr(_recorded_finds, 'requests', None)
+    _recorded_finds.requests = []
+    try:
+        yield _recorded_finds.requests
+    finally:
+        _recorded_finds.requests = previous
+
+
 def quetzal_client_from_secret():
     default_config = Configuration()
     quetzal_kws = dict(
@@ -305,28 +652,21 @@ def quetzal_client_from_secret():
                      'QUETZAL_CLIENT_KWARGS due to the following exception: %s '
                      'Falling back to environment variable-based client',
                      ex)
-    return _memo_quetzal_client(**quetzal_kws)
-
-
-@functools.lru_cache(maxsize=1024)
-def _memo_quetzal_client(**kwargs):
-    """A memorized client from its kwargs
-
-    This re-usability of Quetzal clients is important when one has a flow that
-    uses many tasks that interact with Quetzal. Eventually, the system may run
-    out of available connections (in reality they are socket files) and any
-    Quetzal operation will fail with a weird NewConnectionError exception
-    """
-    return helpers.get_client(**kwargs)
+    # Re-using the same client is important when a flow has many tasks that
+    # interact with Quetzal: otherwise, the system may run out of available
+    # connections (in reality they are socket files) and any Quetzal operation
+    # will fail with a weird NewConnectionError exception
+    return get_client(**quetzal_kws)
 
 
 @functools.lru_cache(maxsize=1024)
 def resolve_workspace_name(name: str) -> int:
     logger.debug('Resolving Quetzal workspace name %s...', name)
     client = quetzal_client_from_secret()
-    details, total = helpers.workspace.list_(client,
-                                             name=name,
-                                             deleted=False)
+    with api_call('list_workspaces'):
+        details, total = helpers.workspace.list_(client,
+                                                 name=name,
+                                                 deleted=False)
     if total == 0:
         raise RuntimeError(f'No workspace named "{name}" was found')
     elif total > 1:
@@ -334,3 +674,112 @@ def resolve_workspace_name(name: str) -> int:
                            f'{len(total)} workspaces with the same name...')
 
     return details[0]['id']
+
+
+_modified_files: Dict[str, float] = {}
+_modified_files_lock = threading.Lock()
+
+
+def _workspace_marker(workspace_id: Optional[int], kind: str) -> Optional[pathlib.Path]:
+    temp_dir = context.get('temp_dir', None)
+    if workspace_id is None or not temp_dir:
+        return None
+    return pathlib.Path(temp_dir) / 'cache' / 'quetzal' / f'workspace-{workspace_id}.{kind}'
+
+
+def _touch(marker: Optional[pathlib.Path]) -> None:
+    if marker is None:
+        return
+    try:
+        marker.parent.mkdir(parents=True, exist_ok=True)
+        marker.touch()
+        # touch does not update the modification time of an existing file
+        # on all platforms
+        os.utime(str(marker))
+    except OSError:
+        logger.debug('Could not update workspace marker %s', marker, exc_info=True)
+
+
+def mark_workspace_modified(workspace_id: Optional[int]) -> None:
+    """ Record that a workspace has been modified since its last scan
+
+    The record is a file in the ``cache`` directory of the ``temp_dir`` of the
+    prefect context, so that other processes on the same machine see it.
+    Nothing is recorded outside a context with a ``temp_dir``.
+    """
+    _touch(_workspace_marker(workspace_id, 'modified'))
+
+
+def mark_workspace_scanned(workspace_id: Optional[int]) -> None:
+    """Record that a workspace has just been scanned"""
+    _touch(_workspace_marker(workspace_id, 'scanned'))
+
+
+def _file_marker(workspace_id: Optional[int], file_id: Any) -> Optional[pathlib.Path]:
+    marker = _workspace_marker(workspace_id, 'files')
+    if marker is None:
+        return None
+    return marker / f'{file_id}.modified'
+
+
+def mark_file_modified(workspace_id: Optional[int], file_id: Any) -> None:
+    """ Record that the metadata of a file has been modified since the last scan
+
+    The workspace is marked as modified as well (see
+    :py:func:`mark_workspace_modified`). The record is kept by this process
+    and, like the workspace records, in the ``temp_dir`` of the prefect
+    context.
+    """
+    with _modified_files_lock:
+        _modified_files[str(file_id)] = time.time()
+    _touch(_file_marker(workspace_id, file_id))
+    mark_workspace_modified(workspace_id)
+
+
+def file_modified_since_scan(workspace_id: Optional[int], file_id: Any) -> bool:
+    """ Whether the metadata of a file was modified after the last scan of its workspace
+
+    When the workspace has no recorded scan, any recorded modification is
+    considered to be more recent. As with :py:func:`workspace_scan_is_fresh`,
+    only the modifications done by Iguazu on this machine are known.
+    """
+    modified_at = _modified_files.get(str(file_id), None)
+    marker = _file_marker(workspace_id, file_id)
+    if marker is not None and marker.exists():
+        modified_at = max(modified_at or 0, marker.stat().st_mtime)
+    if modified_at is None:
+        return False
+    scanned = _workspace_marker(workspace_id, 'scanned')
+    if scanned is None or not scanned.exists():
+        return True
+    return modified_at >= scanned.stat().st_mtime
+
+
+def workspace_last_change(workspace_id: Optional[int]) -> Optional[float]:
+    """ Get the time of the last known modification of a workspace
+
+    Returns ``None`` when no modification was recorded.
+    """
+    marker = _workspace_marker(workspace_id, 'modified')
+    if marker is None or not marker.exists():
+        return None
+    return marker.stat().st_mtime
+
+
+def workspace_scan_is_fresh(workspace_id: Optional[int], max_age: float) -> bool:
+    """ Whether the last scan of a workspace can be reused
+
+    This is the case when the workspace was scanned less than `max_age`
+    seconds ago and no modification was recorded since then by
+    :py:func:`mark_workspace_modified`. Since only the modifications done by
+    Iguazu on this machine are recorded, `max_age` bounds how long the changes
+    made elsewhere can go unnoticed.
+    """
+    marker = _workspace_marker(workspace_id, 'scanned')
+    if max_age <= 0 or marker is None or not marker.exists():
+        return False
+    scanned_at = marker.stat().st_mtime
+    if time.time() - scanned_at > max_age:
+        return False
+    modified_at = workspace_last_change(workspace_id)
+    return modified_at is None or modified_at < scanned_at
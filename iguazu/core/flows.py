@@ -1,21 +1,43 @@
 import inspect
 import logging
-import pathlib
+import os
+import sqlite3
+from typing import Any, Dict
 
 import prefect
 
-from iguazu.utils import (
-    all_subclasses, import_submodules, load_pickle, dump_pickle
-)
+from iguazu.core.runners import IguazuFlowRunner
+from iguazu.core.state_cache import flow_state_cache
+from iguazu.utils import all_subclasses, import_submodules
 
 
 logger = logging.getLogger(__name__)
 
 
+CPU_BOUND_EXECUTOR_DEFAULTS = {
+    # One single-threaded process per CPU, since most of the work holds the GIL
+    'processes': dict(workers=None, threads_per_worker=1, memory_limit='4GB'),
+    'threads': dict(workers=None),
+}
+"""Recommended executor parameters for flows that spend most of their time
+processing signals. A ``None`` number of workers means one per CPU."""
+
+IO_BOUND_EXECUTOR_DEFAULTS = {
+    'processes': dict(workers=4, threads_per_worker=8, memory_limit='auto'),
+    'threads': dict(workers=32),
+}
+"""Recommended executor parameters for flows that spend most of their time
+waiting for Quetzal, Typeform or the disk."""
+
+
 class PreparedFlow(prefect.Flow):
 
     REGISTRY_NAME = None
 
+    EXECUTOR_DEFAULTS = CPU_BOUND_EXECUTOR_DEFAULTS
+    """Recommended executor parameters of this flow for each executor type
+    (see ``iguazu flows run --executor-type``)."""
+
     def __init__(self, *args, **kwargs):
         # Separate kwargs of prefect.Flow
         prefect_params = inspect.getfullargspec(prefect.Flow.__init__).args
@@ -34,6 +56,18 @@ class PreparedFlow(prefect.Flow):
     def click_options():
         return tuple()
 
+    @classmethod
+    def executor_defaults(cls, executor_type: str) -> Dict[str, Any]:
+        """Get the recommended executor parameters of this flow
+
+        Returns an empty dictionary for executor types without recommended
+        parameters.
+        """
+        defaults = dict(cls.EXECUTOR_DEFAULTS.get(executor_type, {}))
+        if 'workers' in defaults and defaults['workers'] is None:
+            defaults['workers'] = os.cpu_count() or 1
+        return defaults
+
 
 def _get_flow_registry():
     # Force the import of all flows, so that the all_subclasses call later
@@ -64,35 +98,22 @@ def execute_flow(func, func_kwargs, executor, context_args, use_cache):
         if p not in known_parameters or flow_parameters[p] is None:
             flow_parameters.pop(p)
 
-    # Read cached states from a local file
-    cache_filename = (
-            pathlib.Path(context_args['temp_dir']) /
-            'cache' /
-            'task_states.pickle'
-    )
+    # Cached states are read and saved incrementally on a local database
     context_args.setdefault('caches', {})
     if use_cache:
+        cache = flow_state_cache(context_args['temp_dir'])
         try:
-            logger.info('Trying to restore previous cache from %s', cache_filename)
-            previous_cache = load_pickle(cache_filename, None) or {}
-            logger.info('Restored cached had %d elements', len(previous_cache))
-            context_args['caches'] = previous_cache
-        except:
-            logger.warning('Could not read cache at %s', cache_filename, exc_info=True)
-
-    with prefect.context(**context_args) as context:
+            expired = cache.expire()
+            logger.info('Using cache at %s (%d expired states removed)', cache.path, expired)
+            context_args['caches'] = cache
+        except (sqlite3.Error, OSError):
+            logger.warning('Could not open cache at %s', cache.path, exc_info=True)
+
+    with prefect.context(**context_args):
         flow_state = flow.run(parameters=flow_parameters,
                               executor=executor,
+                              runner_cls=IguazuFlowRunner,
                               run_on_schedule=True)
-        cache = context.caches
-
-    if use_cache and cache:
-        # Save cached states to a local file
-        try:
-            logger.info('Saving cache with %d elements to %s', len(cache), cache_filename)
-            dump_pickle(cache, cache_filename)
-        except:
-            logger.warning('Could not save cache to %s', cache_filename, exc_info=True)
 
     return flow, flow_state
 
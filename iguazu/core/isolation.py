@@ -0,0 +1,172 @@
+"""
+Execution of task code in an isolated subprocess
+
+Some Iguazu tasks call C code that never releases the Python global
+interpreter lock, such as cvxEDA. On a dask worker with several threads, this
+stalls the worker heartbeats and all the other tasks. This module runs a
+function on a forked child process so that the worker process only waits on a
+pipe, which releases the GIL. The child can also be limited in time and
+memory, so that a runaway computation is killed instead of the worker.
+
+The result of the function, or the exception that it raised, is pickled back
+to the parent through the pipe. Dataframes that the function saved in a
+:py:func:`iguazu.core.dataframes.shared_dataframes` context (i.e. inside a
+:py:class:`iguazu.core.pipelines.FusedPipeline`) are sent back too, so that
+the next stages do not need to read them again. The Quetzal calls of the
+child are added to the call accounting of the parent (see
+:py:func:`iguazu.core.quetzal_client.account_calls`), and its spans to the
+trace of the parent (see :py:mod:`iguazu.core.tracing`).
+
+Note that any other side effect of the function on the parent process
+objects (e.g. modifying the task instance or an input file adapter) is lost.
+The child is created with the *fork* start method, which inherits the prefect
+context, but which is only available on Unix. Since only the forking thread
+exists in the child, a lock held by another thread of the parent when it
+forked (e.g. in a connection pool) is never released in the child: give the
+child a `timeout` so that it is killed instead of waiting forever. Dask workers started by a nanny
+are daemonic processes, which cannot have children unless the dask
+configuration sets ``distributed.worker.daemon: false``.
+"""
+
+import logging
+import multiprocessing
+import os
+import pickle
+import resource
+import traceback
+from typing import Any, Callable, Optional
+
+from iguazu.core import tracing
+from iguazu.core.dataframes import current_shared_dataframes
+from iguazu.core.exceptions import SubprocessFailed, SubprocessTimeout
+from iguazu.core.files.metadata import buffered_metadata
+from iguazu.core.profiling import current_profile, measure
+from iguazu.core.quetzal_client import account_calls, current_call_accounting
+
+logger = logging.getLogger(__name__)
+
+
+def run_in_subprocess(func: Callable[[], Any], *,
+                      timeout: Optional[float] = None,
+                      memory_limit: int = 0) -> Any:
+    """ Call a function on a forked child process and get its result
+
+    Parameters
+    ----------
+    func
+        Function without parameters (use :py:func:`functools.partial` if
+        needed). Its result must be picklable.
+    timeout
+        Maximum wall-clock time, in seconds, of the child. ``None`` means no
+        limit.
+    memory_limit
+        Maximum increase, in bytes, of the address space of the child over the
+        address space that it inherits from the parent. Zero means no limit.
+        Allocations over this limit raise a :py:class:`MemoryError` on the
+        child, which is propagated.
+
+    Returns
+    -------
+    The result of ``func()``.
+
+    Raises
+    ------
+    SubprocessTimeout
+        When the child did not finish within `timeout` seconds. The child is
+        killed.
+    SubprocessFailed
+        When the child died without sending a result, for example when it was
+        killed by the operating system.
+    Exception
+        Any exception raised by `func` is raised again on the parent.
+
+    """
+    context = multiprocessing.get_context('fork')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_child_main, args=(sender, func, memory_limit))
+    process.start()
+    # Close the parent copy of the sending end, so that the receiving end gets
+    # an EOF if the child dies
+    sender.close()
+    logger.debug('Started subprocess %d for %s', process.pid, func)
+
+    try:
+        # Note: receive before joining, otherwise a large result fills the
+        # pipe buffer and the child never ends
+        if not receiver.poll(timeout):
+            raise SubprocessTimeout(f'Subprocess {process.pid} did not finish '
+                                    f'in {timeout} seconds')
+        try:
+            success, payload, shared, calls, usage, spans = receiver.recv()
+        except EOFError:
+            process.join()
+            raise SubprocessFailed(f'Subprocess {process.pid} ended without a '
+                                   f'result, with exit code {process.exitcode}') from None
+    finally:
+        if process.is_alive():
+            logger.warning('Killing subprocess %d', process.pid)
+            process.kill()
+        process.join()
+        receiver.close()
+
+    registry = current_shared_dataframes()
+    if registry is not None and shared:
+        registry.update(shared)
+    accounting = current_call_accounting()
+    if accounting is not None:
+        accounting.merge(calls)
+    profile = current_profile()
+    if profile is not None:
+        profile.add_usage(usage)
+    tracing.add_spans(spans)
+
+    if not success:
+        raise payload
+    return payload
+
+
+def _address_space() -> int:
+    try:
+        with open('/proc/self/statm') as fd:
+            pages = int(fd.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return 0
+    return pages * resource.getpagesize()
+
+
+def _child_main(sender, func, memory_limit):
+    if memory_limit > 0:
+        # The limit of the address space counts everything inherited from the
+        # parent, which can be much larger than what the task allocates
+        limit = _address_space() + memory_limit
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    registry = current_shared_dataframes()
+    before = dict(registry or {})
+    with account_calls() as accounting, measure() as usage, tracing.collect_spans() as spans:
+        try:
+            # Metadata uploads buffered on the child would be lost: send them
+            # before the child ends
+            with buffered_metadata():
+                message = (True, func())
+        except BaseException as exc:
+            message = (False, exc)
+
+    shared = {
+        k: v for k, v in (registry or {}).items() if before.get(k, None) is not v
+    }
+    try:
+        sender.send(message + (shared, accounting.summary(), usage, spans))
+    except (pickle.PicklingError, AttributeError, TypeError) as exc:
+        # The result or the exception cannot be pickled. Send a description
+        # of the problem instead, which is always picklable
+        details = ''.join(traceback.format_exception(type(message[1]), message[1],
+                                                     message[1].__traceback__)) if not message[0] else ''
+        error = SubprocessFailed(f'Subprocess result could not be sent to the '
+                                 f'parent process: {exc}\n{details}')
+        sender.send((False, error, {}, accounting.summary(), usage, spans))
+    finally:
+        sender.close()
+        # Skip the cleanup of the objects inherited from the parent process,
+        # which belong to the parent (e.g. temporary directories)
+        os._exit(0)
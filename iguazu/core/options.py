@@ -44,11 +44,103 @@ class TaskOptions:
     managed_inputs_exception_type: Optional[Type] = SoftPreconditionFailed
     """Exception type that will be raised if the automatic input management fails"""
 
+    managed_inputs_cache_size: int = int(os.environ.get('IGUAZU_MANAGED_INPUTS_CACHE_SIZE', '0'))
+    """Memory budget, in bytes, of the process-wide cache of dataframes read
+    by the automatic input management. Tasks that run on the same process
+    (e.g. a dask worker) and read the same HDF5 key of the same file will
+    share the decoded dataframe instead of reading it again. The cache is
+    shared by all tasks, but this budget only bounds the dataframes added by
+    the tasks with the same name as this one. Zero disables the cache for
+    this task. You can set the default value of this task option
+    for ALL tasks with the environment variable
+    IGUAZU_MANAGED_INPUTS_CACHE_SIZE. See
+    :py:class:`iguazu.core.dataframes.DataFrameCache`."""
+
+    memory_budget: int = int(os.environ.get('IGUAZU_MEMORY_BUDGET', '0'))
+    """Memory budget, in bytes, that a task may use for its computations.
+    Tasks that can split their work, such as
+    :py:class:`iguazu.tasks.galvanic.ApplyCVX`, use it to choose how to
+    process their input without exceeding it. Zero means no budget. You can
+    set the default value of this task option for ALL tasks with the
+    environment variable IGUAZU_MEMORY_BUDGET."""
+
+    isolation: Optional[str] = os.environ.get('IGUAZU_ISOLATION', None) or None
+    """Set to ``'subprocess'`` to execute the run method of the task on a
+    forked child process. Use this for tasks that hold the Python global
+    interpreter lock for a long time, so that they do not stall the other
+    threads of a dask worker. ``None`` runs the task on the current thread.
+    You can set the default value of this task option for ALL tasks with the
+    environment variable IGUAZU_ISOLATION. See
+    :py:mod:`iguazu.core.isolation`."""
+
+    isolation_timeout: Optional[float] = float(os.environ.get('IGUAZU_ISOLATION_TIMEOUT', '3600')) or None
+    """Maximum wall-clock time, in seconds, of a task run with
+    ``isolation='subprocess'``. The child process is killed when it exceeds
+    it and the task fails. Since the child is forked from a process with
+    several threads, it can deadlock on a lock that another thread held when
+    it was forked: this limit makes sure that the task fails instead of
+    waiting forever. ``None`` means no limit. You can set the default value
+    of this task option for ALL tasks with the environment variable
+    IGUAZU_ISOLATION_TIMEOUT, where zero means no limit."""
+
+    isolation_memory_limit: int = 0
+    """Maximum increase, in bytes, of the address space (i.e. the virtual
+    memory, not the resident memory) of a task run with
+    ``isolation='subprocess'``, over the address space that the child
+    inherits from its parent. Zero means no limit."""
+
     auto_clean_files: bool = str2bool(os.environ.get('IGUAZU_AUTO_CLEAN_FILES', '0'))
     """Delete input and output files when this tasks finishes.
     This is useful to avoid filling the disk, specially on a cluster. You can
     set the default value of this task option for ALL tasks with the 
     environment variable IGUAZU_AUTO_CLEAN_FILES"""
 
+    buffer_metadata: bool = str2bool(os.environ.get('IGUAZU_BUFFER_METADATA', '1'))
+    """Buffer the metadata uploads of this task and send them when the task
+    finishes, merging the uploads of the same file into one request. You can
+    set the default value of this task option for ALL tasks with the
+    environment variable IGUAZU_BUFFER_METADATA. See
+    :py:mod:`iguazu.core.files.metadata`."""
+
+    prefetch_inputs: int = int(os.environ.get('IGUAZU_PREFETCH_INPUTS', '0'))
+    """Number of input files of the next children of a mapped task to
+    download in background threads while the current children run. Zero
+    disables the prefetch. You can set the default value of this task option
+    for ALL tasks with the environment variable IGUAZU_PREFETCH_INPUTS. See
+    :py:mod:`iguazu.core.prefetch`."""
+
+    prefetch_workers: int = int(os.environ.get('IGUAZU_PREFETCH_WORKERS', '2'))
+    """Maximum number of concurrent downloads of the input prefetch."""
+
+    prefetch_budget: int = int(os.environ.get('IGUAZU_PREFETCH_BUDGET', '0'))
+    """Maximum number of bytes of prefetched input files that are waiting for
+    their child task. Zero means no limit."""
+
+    batch_previous_results: bool = str2bool(os.environ.get('IGUAZU_BATCH_PREVIOUS_RESULTS', '1'))
+    """Look for the previous results of all the children of a mapped task
+    with one Quetzal query per batch before the children are submitted,
+    instead of letting each child look for its own previous results when it
+    verifies its preconditions. Children with previous results are skipped
+    without running. You can set the default value of this task option for
+    ALL tasks with the environment variable IGUAZU_BATCH_PREVIOUS_RESULTS.
+    See :py:meth:`iguazu.core.tasks.Task.find_previous_results`."""
+
+    result_cache: bool = str2bool(os.environ.get('IGUAZU_RESULT_CACHE', '0'))
+    """Save the outputs of this task on a persistent cache keyed by the
+    fingerprint of the task and its inputs, and use them instead of running
+    the task again with the same inputs, even on another flow run. You can
+    set the default value of this task option for ALL tasks with the
+    environment variable IGUAZU_RESULT_CACHE. See
+    :py:mod:`iguazu.core.result_cache`."""
+
+    def __post_init__(self):
+        if self.isolation not in ISOLATION_MODES:
+            raise ValueError(f'Invalid isolation {self.isolation!r}, '
+                             f'it must be one of {ISOLATION_MODES}')
+        if self.prefetch_workers < 1:
+            raise ValueError('prefetch_workers must be at least 1')
+
+
+ISOLATION_MODES = (None, 'subprocess')
 
 ALL_OPTIONS = tuple(f.name for f in fields(TaskOptions))
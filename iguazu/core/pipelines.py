@@ -0,0 +1,173 @@
+"""
+Fused execution of a chain of Iguazu tasks
+
+Most Iguazu feature flows are chains of tasks mapped over the same files,
+where each task writes a HDF5 file that is uploaded, then downloaded and
+decoded again by the next task. When the data backend is remote, these round
+trips can take longer than the processing itself.
+
+A :py:class:`FusedPipeline` runs the whole chain for one file as a single
+Prefect task. Each stage is still a regular :py:class:`iguazu.core.tasks.Task`
+with its own preconditions, graceful failures and metadata journal, but:
+
+* the outputs of intermediate stages are only written locally and are not
+  uploaded, unless they are declared as checkpoints;
+* the dataframes saved with :py:func:`iguazu.functions.specs.store_output` are
+  kept in memory and handed over to the next stages, so they are not
+  decoded again;
+* the previous results of the last stage are searched before running any
+  stage, so that files already processed are skipped without recomputing
+  the intermediate stages.
+
+"""
+
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Mapping, Optional, Sequence
+
+import prefect
+from prefect.engine.signals import ENDRUN
+
+from iguazu.core.dataframes import shared_dataframes
+from iguazu.core.files import FileAdapter
+from iguazu.core.tasks import Task
+from iguazu.helpers.states import GracefulFail, SkippedResult
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PipelineStage:
+    """Definition of a stage of a :py:class:`FusedPipeline`"""
+
+    name: str
+    """Name of this stage. Later stages use it to refer to the output of
+    this stage."""
+
+    task: Task
+    """Iguazu task executed on this stage"""
+
+    inputs: Mapping[str, str] = field(default_factory=dict)
+    """Mapping of the task run parameters to the name of the pipeline input
+    or previous stage that provides its value."""
+
+
+class FusedPipeline(Task):
+    """Run a chain of Iguazu tasks on a single worker
+
+    Use this task to replace a chain of mapped tasks with a single mapped task.
+    For example, instead of::
+
+        clean_signals = clean.map(signals=raw, events=raw)
+        features = extract.map(signals=clean_signals, events=raw)
+
+    One can use::
+
+        pipeline = FusedPipeline(stages=[
+            PipelineStage('clean', clean, dict(signals='raw', events='raw')),
+            PipelineStage('features', extract, dict(signals='clean', events='raw')),
+        ])
+        features = pipeline.map(raw=raw)
+
+    The pipeline returns the output of its last stage. When the last stage
+    has a previous result, the pipeline is skipped with this result before
+    running any stage. When the last stage gracefully fails or is skipped,
+    the pipeline ends with the same state.
+    When an intermediate stage gracefully fails, its default outputs are
+    handed to the next stages, exactly as it happens with separate tasks.
+
+    Parameters
+    ----------
+    stages
+        Sequence of stages, in execution order.
+    checkpoints
+        Names of the intermediate stages whose outputs are uploaded to their
+        backend. The outputs of the last stage are always uploaded.
+
+    """
+
+    def __init__(self, *,
+                 stages: Sequence[PipelineStage],
+                 checkpoints: Optional[Iterable[str]] = None,
+                 **kwargs):
+        super().__init__(**kwargs)
+        if not stages:
+            raise ValueError('A fused pipeline needs at least one stage')
+        self.stages = tuple(stages)
+        self.checkpoints = frozenset(checkpoints or ())
+        names = [stage.name for stage in self.stages]
+        if len(set(names)) != len(names):
+            raise ValueError('Fused pipeline stage names must be unique')
+        unknown = self.checkpoints - set(names)
+        if unknown:
+            raise ValueError(f'Unknown checkpoint stages: {sorted(unknown)}')
+
+    def run(self, **inputs) -> Any:
+        results = dict(inputs)
+        last = self.stages[-1]
+        with shared_dataframes(), prefect.context(pipeline_auto_clean=self._auto_clean_context):
+            for stage in self.stages:
+                missing = [source for source in stage.inputs.values() if source not in results]
+                if missing:
+                    raise ValueError(f'Stage {stage.name} requires {missing}, which are '
+                                     f'neither pipeline inputs nor previous stages')
+                kwargs = {param: results[source] for param, source in stage.inputs.items()}
+                persist = stage is last or stage.name in self.checkpoints
+                self.logger.info('Running fused stage %s (%s) with persist=%s',
+                                 stage.name, type(stage.task).__name__, persist)
+                with prefect.context(persist_outputs=persist):
+                    try:
+                        results[stage.name] = stage.task.run(**kwargs)
+                    except ENDRUN as signal:
+                        if stage is last or not isinstance(signal.state, (GracefulFail, SkippedResult)):
+                            raise
+                        self.logger.info('Fused stage %s ended with state %s, continuing '
+                                         'with its results', stage.name,
+                                         type(signal.state).__name__)
+                        results[stage.name] = signal.state.result
+
+        return results[last.name]
+
+    def preconditions(self, **inputs):
+        # Each stage verifies its own preconditions. In particular, an input
+        # with a failed status makes the first stage gracefully fail with its
+        # default outputs, which are handed to the next stages, exactly as
+        # with separate tasks. Only the previous results of the pipeline,
+        # which are those of its last stage, are verified here, so that the
+        # stages are not run in vain
+        if self.forced or any(stage.task.forced for stage in self.stages):
+            return
+        previous = self._find_previous_result(inputs)
+        if previous is not None:
+            raise ENDRUN(state=SkippedResult(message='Previous results already exist.',
+                                             result=previous))
+
+    def _find_previous_result(self, inputs: Mapping[str, Any]) -> Optional[FileAdapter]:
+        # The default outputs of each stage are the inputs of the default
+        # outputs of the next stages, as if the stages had gracefully failed
+        outputs = dict(inputs)
+        for stage in self.stages:
+            kwargs = {param: outputs.get(source, None) for param, source in stage.inputs.items()}
+            try:
+                with prefect.context(run_kwargs=kwargs):
+                    outputs[stage.name] = stage.task.default_outputs(**kwargs)
+            except Exception:
+                self.logger.debug('Could not determine the default outputs of fused stage %s',
+                                  stage.name, exc_info=True)
+                return None
+
+        last = self.stages[-1]
+        result = outputs[last.name]
+        if isinstance(result, FileAdapter) and last.task._is_previous_result(result):
+            return result
+        return None
+
+    def handle_outputs(self, outputs) -> Any:
+        # Each stage has already handled its outputs: it has set the metadata
+        # journal and uploaded them. Doing it here again would replace the
+        # journal of the last stage with the journal of the pipeline
+        self.postconditions(outputs)
+        return outputs
+
+    def default_outputs(self, **inputs) -> Any:
+        return None
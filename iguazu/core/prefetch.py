@@ -0,0 +1,191 @@
+"""
+Background download of the input files of mapped tasks
+
+Each child of a mapped Iguazu task downloads its input files when it first
+accesses them, so that the network transfer and the computation of the
+children never overlap. When a task sets the
+:py:attr:`iguazu.core.options.TaskOptions.prefetch_inputs` option, the
+:py:class:`iguazu.core.runners.IguazuTaskRunner` creates an
+:py:class:`InputPrefetcher` when the task is mapped. The prefetcher downloads
+the input files of the next children, in their map order, with a pool of
+threads, while the current children compute.
+
+The prefetcher stays a bounded number of files (and, optionally, of bytes)
+ahead of the children that already started. Children report that they
+started when their inputs are prepared by the task runner, which only reaches
+the prefetcher when the children run on the same process as their parent
+task runner, i.e. with the local or threaded executors. With other executors,
+only the first files are prefetched. Files downloaded on the same machine are
+found by the children of any process, in particular with the download cache
+of :py:mod:`iguazu.core.files.cache`.
+"""
+
+import concurrent.futures
+import copy
+import logging
+import threading
+from typing import Dict, List, Optional, Sequence
+
+from iguazu.core.files import FileAdapter, QuetzalFile
+
+logger = logging.getLogger(__name__)
+
+
+class InputPrefetcher:
+    """ Download files in the background, ahead of their consumers
+
+    Parameters
+    ----------
+    files
+        Files in the order in which they will be needed. Only the
+        :py:class:`QuetzalFile` known to Quetzal are downloaded.
+    lookahead
+        Maximum number of files downloaded (or being downloaded) that were not
+        consumed yet.
+    workers
+        Maximum number of concurrent downloads.
+    budget
+        Maximum number of bytes of downloaded files that were not consumed
+        yet. Zero means no limit. At least one file is always prefetched.
+
+    """
+
+    def __init__(self, files: Sequence[FileAdapter], *,
+                 lookahead: int, workers: int = 2, budget: int = 0):
+        self.lookahead = lookahead
+        self.budget = budget
+        self._files: List[QuetzalFile] = []
+        self._positions: Dict[str, int] = {}
+        for file in files:
+            if not isinstance(file, QuetzalFile) or file.id is None:
+                continue
+            key = _key(file)
+            if key not in self._positions:
+                self._positions[key] = len(self._files)
+                self._files.append(file)
+        self._futures: Dict[int, concurrent.futures.Future] = {}
+        self._sizes: Dict[int, int] = {}
+        self._next = 0
+        self._consumed = 0
+        self._pending_bytes = 0
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers,
+                                                               thread_name_prefix='iguazu-prefetch')
+        self._known_sizes: Dict[int, int] = {}
+        self._read_sizes(0)
+        with self._lock:
+            self._fill()
+
+    @property
+    def done(self) -> bool:
+        """Whether all the files have been consumed"""
+        return self._consumed >= len(self._files)
+
+    def consumed(self, file: FileAdapter) -> None:
+        """ Notify that a file is needed now
+
+        Waits until the file is downloaded if its download already started,
+        so that it is not downloaded twice, then starts the download of the
+        next files.
+        """
+        position = self._positions.get(_key(file)) if isinstance(file, QuetzalFile) else None
+        if position is None:
+            return
+        future = self._futures.get(position, None)
+        if future is not None:
+            try:
+                future.result()
+            except Exception:
+                # Not a problem: the consumer will download the file itself
+                logger.warning('Failed to prefetch %s', file, exc_info=True)
+
+        self._read_sizes(max(self._consumed, position + 1))
+        with self._lock:
+            if position in self._sizes:
+                self._pending_bytes -= self._sizes.pop(position)
+            self._consumed = max(self._consumed, position + 1)
+            self._fill()
+        if self.done:
+            self.close()
+
+    def close(self) -> None:
+        """Cancel the downloads that did not start yet"""
+        for future in self._futures.values():
+            future.cancel()
+        self._executor.shutdown(wait=False)
+
+    def _read_sizes(self, start: int) -> None:
+        # Reading the metadata may need a request: do it before taking the
+        # lock, for the files that the next _fill may submit
+        for position in range(start, min(start + self.lookahead, len(self._files))):
+            if position not in self._known_sizes:
+                file = self._files[position]
+                self._known_sizes[position] = file.metadata.get('base', {}).get('size', 0) or 0
+
+    def _fill(self) -> None:
+        # Note: must be called with the lock held
+        self._next = max(self._next, self._consumed)
+        while self._next < len(self._files) and self._next < self._consumed + self.lookahead:
+            size = self._known_sizes.get(self._next, None)
+            if size is None:
+                # Another consumer moved the window: it fills the rest
+                break
+            if self.budget > 0 and self._pending_bytes > 0 and self._pending_bytes + size > self.budget:
+                break
+            self._sizes[self._next] = size
+            self._pending_bytes += size
+            self._futures[self._next] = self._executor.submit(_download, self._files[self._next])
+            self._next += 1
+
+
+def _key(file: QuetzalFile) -> str:
+    return str(file._local_path)
+
+
+def _download(file: QuetzalFile) -> None:
+    # Download with a copy, so that the cache reference (if any) of the
+    # prefetch does not become the reference of the consumer
+    worker_copy = copy.copy(file)
+    worker_copy._metadata = copy.deepcopy(file._metadata)
+    logger.debug('Prefetching %s', file)
+    worker_copy.file
+    worker_copy.detach()
+
+
+_prefetchers: Dict[str, InputPrefetcher] = {}
+_prefetchers_lock = threading.Lock()
+
+
+def start_prefetch(key: str, files: Sequence[FileAdapter], *, lookahead: int,
+                   workers: int = 2, budget: int = 0) -> Optional[InputPrefetcher]:
+    """ Start prefetching files for the consumer identified by `key`
+
+    Any previous prefetch of the same consumer is stopped.
+    """
+    prefetcher = InputPrefetcher(files, lookahead=lookahead, workers=workers, budget=budget)
+    with _prefetchers_lock:
+        previous = _prefetchers.pop(key, None)
+        if not prefetcher.done:
+            _prefetchers[key] = prefetcher
+    if previous is not None:
+        previous.close()
+    return prefetcher
+
+
+def get_prefetcher(key: str) -> Optional[InputPrefetcher]:
+    """Get the active prefetcher of a consumer, if any"""
+    with _prefetchers_lock:
+        prefetcher = _prefetchers.get(key, None)
+        if prefetcher is not None and prefetcher.done:
+            del _prefetchers[key]
+            prefetcher = None
+    return prefetcher
+
+
+def stop_all() -> None:
+    """Stop all active prefetchers"""
+    with _prefetchers_lock:
+        prefetchers = list(_prefetchers.values())
+        _prefetchers.clear()
+    for prefetcher in prefetchers:
+        prefetcher.close()
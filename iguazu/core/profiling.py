@@ -0,0 +1,222 @@
+"""
+Per-phase profiling of Iguazu tasks
+
+An Iguazu task run has several phases: entering and leaving its
+``contexts`` (which sends the buffered metadata), ``prepare_inputs`` (which
+reads the input dataframes), ``run``, ``handle_outputs`` (which writes and
+uploads the outputs) and ``graceful_fail`` (which includes the
+``handle_outputs`` of the default outputs, and which is nested in the phase
+that failed). Each phase is measured with
+:py:func:`profile_phase` on the :py:class:`TaskProfile` of the current
+:py:func:`profile_task` context, which Iguazu opens for each task run.
+
+The following values are recorded for each phase:
+
+* ``wall_seconds``: elapsed time.
+* ``cpu_seconds``: CPU time of the thread that runs the task (and of the
+  subprocess that runs it, with ``isolation='subprocess'``).
+* ``peak_rss_delta``: increase, in bytes, of the peak resident memory of the
+  process. Since the peak is shared by all the threads of the process, this
+  is only exact when tasks do not run concurrently on the same process.
+* ``read_bytes`` and ``written_bytes``: bytes read and written by the system
+  calls of the thread (files, pipes and sockets). These are only available on
+  Linux.
+* ``rows``: number of dataframe rows read by ``prepare_inputs``, returned by
+  ``run``, or recorded by the task with :py:func:`record_rows`. The input
+  rows are only counted by ``prepare_inputs``, so that the total counts each
+  row once.
+
+The profile of each task run is saved in the journal metadata of its outputs
+(see :py:meth:`iguazu.core.tasks.Task.default_metadata`) and on the
+``task_profile`` attribute of its final state, which is reported by
+``iguazu flows run``. Comparing the CPU time with the wall time, the bytes
+read and written, and the Quetzal calls of a task tells whether it is bound
+by the CPU, the disk or the network. The phases are also recorded on the
+timeline of the flow when tracing is enabled (see :py:mod:`iguazu.core.tracing`).
+"""
+
+import contextlib
+import resource
+import sys
+import threading
+import time
+from typing import Dict, Iterator, Optional
+
+from iguazu.core import tracing
+
+PHASES = ('contexts', 'prepare_inputs', 'run', 'handle_outputs', 'graceful_fail')
+"""Phases of a task run, in the order in which they are reported."""
+
+MEASURES = ('wall_seconds', 'cpu_seconds', 'peak_rss_delta', 'read_bytes', 'written_bytes', 'rows')
+"""Values recorded for each phase."""
+
+# ru_maxrss is in kilobytes on Linux, but in bytes on macOS
+_RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+def _io_counters() -> Dict[str, int]:
+    for filename in ('/proc/thread-self/io', '/proc/self/io'):
+        try:
+            with open(filename) as fd:
+                values = dict(line.split(':', 1) for line in fd if ':' in line)
+        except OSError:
+            continue
+        return dict(read_bytes=int(values['rchar']), written_bytes=int(values['wchar']))
+    return dict(read_bytes=0, written_bytes=0)
+
+
+def _snapshot() -> Dict[str, float]:
+    return dict(
+        wall_seconds=time.perf_counter(),
+        cpu_seconds=time.thread_time(),
+        peak_rss_delta=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _RSS_UNIT,
+        **_io_counters(),
+    )
+
+
+@contextlib.contextmanager
+def measure() -> Iterator[Dict[str, float]]:
+    """ Measure the resources used until the end of this context
+
+    The dictionary returned by this context is filled with the
+    :py:data:`MEASURES` (with zero ``rows``) when the context ends.
+    """
+    usage = {}
+    before = _snapshot()
+    try:
+        yield usage
+    finally:
+        after = _snapshot()
+        usage.update({k: after[k] - before[k] for k in before})
+        usage['rows'] = 0
+
+
+class TaskProfile:
+    """ Resources used by each phase of a task run """
+
+    def __init__(self):
+        self._phases = {}
+        self._total = dict.fromkeys(MEASURES, 0)
+        self._stack = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """ Measure a phase of the task
+
+        A phase measured several times is added up. A phase nested in the same
+        phase (e.g. the stages of a fused pipeline, which share the profile of
+        the pipeline) is only measured by the outermost one.
+        """
+        with self._lock:
+            entry = self._phases.setdefault(name, dict.fromkeys(MEASURES, 0))
+            nested = any(e is entry for e in self._stack)
+            top_level = not self._stack
+            self._stack.append(entry)
+        if nested:
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self._stack.pop()
+            return
+        try:
+            with measure() as usage:
+                yield
+        finally:
+            with self._lock:
+                self._stack.pop()
+                _add(entry, usage)
+                if top_level:
+                    _add(self._total, usage)
+
+    def add_rows(self, rows: int) -> None:
+        """Add rows processed by the current phase"""
+        with self._lock:
+            if self._stack:
+                self._stack[-1]['rows'] += rows
+                self._total['rows'] += rows
+
+    def add_usage(self, usage: Dict[str, float]) -> None:
+        """ Add the resources used elsewhere (e.g. by a subprocess) to the current phase
+
+        Only the CPU time, bytes, rows and peak memory are added: the wall
+        time is already measured by the phase.
+        """
+        with self._lock:
+            if self._stack:
+                usage = dict(usage, wall_seconds=0)
+                _add(self._stack[-1], usage)
+                _add(self._total, usage)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """ Get the phases measured so far
+
+        Returns
+        -------
+        dict
+            A dictionary whose keys are the phases, in the order of
+            :py:data:`PHASES`, and whose values are dictionaries of the
+            :py:data:`MEASURES` of the phase. Phases that are not finished
+            yet have partial values. The ``total`` key has the sum of the
+            phases that were not nested in another phase.
+        """
+        with self._lock:
+            order = {name: i for i, name in enumerate(PHASES)}
+            names = sorted(self._phases, key=lambda n: (order.get(n, len(order)), n))
+            summary = {name: dict(self._phases[name]) for name in names}
+            summary['total'] = dict(self._total)
+            return summary
+
+
+def _add(entry: Dict[str, float], usage: Dict[str, float]) -> None:
+    for k in MEASURES:
+        if k == 'peak_rss_delta':
+            entry[k] = max(entry[k], usage.get(k, 0))
+        else:
+            entry[k] += usage.get(k, 0)
+
+
+_profiles = threading.local()
+
+
+@contextlib.contextmanager
+def profile_task(reuse: bool = False) -> Iterator[TaskProfile]:
+    """ Profile the phases of a task run of this thread until the end of this context
+
+    Contexts can be nested: phases are only recorded on the innermost
+    context. When `reuse` is set and there is already a context, its
+    profile is used instead of a new one.
+    """
+    stack = _profiles.__dict__.setdefault('stack', [])
+    if reuse and stack:
+        yield stack[-1]
+        return
+    profile = TaskProfile()
+    stack.append(profile)
+    try:
+        yield profile
+    finally:
+        stack.remove(profile)
+
+
+def current_profile() -> Optional[TaskProfile]:
+    """Get the profile of the innermost :py:func:`profile_task` context, if any"""
+    stack = getattr(_profiles, 'stack', None)
+    return stack[-1] if stack else None
+
+
+@contextlib.contextmanager
+def profile_phase(name: str):
+    """Measure a phase on the current profile, if any, and on the trace of the flow"""
+    profile = current_profile()
+    measured = profile.phase(name) if profile is not None else contextlib.nullcontext()
+    with tracing.span(name, 'phase'), measured:
+        yield
+
+
+def record_rows(rows: int) -> None:
+    """Add dataframe rows processed by the current phase of the current profile, if any"""
+    profile = current_profile()
+    if profile is not None:
+        profile.add_rows(rows)
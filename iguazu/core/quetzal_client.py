@@ -0,0 +1,326 @@
+"""
+Managed Quetzal clients
+
+Each Quetzal client has its own pool of HTTP connections. Flows that create
+many clients, or that send many requests at the same time (e.g. a mapped
+task with thousands of children on a threaded executor), eventually run out of
+sockets and fail with ``NewConnectionError`` exceptions.
+
+This module provides one client per process and set of credentials
+(:py:func:`get_client`) whose requests share a bounded pool of connections
+with TCP keep-alive, and are limited by a process-wide
+:py:class:`RequestLimiter`. When all the connections are in use, requests wait
+for a free connection instead of opening new ones.
+
+The following environment variables configure the clients:
+
+* ``IGUAZU_QUETZAL_POOL_SIZE``: maximum number of connections to each Quetzal
+  host (10 by default).
+* ``IGUAZU_QUETZAL_MAX_REQUESTS``: maximum number of requests in flight in the
+  process (the pool size by default). Zero means no limit.
+* ``IGUAZU_QUETZAL_KEEPALIVE``: whether to enable TCP keep-alive on the
+  connections (enabled by default).
+* ``IGUAZU_QUETZAL_POOL_TIMEOUT``: maximum time, in seconds, that a request
+  waits for a free connection of the pool (300 by default), after which it
+  fails with an ``EmptyPoolError``. This prevents a deadlock when responses
+  whose contents are streamed are never read or released, since they keep
+  their connection. Zero means no limit.
+
+Note that only the time until the response headers are received is limited
+and measured: the contents of a streamed download are read afterwards.
+
+Besides the HTTP requests, the Quetzal operations made by Iguazu (find,
+retrieve, upload, download, etc.) are counted and timed with
+:py:func:`api_call`. Each operation is recorded on the innermost
+:py:func:`account_calls` context of the current thread, which Iguazu opens for
+each task run, so that the calls of each task are reported on the flow report
+and on the metadata journal of its outputs.
+"""
+
+import bisect
+import contextlib
+import functools
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Dict, Iterator, Optional
+
+from quetzal.client import helpers
+from quetzal.client.base import CustomRestClient
+from urllib3.connection import HTTPConnection
+
+from iguazu.utils import str2bool
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+"""Upper bounds, in seconds, of the buckets of the request latency histogram."""
+
+
+class RequestLimiter:
+    """ Limit and measure the requests in flight
+
+    Parameters
+    ----------
+    max_requests
+        Maximum number of requests in flight. Zero means no limit.
+
+    """
+
+    def __init__(self, max_requests: int = 0):
+        self.max_requests = max_requests
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._queued = 0
+        self._total = 0
+        self._errors = 0
+        self._histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+        self._latency_sum = 0.0
+
+    @contextlib.contextmanager
+    def request(self):
+        """Context that waits for a free request slot and measures the request"""
+        with self._condition:
+            self._queued += 1
+            try:
+                while 0 < self.max_requests <= self._in_flight:
+                    self._condition.wait()
+            finally:
+                self._queued -= 1
+            self._in_flight += 1
+
+        t0 = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except Exception:
+            failed = True
+            raise
+        finally:
+            latency = time.perf_counter() - t0
+            with self._condition:
+                self._in_flight -= 1
+                self._total += 1
+                self._errors += failed
+                self._histogram[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+                self._latency_sum += latency
+                self._condition.notify()
+
+    def stats(self) -> Dict:
+        """ Get the metrics of the requests
+
+        Returns
+        -------
+        dict
+            A dictionary with the number of requests ``in_flight`` and
+            ``queued`` (waiting for a free slot) at this moment, the ``total``
+            number of requests and ``errors``, the ``latency_sum`` in seconds,
+            and the ``latency_histogram``: a dictionary of the number of
+            requests whose latency was under each bound of
+            :py:data:`LATENCY_BUCKETS` (and the others, under ``inf``).
+        """
+        with self._condition:
+            bounds = [str(b) for b in LATENCY_BUCKETS] + ['inf']
+            return dict(
+                in_flight=self._in_flight,
+                queued=self._queued,
+                total=self._total,
+                errors=self._errors,
+                latency_sum=self._latency_sum,
+                latency_histogram=dict(zip(bounds, self._histogram)),
+            )
+
+
+class CallAccounting:
+    """ Number, errors and duration of the Quetzal operations, by operation """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation: str, seconds: float, failed: bool = False) -> None:
+        """Record one call of an operation"""
+        with self._lock:
+            entry = self._calls.setdefault(operation, dict(count=0, errors=0, seconds=0.0))
+            entry['count'] += 1
+            entry['errors'] += failed
+            entry['seconds'] += seconds
+
+    def merge(self, summary: Dict[str, Dict]) -> None:
+        """Add the calls of a :py:meth:`summary` from another accounting"""
+        with self._lock:
+            for operation, values in summary.items():
+                entry = self._calls.setdefault(operation, dict(count=0, errors=0, seconds=0.0))
+                for k in entry:
+                    entry[k] += values.get(k, 0)
+
+    def summary(self) -> Dict[str, Dict]:
+        """ Get the calls recorded so far
+
+        Returns
+        -------
+        dict
+            A dictionary whose keys are the operations, and whose values are
+            dictionaries with the ``count`` of calls, the number of
+            ``errors`` and the total duration in ``seconds``.
+        """
+        with self._lock:
+            return {operation: dict(entry) for operation, entry in sorted(self._calls.items())}
+
+    @property
+    def total_calls(self) -> int:
+        with self._lock:
+            return sum(entry['count'] for entry in self._calls.values())
+
+    @property
+    def total_seconds(self) -> float:
+        with self._lock:
+            return sum(entry['seconds'] for entry in self._calls.values())
+
+
+_accounting = threading.local()
+_process_accounting = CallAccounting()
+# The lock may have been held by another thread when the process was forked
+os.register_at_fork(after_in_child=lambda: setattr(_process_accounting, '_lock', threading.Lock()))
+
+
+@contextlib.contextmanager
+def account_calls(reuse: bool = False) -> Iterator[CallAccounting]:
+    """ Record the Quetzal operations of this thread until the end of this context
+
+    Contexts can be nested: operations are only recorded on the innermost
+    context. When `reuse` is set and there is already a context, its
+    accounting is used instead of a new one.
+    """
+    stack = _accounting.__dict__.setdefault('stack', [])
+    if reuse and stack:
+        yield stack[-1]
+        return
+    accounting = CallAccounting()
+    stack.append(accounting)
+    try:
+        yield accounting
+    finally:
+        stack.remove(accounting)
+
+
+def current_call_accounting() -> Optional[CallAccounting]:
+    """Get the accounting of the innermost :py:func:`account_calls` context, if any"""
+    stack = getattr(_accounting, 'stack', None)
+    return stack[-1] if stack else None
+
+
+@contextlib.contextmanager
+def api_call(operation: str):
+    """ Context that counts and times a Quetzal operation
+
+    The operation is recorded on the current :py:func:`account_calls` context
+    and on the totals of the process (see :py:func:`api_call_stats`).
+    """
+    t0 = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except Exception:
+        failed = True
+        raise
+    finally:
+        seconds = time.perf_counter() - t0
+        _process_accounting.record(operation, seconds, failed)
+        accounting = current_call_accounting()
+        if accounting is not None:
+            accounting.record(operation, seconds, failed)
+
+
+def api_call_stats() -> Dict[str, Dict]:
+    """Get the Quetzal operations of this process, see :py:meth:`CallAccounting.summary`"""
+    return _process_accounting.summary()
+
+
+class _ManagedRestClient(CustomRestClient):
+    """REST client whose requests go through the process request limiter"""
+
+    def __init__(self, configuration, *, pool_size: int, keepalive: bool,
+                 pool_timeout: Optional[float] = None):
+        super().__init__(configuration, maxsize=pool_size)
+        # Wait for a free connection instead of opening (and then discarding)
+        # a new one when all the connections of the pool are in use
+        self.pool_manager.connection_pool_kw['block'] = True
+        if pool_timeout:
+            # ... but not forever: the pool manager sends this keyword to the
+            # connection pool of each request
+            self.pool_manager.urlopen = functools.partial(self.pool_manager.urlopen,
+                                                          pool_timeout=pool_timeout)
+        if keepalive:
+            self.pool_manager.connection_pool_kw['socket_options'] = (
+                HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+            )
+
+    def request(self, *args, **kwargs):
+        with limiter().request():
+            return super().request(*args, **kwargs)
+
+
+_lock = threading.Lock()
+_clients = {}
+_limiter = None
+_pid = None
+
+
+def _reset_after_fork() -> None:
+    # Connections and locks inherited from a parent process cannot be used
+    global _pid, _limiter
+    if _pid != os.getpid():
+        _clients.clear()
+        _limiter = None
+        _pid = os.getpid()
+
+
+def limiter() -> RequestLimiter:
+    """Get the request limiter of this process"""
+    global _limiter
+    with _lock:
+        _reset_after_fork()
+        if _limiter is None:
+            pool_size = int(os.environ.get('IGUAZU_QUETZAL_POOL_SIZE', '10'))
+            max_requests = int(os.environ.get('IGUAZU_QUETZAL_MAX_REQUESTS', str(pool_size)))
+            _limiter = RequestLimiter(max_requests)
+        return _limiter
+
+
+def get_client(url: Optional[str] = None,
+               username: Optional[str] = None,
+               password: Optional[str] = None,
+               insecure: bool = False,
+               api_key: Optional[str] = None):
+    """ Get the managed Quetzal client of this process for some credentials
+
+    The parameters are the same as :py:func:`quetzal.client.helpers.get_client`.
+    The same client is returned for the same parameters, until the process is
+    forked.
+    """
+    key = (url, username, password, insecure, api_key)
+    with _lock:
+        _reset_after_fork()
+        client = _clients.get(key, None)
+        if client is None:
+            client = helpers.get_client(url=url, username=username, password=password,
+                                        insecure=insecure, api_key=api_key)
+            pool_size = int(os.environ.get('IGUAZU_QUETZAL_POOL_SIZE', '10'))
+            keepalive = str2bool(os.environ.get('IGUAZU_QUETZAL_KEEPALIVE', '1'))
+            pool_timeout = float(os.environ.get('IGUAZU_QUETZAL_POOL_TIMEOUT', '300')) or None
+            client.rest_client = _ManagedRestClient(client.configuration,
+                                                    pool_size=pool_size,
+                                                    keepalive=keepalive,
+                                                    pool_timeout=pool_timeout)
+            logger.debug('Created Quetzal client for %s with %d connections',
+                         client.configuration.host, pool_size)
+            _clients[key] = client
+    return client
+
+
+def quetzal_client_stats() -> Dict:
+    """Get the request metrics of the Quetzal clients of this process"""
+    return limiter().stats()
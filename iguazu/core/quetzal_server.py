@@ -0,0 +1,702 @@
+"""
+Local stand-in for the Quetzal API
+
+:py:class:`LocalQuetzalServer` is a small HTTP server, running on a thread of
+the current process, that implements the part of the Quetzal API used by
+Iguazu: authentication, workspaces (create, list, scan, commit and delete),
+file upload and download, metadata and queries. Since it is a real HTTP
+server, Iguazu uses it through the regular Quetzal client, with the same
+requests, connection pool and serialization as with a real Quetzal server.
+This makes it possible to test and benchmark the Quetzal I/O of flows without
+a Quetzal deployment:
+
+.. code-block:: python
+
+    with LocalQuetzalServer(latency=0.02, bandwidth=10 << 20) as server:
+        client = get_client(**server.client_kwargs)
+        ...
+        print(server.stats())
+
+The ``iguazu quetzal-server`` command runs a server until it is interrupted,
+so that flows can be executed against it with the ``QUETZAL_URL``,
+``QUETZAL_USER`` and ``QUETZAL_PASSWORD`` environment variables that it
+prints.
+
+Queries are executed by SQLite on a ``metadata`` table that has a JSON column
+for each metadata family, which supports the ``->``, ``->>`` and ``?``
+operators of the PostgreSQL JSON queries used by Iguazu. The ``->`` and
+``->>`` operators need SQLite 3.38 or newer (see
+:py:data:`MIN_SQLITE_VERSION`): the server cannot be created with an older
+SQLite. Both the ``postgresql`` and
+``postgresql_json`` dialects are executed like this. As with Quetzal, the
+queries of a workspace only see the metadata of its last scan.
+
+This server is meant for tests and benchmarks only: it keeps everything in
+memory (except the file contents, which are saved in a temporary directory),
+it accepts any username and password, and it does not check the metadata
+family versions.
+"""
+
+import base64
+import collections
+import contextlib
+import copy
+import datetime
+import email.parser
+import email.policy
+import hashlib
+import http.server
+import json
+import logging
+import math
+import pathlib
+import re
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 100
+MIN_SQLITE_VERSION = (3, 38)
+"""Oldest SQLite version that supports the JSON operators of the queries."""
+STREAM_CHUNK_SIZE = 1 << 16
+
+_API_PREFIX = '/api/v1'
+_JSONB_EXISTS = re.compile(r"((?:\w+|\"[^\"]*\")(?:\s*->>?\s*'[^']*')*)\s*\?\s*'((?:[^']|'')*)'")
+
+
+class _ApiError(Exception):
+    def __init__(self, status: int, title: str):
+        super().__init__(title)
+        self.status = status
+        self.title = title
+
+
+class _Workspace:
+    def __init__(self, wid, name, description, families, owner, temporary):
+        self.id = wid
+        self.name = name
+        self.description = description
+        self.families = families
+        self.owner = owner
+        self.temporary = temporary
+        self.status = 'READY'
+        self.creation_date = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        # Metadata of the files uploaded or modified in this workspace; the
+        # other committed files are seen as they are in the global view
+        self.files = {}
+        # Metadata database of the last scan
+        self.view = None
+
+    def details(self, base_url):
+        return dict(
+            id=self.id,
+            name=self.name,
+            description=self.description,
+            families=self.families,
+            owner=self.owner,
+            status=self.status,
+            temporary=self.temporary,
+            creation_date=self.creation_date,
+            data_url=f'{base_url}/data/workspaces/{self.id}/files/',
+        )
+
+
+class _Backend:
+    """State of the server, shared by all the request handler threads"""
+
+    def __init__(self, storage: pathlib.Path, latency: float, bandwidth: float):
+        self.storage = storage
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.lock = threading.RLock()
+        self.tokens = {}
+        self.workspaces = {}
+        self.files = {}
+        self.queries = {}
+        self.global_view = None
+        self.requests = collections.Counter()
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self._ids = collections.Counter()
+
+    def next_id(self, kind: str) -> int:
+        with self.lock:
+            self._ids[kind] += 1
+            return self._ids[kind]
+
+    def workspace(self, wid) -> _Workspace:
+        with self.lock:
+            workspace = self.workspaces.get(int(wid), None)
+        if workspace is None:
+            raise _ApiError(404, f'Workspace {wid} does not exist')
+        return workspace
+
+    def visible_files(self, workspace: Optional[_Workspace]) -> Dict[str, Dict]:
+        """Metadata of the files seen from a workspace, or the global view"""
+        with self.lock:
+            files = dict(self.files)
+            if workspace is not None:
+                files.update(workspace.files)
+            return files
+
+    def throttle(self, size: int) -> None:
+        if self.bandwidth > 0 and size > 0:
+            time.sleep(size / self.bandwidth)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    # Keep the connections alive, like a real server behind a load balancer
+    protocol_version = 'HTTP/1.1'
+    server_version = 'IguazuLocalQuetzal/1.0'
+
+    routes = (
+        ('POST', r'/auth/token', 'auth_token'),
+        ('POST', r'/auth/logout', 'auth_logout'),
+        ('GET', r'/data/workspaces/', 'workspace_fetch'),
+        ('POST', r'/data/workspaces/', 'workspace_create'),
+        ('GET', r'/data/workspaces/(?P<wid>\d+)', 'workspace_details'),
+        ('DELETE', r'/data/workspaces/(?P<wid>\d+)', 'workspace_delete'),
+        ('PUT', r'/data/workspaces/(?P<wid>\d+)/commit', 'workspace_commit'),
+        ('PUT', r'/data/workspaces/(?P<wid>\d+)/scan', 'workspace_scan'),
+        ('GET', r'/data/workspaces/(?P<wid>\d+)/files/', 'file_fetch'),
+        ('POST', r'/data/workspaces/(?P<wid>\d+)/files/', 'file_create'),
+        ('GET', r'/data/workspaces/(?P<wid>\d+)/files/(?P<uuid>[^/]+)', 'file_details'),
+        ('PATCH', r'/data/workspaces/(?P<wid>\d+)/files/(?P<uuid>[^/]+)', 'file_update_metadata'),
+        ('PUT', r'/data/workspaces/(?P<wid>\d+)/files/(?P<uuid>[^/]+)', 'file_set_metadata'),
+        ('DELETE', r'/data/workspaces/(?P<wid>\d+)/files/(?P<uuid>[^/]+)', 'file_delete'),
+        ('POST', r'/data/workspaces/(?P<wid>\d+)/queries/', 'query_create'),
+        ('GET', r'/data/workspaces/(?P<wid>\d+)/queries/(?P<qid>\d+)', 'query_details'),
+        ('GET', r'/data/files/', 'file_fetch'),
+        ('GET', r'/data/files/(?P<uuid>[^/]+)', 'file_details'),
+        ('POST', r'/data/queries/', 'query_create'),
+        ('GET', r'/data/queries/(?P<qid>\d+)', 'query_details'),
+    )
+
+    @property
+    def backend(self) -> _Backend:
+        return self.server.backend
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}{_API_PREFIX}'
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_PATCH(self):
+        self._dispatch('PATCH')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def log_message(self, format, *args):
+        logger.debug('%s - %s', self.address_string(), format % args)
+
+    def _dispatch(self, method):
+        url = urllib.parse.urlsplit(self.path)
+        self.params = {k: v[-1] for k, v in urllib.parse.parse_qs(url.query).items()}
+        self.query_string = url.query
+        # Always read the body, so that the connection can be reused
+        self.body = self._read_body()
+        if self.backend.latency > 0:
+            time.sleep(self.backend.latency)
+
+        path = url.path[len(_API_PREFIX):] if url.path.startswith(_API_PREFIX) else None
+        try:
+            for route_method, pattern, name in self.routes:
+                match = re.fullmatch(pattern, path or '')
+                if route_method == method and match:
+                    with self.backend.lock:
+                        self.backend.requests[name] += 1
+                    if not name.startswith('auth_'):
+                        self.username = self._authenticate()
+                    getattr(self, name)(**match.groupdict())
+                    break
+            else:
+                raise _ApiError(404, f'No route for {method} {url.path}')
+        except _ApiError as exc:
+            self._send_json({'type': 'about:blank', 'title': exc.title, 'status': exc.status},
+                            status=exc.status, content_type='application/problem+json')
+        except Exception as exc:
+            logger.warning('Local Quetzal server failed on %s %s', method, self.path, exc_info=True)
+            self._send_json({'type': 'about:blank', 'title': str(exc), 'status': 500},
+                            status=500, content_type='application/problem+json')
+
+    def _read_body(self) -> bytes:
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip() or b'0', 16)
+                if size == 0:
+                    # Skip the trailers until the empty line
+                    while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            body = b''.join(chunks)
+        else:
+            body = self.rfile.read(int(self.headers.get('Content-Length', None) or 0))
+        with self.backend.lock:
+            self.backend.bytes_received += len(body)
+        self.backend.throttle(len(body))
+        return body
+
+    def _json_body(self) -> Any:
+        try:
+            return json.loads(self.body.decode('utf-8'))
+        except ValueError:
+            raise _ApiError(400, 'Invalid JSON body') from None
+
+    def _send(self, status: int, body: bytes = b'', content_type: Optional[str] = None, headers=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.backend.lock:
+            self.backend.bytes_sent += len(body)
+
+    def _send_json(self, obj, status: int = 200, content_type: str = 'application/json'):
+        self._send(status, json.dumps(obj).encode('utf-8'), content_type)
+
+    def _authenticate(self) -> str:
+        api_key = self.headers.get('X-API-KEY', None)
+        if api_key:
+            return 'api-key'
+        authorization = self.headers.get('Authorization', '')
+        if authorization.startswith('Bearer '):
+            with self.backend.lock:
+                username = self.backend.tokens.get(authorization[len('Bearer '):], None)
+            if username is not None:
+                return username
+        raise _ApiError(401, 'Unauthorized')
+
+    def _page(self, items: List) -> Dict:
+        page = int(self.params.get('page', 1))
+        per_page = int(self.params.get('per_page', DEFAULT_PAGE_SIZE))
+        start = (page - 1) * per_page
+        return dict(
+            page=page,
+            pages=max(1, math.ceil(len(items) / per_page)),
+            total=len(items),
+            results=items[start:start + per_page],
+        )
+
+    # Authentication
+
+    def auth_token(self):
+        authorization = self.headers.get('Authorization', '')
+        if not authorization.startswith('Basic '):
+            raise _ApiError(401, 'Basic authentication is required')
+        username = base64.b64decode(authorization[len('Basic '):]).decode('utf-8').split(':')[0]
+        token = secrets.token_hex(16)
+        with self.backend.lock:
+            self.backend.tokens[token] = username
+        self._send_json({'token': token})
+
+    def auth_logout(self):
+        self._send_json({})
+
+    # Workspaces
+
+    def workspace_fetch(self):
+        name = self.params.get('name', None)
+        owner = self.params.get('owner', None)
+        deleted = self.params.get('deleted', 'false').lower() in ('true', '1')
+        with self.backend.lock:
+            workspaces = [
+                w.details(self.base_url) for w in self.backend.workspaces.values()
+                if (name is None or w.name == name) and
+                   (owner is None or w.owner == owner) and
+                   (deleted or w.status != 'DELETED')
+            ]
+        self._send_json(self._page(workspaces))
+
+    def workspace_create(self):
+        body = self._json_body()
+        families = {'base': 1}
+        families.update({k: v or 1 for k, v in (body.get('families', None) or {}).items()})
+        with self.backend.lock:
+            for w in self.backend.workspaces.values():
+                if w.name == body.get('name', None) and w.owner == self.username and w.status != 'DELETED':
+                    raise _ApiError(400, f'Workspace {w.name} already exists')
+            workspace = _Workspace(self.backend.next_id('workspace'), body.get('name', None),
+                                   body.get('description', ''), families, self.username,
+                                   bool(body.get('temporary', False)))
+            self.backend.workspaces[workspace.id] = workspace
+            _scan(self.backend, workspace)
+            details = workspace.details(self.base_url)
+        # The initialization is immediate, but the client waits for it
+        details['status'] = 'INITIALIZING'
+        self._send_json(details, status=201)
+
+    def workspace_details(self, wid):
+        with self.backend.lock:
+            details = self.backend.workspace(wid).details(self.base_url)
+        self._send_json(details)
+
+    def workspace_delete(self, wid):
+        with self.backend.lock:
+            workspace = self.backend.workspace(wid)
+            workspace.status = 'DELETED'
+            workspace.files.clear()
+            workspace.view = None
+        self._send(202)
+
+    def workspace_commit(self, wid):
+        with self.backend.lock:
+            workspace = self.backend.workspace(wid)
+            for file_id, metadata in workspace.files.items():
+                state = metadata['base']['state']
+                if state == 'DELETED' and file_id in self.backend.files:
+                    self.backend.files[file_id]['base']['state'] = 'DELETED'
+                elif state == 'READY':
+                    self.backend.files[file_id] = copy.deepcopy(metadata)
+            workspace.files.clear()
+            self.backend.global_view = None
+            details = workspace.details(self.base_url)
+        details['status'] = 'COMMITTING'
+        self._send_json(details)
+
+    def workspace_scan(self, wid):
+        with self.backend.lock:
+            workspace = self.backend.workspace(wid)
+            _scan(self.backend, workspace)
+            details = workspace.details(self.base_url)
+        details['status'] = 'SCANNING'
+        self._send_json(details)
+
+    # Files
+
+    def _file_metadata(self, workspace: Optional[_Workspace], file_id: str) -> Dict:
+        metadata = self.backend.visible_files(workspace).get(file_id, None)
+        if metadata is None:
+            raise _ApiError(404, f'File {file_id} does not exist')
+        return metadata
+
+    def file_fetch(self, wid=None):
+        workspace = self.backend.workspace(wid) if wid is not None else None
+        filters = {}
+        for item in filter(None, self.params.get('filters', '').split(',')):
+            key, _, value = item.partition('=')
+            filters[key] = value
+        with self.backend.lock:
+            results = [
+                copy.deepcopy(metadata['base'])
+                for metadata in self.backend.visible_files(workspace).values()
+                if all(str(metadata['base'].get(k, '')) == v for k, v in filters.items())
+            ]
+        self._send_json(self._page(results))
+
+    def file_create(self, wid):
+        workspace = self.backend.workspace(wid)
+        parser = email.parser.BytesParser(policy=email.policy.HTTP)
+        header = f'Content-Type: {self.headers["Content-Type"]}\r\n\r\n'.encode('utf-8')
+        message = parser.parsebytes(header + self.body)
+        content = filename = None
+        if message.is_multipart():
+            for part in message.iter_parts():
+                if part.get_param('name', header='content-disposition') == 'content':
+                    filename = part.get_filename()
+                    content = part.get_payload(decode=True)
+        if content is None or not filename:
+            raise _ApiError(400, 'Missing file content')
+
+        file_id = str(uuid.uuid4())
+        (self.backend.storage / file_id).write_bytes(content)
+        temporary = self.params.get('temporary', 'false').lower() in ('true', '1')
+        base = dict(
+            id=file_id,
+            filename=pathlib.PurePosixPath(filename).name,
+            path=self.params.get('path', ''),
+            size=len(content),
+            checksum=hashlib.md5(content).hexdigest(),
+            date=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            state='TEMPORARY' if temporary else 'READY',
+            url=f'{self.base_url}/data/files/{file_id}',
+        )
+        with self.backend.lock:
+            workspace.files[file_id] = {'base': base}
+        self._send_json(base, status=201)
+
+    def file_details(self, uuid, wid=None):
+        workspace = self.backend.workspace(wid) if wid is not None else None
+        with self.backend.lock:
+            metadata = copy.deepcopy(self._file_metadata(workspace, uuid))
+        if 'application/octet-stream' not in self.headers.get('Accept', ''):
+            self._send_json({'id': uuid, 'metadata': metadata})
+            return
+
+        path = self.backend.storage / uuid
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(path.stat().st_size))
+        self.end_headers()
+        with path.open('rb') as fd:
+            for chunk in iter(lambda: fd.read(STREAM_CHUNK_SIZE), b''):
+                self.backend.throttle(len(chunk))
+                self.wfile.write(chunk)
+                with self.backend.lock:
+                    self.backend.bytes_sent += len(chunk)
+
+    def _change_metadata(self, wid, uuid, merge):
+        workspace = self.backend.workspace(wid)
+        body = self._json_body()
+        with self.backend.lock:
+            metadata = workspace.files.get(uuid, None)
+            if metadata is None:
+                metadata = copy.deepcopy(self._file_metadata(None, uuid))
+            for family, values in (body.get('metadata', None) or {}).items():
+                if family not in workspace.families:
+                    raise _ApiError(400, f'Family {family} is not used in workspace {workspace.id}')
+                values = {k: v for k, v in values.items() if k != 'id'}
+                if family == 'base':
+                    metadata['base'].update({k: v for k, v in values.items() if k in ('path', 'filename')})
+                elif merge:
+                    metadata.setdefault(family, {}).update(values)
+                else:
+                    metadata[family] = values
+                metadata[family]['id'] = uuid
+            workspace.files[uuid] = metadata
+            result = copy.deepcopy(metadata)
+        self._send_json({'id': uuid, 'metadata': result})
+
+    def file_update_metadata(self, wid, uuid):
+        self._change_metadata(wid, uuid, merge=True)
+
+    def file_set_metadata(self, wid, uuid):
+        self._change_metadata(wid, uuid, merge=False)
+
+    def file_delete(self, wid, uuid):
+        workspace = self.backend.workspace(wid)
+        with self.backend.lock:
+            metadata = workspace.files.get(uuid, None)
+            if metadata is None:
+                metadata = copy.deepcopy(self._file_metadata(None, uuid))
+            metadata['base']['state'] = 'DELETED'
+            workspace.files[uuid] = metadata
+        self._send(202)
+
+    # Queries
+
+    def query_create(self, wid=None):
+        body = self._json_body()
+        dialect = body.get('dialect', None)
+        if dialect not in ('postgresql', 'postgresql_json'):
+            raise _ApiError(400, f'Unsupported dialect {dialect}')
+        with self.backend.lock:
+            if wid is not None:
+                workspace = self.backend.workspace(wid)
+                if workspace.view is None:
+                    raise _ApiError(400, f'Workspace {wid} has not been scanned')
+                view = workspace.view
+            else:
+                if self.backend.global_view is None:
+                    self.backend.global_view = _build_view(self.backend.files)
+                view = self.backend.global_view
+            rows = _execute(view, body.get('query', ''))
+            qid = self.backend.next_id('query')
+            self.backend.queries[qid] = dict(id=qid, dialect=dialect, query=body.get('query', ''),
+                                             workspace_id=int(wid) if wid is not None else None,
+                                             rows=rows)
+        # Like Quetzal, redirect to the first page of the results
+        location = f'{_API_PREFIX}/data/workspaces/{wid}/queries/{qid}' if wid is not None else \
+            f'{_API_PREFIX}/data/queries/{qid}'
+        if self.query_string:
+            location += '?' + self.query_string
+        self._send(303, headers={'Location': location})
+
+    def query_details(self, qid, wid=None):
+        with self.backend.lock:
+            query = self.backend.queries.get(int(qid), None)
+        if query is None or query['workspace_id'] != (int(wid) if wid is not None else None):
+            raise _ApiError(404, f'Query {qid} does not exist')
+        page = self._page(query['rows'])
+        page.update({k: v for k, v in query.items() if k != 'rows'})
+        self._send_json(page)
+
+
+def _scan(backend: _Backend, workspace: _Workspace) -> None:
+    workspace.view = _build_view(backend.visible_files(workspace), list(workspace.families))
+
+
+def _build_view(files: Dict[str, Dict], families: Optional[List[str]] = None) -> sqlite3.Connection:
+    """Create a SQLite database with the metadata of some files"""
+    if families is None:
+        families = sorted({family for metadata in files.values() for family in metadata})
+    families = ['base'] + [f for f in families if f != 'base']
+    connection = sqlite3.connect(':memory:', check_same_thread=False)
+    connection.create_function('md5', 1, _md5)
+    connection.create_function('jsonb_exists', 2, _jsonb_exists)
+    columns = ', '.join(f'"{family}" TEXT' for family in families)
+    connection.execute(f'CREATE TABLE metadata ({columns})')
+    connection.executemany(
+        f'INSERT INTO metadata VALUES ({", ".join("?" for _ in families)})',
+        [
+            [json.dumps(metadata[f]) if f in metadata else None for f in families]
+            for metadata in files.values()
+        ]
+    )
+    return connection
+
+
+def _execute(connection: sqlite3.Connection, query: str) -> List[Dict]:
+    # The ? operator (key or element exists) has no SQLite equivalent
+    translated = _JSONB_EXISTS.sub(r"jsonb_exists(\1, '\2')", query)
+    try:
+        cursor = connection.execute(translated)
+    except sqlite3.Error as exc:
+        raise _ApiError(400, f'Query failed: {exc}') from None
+    names = [d[0] for d in cursor.description or ()]
+    return [
+        {name: _decode(value) for name, value in zip(names, row)}
+        for row in cursor.fetchall()
+    ]
+
+
+def _decode(value):
+    # JSON columns and -> expressions are JSON texts on SQLite, but decoded
+    # objects on PostgreSQL
+    if isinstance(value, str) and value[:1] in ('{', '['):
+        with contextlib.suppress(ValueError):
+            return json.loads(value)
+    return value
+
+
+def _md5(value):
+    if value is None:
+        return None
+    return hashlib.md5(str(value).encode('utf-8')).hexdigest()
+
+
+def _jsonb_exists(document, key):
+    if document is None:
+        return None
+    with contextlib.suppress(ValueError, TypeError):
+        value = json.loads(document)
+        if isinstance(value, dict):
+            return key in value
+        if isinstance(value, list):
+            return key in value
+        return value == key
+    return False
+
+
+class LocalQuetzalServer:
+    """ In-process stand-in for a Quetzal server
+
+    Parameters
+    ----------
+    host
+        Address where the server listens.
+    port
+        Port where the server listens. Zero means a free port.
+    latency
+        Seconds added to each request, to simulate the round trip to a remote
+        server.
+    bandwidth
+        Bytes per second of the request and response bodies. Zero means no
+        limit.
+    username
+        Username of the :py:attr:`client_kwargs`. Any username and password
+        are accepted by the server.
+    password
+        Password of the :py:attr:`client_kwargs`.
+
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, *,
+                 latency: float = 0, bandwidth: float = 0,
+                 username: str = 'iguazu', password: str = 'iguazu'):
+        if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+            raise RuntimeError(f'The local Quetzal server needs SQLite '
+                               f'{".".join(map(str, MIN_SQLITE_VERSION))} or newer, '
+                               f'found version {sqlite3.sqlite_version}')
+        self.username = username
+        self.password = password
+        self._storage = tempfile.TemporaryDirectory(prefix='iguazu_quetzal_')
+        self._httpd = http.server.ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.backend = _Backend(pathlib.Path(self._storage.name), latency, bandwidth)
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """URL of the API, to be used as the Quetzal client URL"""
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}{_API_PREFIX}'
+
+    @property
+    def client_kwargs(self) -> Dict[str, Any]:
+        """Parameters of :py:func:`iguazu.core.quetzal_client.get_client` for this server"""
+        return dict(url=self.url, username=self.username, password=self.password)
+
+    @property
+    def environment(self) -> Dict[str, str]:
+        """Environment variables that configure the Quetzal client for this server"""
+        return dict(QUETZAL_URL=self.url, QUETZAL_USER=self.username, QUETZAL_PASSWORD=self.password)
+
+    def start(self) -> 'LocalQuetzalServer':
+        """Serve the requests on a background thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                            name='local-quetzal-server', daemon=True)
+            self._thread.start()
+            logger.info('Local Quetzal server listening on %s', self.url)
+        return self
+
+    def serve_forever(self) -> None:
+        """Serve the requests on this thread, until interrupted"""
+        logger.info('Local Quetzal server listening on %s', self.url)
+        self._httpd.serve_forever()
+
+    def stop(self) -> None:
+        """Stop the server and delete its files"""
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpd.server_close()
+        self._storage.cleanup()
+
+    def stats(self) -> Dict[str, Any]:
+        """ Get the requests received by the server
+
+        Returns
+        -------
+        dict
+            A dictionary with the number of ``requests`` by API operation
+            (e.g. ``file_details``), and the number of ``bytes_received`` and ``bytes_sent`` in the
+            request and response bodies.
+        """
+        backend = self._httpd.backend
+        with backend.lock:
+            return dict(
+                requests=dict(backend.requests),
+                bytes_received=backend.bytes_received,
+                bytes_sent=backend.bytes_sent,
+            )
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,399 @@
+""" Persistent cache of task results
+
+Iguazu tasks use the prefect cache, whose validator compares the inputs of a
+task with the inputs of its previous run. This only works within the same
+flow run (or with the task states saved by ``iguazu flows run --cache``), and
+only for inputs that can be compared: two :py:class:`iguazu.core.files.LocalFile`
+instances of the same file are never equal.
+
+This module keeps the outputs of successful task runs in a SQLite database,
+keyed by a fingerprint (see :py:func:`task_fingerprint`) of:
+
+* the class and version of the task,
+* the parameters of its constructor, except the options that do not change
+  its results (such as ``force`` or ``isolation``),
+* the temporary and output URLs of the flow, and
+* the inputs of its run, where file adapters are represented by their
+  location, checksum and the ``status`` of each metadata family (e.g. the
+  journal status of the task that created them, which the preconditions of
+  Iguazu tasks check) instead of the object itself.
+
+Other metadata of the input files are not part of the fingerprint: tasks whose
+results depend on other metadata of their inputs must not set the
+``result_cache`` option.
+
+When a task with the :py:attr:`iguazu.core.options.TaskOptions.result_cache`
+option finds its fingerprint on the cache, and the output files saved there
+still exist with the same contents, it ends with a
+:py:class:`iguazu.helpers.states.SkippedResult` state whose result is the
+saved outputs, without preparing its inputs nor running.
+
+The cache location is ``cache/results.sqlite3`` in the temporary directory of
+the flow, or the path set in the ``IGUAZU_RESULT_CACHE_PATH`` environment
+variable. Entries that were not used in ``IGUAZU_RESULT_CACHE_MAX_AGE``
+seconds (7 days by default, like the prefect cache) are evicted, and so are
+the least recently used entries when there are more than
+``IGUAZU_RESULT_CACHE_MAX_ENTRIES`` of them (no limit by default).
+"""
+
+import hashlib
+import inspect
+import logging
+import os
+import pathlib
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional, Tuple, Union
+
+import prefect
+
+from iguazu.core.files import FileAdapter, LocalFile, QuetzalFile
+from iguazu.core.files.checksums import file_checksum
+from iguazu.utils import fullname
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_AGE = 7 * 24 * 60 * 60
+"""Default maximum age, in seconds since their last use, of the cache entries."""
+
+RUNTIME_OPTIONS = frozenset((
+    'force', 'managed_inputs_cache_size', 'memory_budget', 'isolation',
+    'isolation_timeout', 'isolation_memory_limit', 'auto_clean_files',
+    'buffer_metadata', 'prefetch_inputs', 'prefetch_workers', 'prefetch_budget',
+    'batch_previous_results', 'result_cache',
+))
+"""Task options that change how a task runs, but not its results. They are
+not part of the fingerprint of a task."""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    task TEXT NOT NULL,
+    outputs BLOB NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL
+)
+"""
+
+
+class Uncacheable(Exception):
+    """The result of a task run cannot be saved on the cache"""
+
+
+class ResultCache:
+    """ Outputs of task runs indexed by their fingerprint
+
+    Parameters
+    ----------
+    path
+        Location of the SQLite database of the cache. It is created if it does
+        not exist. ``None`` creates a cache in memory that is not persisted.
+    max_age
+        Maximum time, in seconds, since the last use of an entry. Older
+        entries are evicted. Zero means no limit.
+    max_entries
+        Maximum number of entries. The least recently used entries are
+        evicted when there are more. Zero means no limit.
+
+    Attributes
+    ----------
+    hits: int
+        Number of outputs obtained from the cache.
+    misses: int
+        Number of lookups that did not find any valid outputs.
+    stores: int
+        Number of outputs saved on the cache.
+    evictions: int
+        Number of entries evicted because of their age or the maximum number
+        of entries.
+
+    """
+
+    def __init__(self, path: Optional[Union[str, pathlib.Path]] = None,
+                 max_age: float = DEFAULT_MAX_AGE,
+                 max_entries: int = 0):
+        self.path = None if path is None else pathlib.Path(path)
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """ Get the outputs saved for a fingerprint
+
+        Returns
+        -------
+        tuple
+            Whether the cache had outputs for this fingerprint, and the
+            outputs. Entries that are too old are not returned.
+
+        """
+        rows = self._execute('SELECT outputs, last_used FROM results WHERE key = ?', (key, ))
+        now = time.time()
+        if not rows or (self.max_age and now - rows[0][1] > self.max_age):
+            self.misses += 1
+            return False, None
+        try:
+            outputs = pickle.loads(rows[0][0])
+        except Exception:
+            logger.warning('Could not read result cache entry %s, discarding it', key, exc_info=True)
+            self.discard(key)
+            self.misses += 1
+            return False, None
+        self._execute('UPDATE results SET last_used = ?, hits = hits + 1 WHERE key = ?',
+                      (now, key), commit=True)
+        self.hits += 1
+        return True, outputs
+
+    def put(self, key: str, task: str, outputs: Any) -> None:
+        """ Save the outputs of a task run and evict the old entries
+
+        Raises
+        ------
+        Uncacheable
+            When the outputs cannot be pickled.
+
+        """
+        try:
+            payload = pickle.dumps(outputs, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as ex:
+            raise Uncacheable(f'Outputs of {task} cannot be pickled') from ex
+        now = time.time()
+        self._execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, 0)',
+                      (key, task, payload, now, now), commit=True)
+        self.stores += 1
+        self.evict()
+
+    def discard(self, key: str) -> None:
+        """Remove an entry, e.g. because its outputs no longer exist"""
+        self._execute('DELETE FROM results WHERE key = ?', (key, ), commit=True)
+
+    def evict(self) -> int:
+        """ Remove the entries that are too old or exceed the maximum number
+
+        Returns
+        -------
+        int
+            Number of entries removed.
+
+        """
+        count = 0
+        if self.max_age:
+            count += self._execute_count('DELETE FROM results WHERE last_used < ?',
+                                         (time.time() - self.max_age, ))
+        if self.max_entries:
+            count += self._execute_count(
+                'DELETE FROM results WHERE key NOT IN '
+                '(SELECT key FROM results ORDER BY last_used DESC LIMIT ?)',
+                (self.max_entries, ))
+        if count:
+            logger.debug('Evicted %d entries of result cache %s', count, self.path)
+        self.evictions += count
+        return count
+
+    def stats(self) -> Dict[str, int]:
+        """Get the hits, misses, stores, evictions and current number of entries"""
+        entries = self._execute('SELECT COUNT(*) FROM results', ())[0][0]
+        return dict(hits=self.hits, misses=self.misses, stores=self.stores,
+                    evictions=self.evictions, entries=entries)
+
+    def _execute(self, sql, parameters, commit=False):
+        with self._lock:
+            connection = self._connect()
+            rows = connection.execute(sql, parameters).fetchall()
+            if commit:
+                connection.commit()
+            return rows
+
+    def _execute_count(self, sql, parameters) -> int:
+        with self._lock:
+            connection = self._connect()
+            count = connection.execute(sql, parameters).rowcount
+            connection.commit()
+            return count
+
+    def _connect(self) -> sqlite3.Connection:
+        # SQLite connections cannot be shared with a forked child process
+        if self._connection is None or self._pid != os.getpid():
+            if self.path is None:
+                database = ':memory:'
+            else:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                database = str(self.path)
+            self._connection = sqlite3.connect(database, timeout=30, check_same_thread=False)
+            self._connection.execute(_SCHEMA)
+            self._connection.commit()
+            self._pid = os.getpid()
+        return self._connection
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_connection'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+_caches_lock = threading.Lock()
+_caches = {}
+
+
+def default_result_cache() -> Optional[ResultCache]:
+    """ Get the result cache of the current flow
+
+    Returns ``None`` when there is no ``IGUAZU_RESULT_CACHE_PATH`` environment
+    variable nor temporary directory on the prefect context.
+    """
+    path = os.environ.get('IGUAZU_RESULT_CACHE_PATH', None)
+    if not path:
+        temp_dir = prefect.context.get('temp_dir', None)
+        if temp_dir is None:
+            return None
+        path = pathlib.Path(temp_dir) / 'cache' / 'results.sqlite3'
+    path = pathlib.Path(path).resolve()
+    with _caches_lock:
+        cache = _caches.get(path, None)
+        if cache is None:
+            max_age = float(os.environ.get('IGUAZU_RESULT_CACHE_MAX_AGE', str(DEFAULT_MAX_AGE)))
+            max_entries = int(os.environ.get('IGUAZU_RESULT_CACHE_MAX_ENTRIES', '0'))
+            cache = ResultCache(path, max_age=max_age, max_entries=max_entries)
+            _caches[path] = cache
+    return cache
+
+
+def result_cache_stats() -> Dict[str, int]:
+    """Get the hits, misses, stores and evictions of the result caches used by this process"""
+    totals = dict(hits=0, misses=0, stores=0, evictions=0)
+    with _caches_lock:
+        for cache in _caches.values():
+            for k in totals:
+                totals[k] += getattr(cache, k)
+    return totals
+
+
+def task_fingerprint(task, inputs: Dict[str, Any]) -> str:
+    """ Get the key of a task run on the result cache
+
+    Parameters
+    ----------
+    task
+        An :py:class:`iguazu.core.tasks.Task` instance.
+    inputs
+        The keyword arguments of its run method.
+
+    Raises
+    ------
+    Uncacheable
+        When an input or constructor parameter cannot be fingerprinted, e.g. a
+        file that does not exist yet.
+
+    """
+    args, kwargs = getattr(task, '_init_arguments', ((), {}))
+    prefect_params = inspect.getfullargspec(prefect.Task.__init__).args[1:]
+    kwargs = {k: v for k, v in kwargs.items()
+              if k not in RUNTIME_OPTIONS and k not in prefect_params}
+    hasher = hashlib.sha256()
+    _update(hasher, (
+        fullname(task),
+        task.version,
+        args,
+        kwargs,
+        prefect.context.get('temp_url', None),
+        prefect.context.get('output_url', None),
+        inputs,
+    ))
+    return hasher.hexdigest()
+
+
+def output_signature(outputs: Any) -> Tuple:
+    """ Get the identity of the output files of a task run
+
+    Raises
+    ------
+    Uncacheable
+        When an output file was not saved to its backend.
+
+    """
+    return tuple(_file_identity(file) for file in _files(outputs))
+
+
+def outputs_exist(outputs: Any, signature: Tuple) -> bool:
+    """ Verify that the output files saved on the cache still exist, unchanged """
+    try:
+        current = output_signature(outputs)
+    except Exception:
+        logger.debug('Cached outputs %s no longer exist', outputs, exc_info=True)
+        return False
+    if current != signature:
+        return False
+    for file in _files(outputs):
+        if isinstance(file, QuetzalFile) and file.metadata['base'].get('state', None) == 'DELETED':
+            return False
+    return True
+
+
+def _files(value: Any) -> Iterator[FileAdapter]:
+    if isinstance(value, FileAdapter):
+        yield value
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from _files(item)
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _files(item)
+
+
+def _file_identity(file: FileAdapter) -> Tuple:
+    if isinstance(file, QuetzalFile) and file.id is not None:
+        checksum = file.metadata['base'].get('checksum', None)
+        if checksum is None:
+            raise Uncacheable(f'File {file} has no checksum')
+        return 'quetzal', file.id, checksum
+    if isinstance(file, LocalFile) and file.file.exists():
+        checksum, _ = file_checksum(file.file)
+        return 'local', file.dirname, file.basename, checksum
+    raise Uncacheable(f'File {file} is not saved')
+
+
+def _file_statuses(file: FileAdapter) -> Tuple:
+    # Tasks branch on the status of their inputs, e.g. a failed input makes a
+    # failed output
+    return tuple(sorted(
+        (family, repr(values['status'])) for family, values in file.metadata.items()
+        if family != 'base' and isinstance(values, dict) and 'status' in values
+    ))
+
+
+def _update(hasher, value: Any) -> None:
+    # Feed a canonical representation of a value to a hash
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes)):
+        hasher.update(repr((type(value).__name__, value)).encode())
+    elif isinstance(value, FileAdapter):
+        hasher.update(repr(('file', ) + _file_identity(value) + _file_statuses(value)).encode())
+    elif isinstance(value, (list, tuple)):
+        hasher.update(repr((type(value).__name__, len(value))).encode())
+        for item in value:
+            _update(hasher, item)
+    elif isinstance(value, dict):
+        hasher.update(repr(('dict', len(value))).encode())
+        for key in sorted(value, key=repr):
+            _update(hasher, key)
+            _update(hasher, value[key])
+    elif inspect.isclass(value) or inspect.isroutine(value):
+        hasher.update(repr(('code', value.__module__, value.__qualname__)).encode())
+    else:
+        try:
+            hasher.update(pickle.dumps(value, protocol=4))
+        except Exception as ex:
+            raise Uncacheable(f'Value {value!r} cannot be fingerprinted') from ex
@@ -0,0 +1,287 @@
+"""
+Prefect runners used to execute Iguazu flows
+
+Iguazu flows are executed with :py:class:`IguazuFlowRunner`, a regular prefect
+flow runner whose tasks are executed by :py:class:`IguazuTaskRunner`. This
+task runner prefetches the Quetzal metadata of the files received by a task
+in batches (see :py:meth:`iguazu.core.files.QuetzalFile.prefetch_metadata`),
+instead of letting each file download its own metadata when it is first
+accessed. This matters on mapped tasks, where each of the thousands of
+children would otherwise make its own request.
+
+When the task sets the
+:py:attr:`iguazu.core.options.TaskOptions.prefetch_inputs` option, the data
+of the input files of the next children of a mapped task is also downloaded
+in the background (see :py:mod:`iguazu.core.prefetch`).
+
+The Quetzal calls made while running each task are counted and timed (see
+:py:func:`iguazu.core.quetzal_client.account_calls`) and saved on the
+``quetzal_calls`` attribute of its final state, which is a dictionary like
+:py:meth:`iguazu.core.quetzal_client.CallAccounting.summary`. Likewise, the
+phases of each Iguazu task are measured (see :py:mod:`iguazu.core.profiling`)
+and saved on the ``task_profile`` attribute of its final state. When the
+flow is traced, the spans of each task run are saved on its ``trace_spans``
+attribute (see :py:mod:`iguazu.core.tracing`).
+
+Before submitting the children of a mapped Iguazu task, the task runner
+looks for their previous results in batches (see
+:py:meth:`iguazu.core.tasks.Task.find_previous_results`), and the children
+that have them are skipped without running.
+
+When the cache of the flow is a :py:class:`iguazu.core.state_cache.FlowStateCache`,
+cached states are saved on it as soon as each task finishes.
+"""
+
+import logging
+import sqlite3
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import prefect
+from prefect.engine.flow_runner import FlowRunner
+from prefect.engine.result import Result
+from prefect.engine.state import Mapped, State
+from prefect.engine.task_runner import TaskRunner
+
+from iguazu.core import prefetch, tracing
+from iguazu.core.files import QuetzalFile
+from iguazu.core.profiling import profile_task
+from iguazu.core.quetzal_client import account_calls, quetzal_client_stats
+from iguazu.core.result_cache import result_cache_stats
+from iguazu.core.state_cache import FlowStateCache
+from iguazu.helpers.states import SkippedResult
+
+logger = logging.getLogger(__name__)
+
+
+class IguazuTaskRunner(TaskRunner):
+    """Task runner that prefetches the Quetzal metadata of the task inputs"""
+
+    def run(self, *args, **kwargs) -> State:
+        # Tracing is requested on the context of the flow, which is sent to
+        # the task runners of every executor
+        context = kwargs.get('context', None) or {}
+        if context.get('trace', False) and not tracing.is_enabled():
+            tracing.enable()
+        map_index = context.get('map_index', None)
+        name = self.task.name if map_index is None else f'{self.task.name}[{map_index}]'
+
+        # The children of a mapped task have their own accounting: each one
+        # is run by its own task runner
+        with account_calls() as accounting, profile_task() as profile, tracing.collect_spans() as spans:
+            with tracing.span(name, 'task', task_class=type(self.task).__name__):
+                state = super().run(*args, **kwargs)
+        state.quetzal_calls = accounting.summary()
+        state.task_profile = profile.summary()
+        if tracing.is_enabled():
+            # Spans of the other threads of this process (e.g. prefetching)
+            # are sent with the first task run that ends after them
+            state.trace_spans = spans + tracing.drain_spans()
+        return state
+
+    def cache_result(self, state: State, inputs: Dict[str, Result]) -> State:
+        state = super().cache_result(state, inputs)
+        # Save the cached state now instead of waiting for the end of the
+        # flow run, so that it is not lost if the flow crashes
+        caches = prefect.context.get('caches', None)
+        if state.is_cached() and isinstance(caches, FlowStateCache):
+            try:
+                caches.append(self.task.cache_key or self.task.name, [state])
+            except (sqlite3.Error, OSError):
+                self.logger.warning('Could not save cached state of %s', self.task.name,
+                                    exc_info=True)
+        return state
+
+    def run_mapped_task(self, state, upstream_states, context, executor) -> State:
+        # Refresh the metadata of all the files that will be sent to the
+        # children before they are submitted to the executor
+        files = []
+        for edge, upstream_state in upstream_states.items():
+            if upstream_state.is_mapped():
+                # Mapped upstream states may be executor futures, only the
+                # finished states have a result that can be used here
+                for child_state in upstream_state.map_states:
+                    if isinstance(child_state, State):
+                        files.extend(_quetzal_files(child_state.result))
+            else:
+                files.extend(_quetzal_files(upstream_state.result))
+        _safe_prefetch(files)
+
+        options = getattr(self.task, 'meta', None)
+        if options is not None and getattr(options, 'prefetch_inputs', 0) > 0:
+            mapped_files = _mapped_files(upstream_states)
+            self.logger.debug('Prefetching %d input files of %s', len(mapped_files), self.task)
+            try:
+                prefetch.start_prefetch(self.task.slug, mapped_files,
+                                        lookahead=options.prefetch_inputs,
+                                        workers=options.prefetch_workers,
+                                        budget=options.prefetch_budget)
+            except Exception:
+                # Not a problem: each child will download its own inputs
+                self.logger.warning('Failed to prefetch the input files of %s', self.task,
+                                    exc_info=True)
+
+        if not state.is_mapped() and hasattr(self.task, 'find_previous_results'):
+            state = self._skip_previous_results(state, upstream_states, context)
+        return super().run_mapped_task(state, upstream_states, context, executor)
+
+    def _skip_previous_results(self, state, upstream_states, context) -> State:
+        """ Find the previous results of all the children before submitting them
+
+        Children with previous results start in a finished
+        :py:class:`SkippedResult` state, so that their task runner ends as
+        soon as it starts, without looking for them again.
+        """
+        children_inputs = _mapped_inputs(upstream_states)
+        known = [i for i, inputs in enumerate(children_inputs) if inputs is not None]
+        if not known:
+            return state
+        try:
+            with prefect.context(context):
+                previous = self.task.find_previous_results([children_inputs[i] for i in known])
+        except Exception:
+            # Not a problem: each child will look for its own previous results
+            self.logger.warning('Failed to find the previous results of %s', self.task.name,
+                                exc_info=True)
+            return state
+
+        map_states = [None] * len(children_inputs)
+        for i, result in zip(known, previous):
+            if result is not None:
+                map_states[i] = SkippedResult(message='Previous results already exist.',
+                                              result=result)
+        skipped = sum(s is not None for s in map_states)
+        self.logger.debug('%d of %d children of %s have previous results',
+                          skipped, len(map_states), self.task.name)
+        if not skipped:
+            return state
+        return Mapped(message=f'{skipped} children have previous results', map_states=map_states)
+
+    def get_task_inputs(self, state, upstream_states) -> Dict[str, Any]:
+        task_inputs = super().get_task_inputs(state, upstream_states)
+        # Only the files that would download their metadata anyway, so that
+        # a mapped child does not download the metadata prefetched by its
+        # parent again
+        files = [
+            file
+            for result in task_inputs.values()
+            for file in _quetzal_files(result.value)
+            if not file._metadata
+        ]
+        if len(files) > 1:
+            _safe_prefetch(files)
+
+        prefetcher = prefetch.get_prefetcher(self.task.slug)
+        if prefetcher is not None:
+            for result in task_inputs.values():
+                for file in _quetzal_files(result.value):
+                    prefetcher.consumed(file)
+        return task_inputs
+
+
+class IguazuFlowRunner(FlowRunner):
+    """Flow runner that uses :py:class:`IguazuTaskRunner` by default"""
+
+    def __init__(self, flow, task_runner_cls=None, **kwargs):
+        super().__init__(flow, task_runner_cls=task_runner_cls or IguazuTaskRunner, **kwargs)
+
+    def run(self, *args, **kwargs) -> State:
+        try:
+            return super().run(*args, **kwargs)
+        finally:
+            prefetch.stop_all()
+            stats = quetzal_client_stats()
+            if stats['total']:
+                self.logger.info('Quetzal requests of this process: %d (%d errors), '
+                                 '%.1f seconds in total', stats['total'], stats['errors'],
+                                 stats['latency_sum'])
+            cache_stats = result_cache_stats()
+            if cache_stats['hits'] or cache_stats['misses']:
+                self.logger.info('Result cache: %d hits, %d misses, %d evictions',
+                                 cache_stats['hits'], cache_stats['misses'],
+                                 cache_stats['evictions'])
+
+
+def _quetzal_files(value: Any) -> Iterator[QuetzalFile]:
+    if isinstance(value, QuetzalFile):
+        yield value
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            if isinstance(item, QuetzalFile):
+                yield item
+
+
+def _mapped_files(upstream_states) -> List[QuetzalFile]:
+    """Get the files of the mapped upstream edges, in the order of the children"""
+    sequences = []
+    for edge, upstream_state in upstream_states.items():
+        if not edge.mapped:
+            continue
+        if upstream_state.is_mapped():
+            values = [
+                child_state.result if isinstance(child_state, State) else None
+                for child_state in upstream_state.map_states
+            ]
+        else:
+            values = upstream_state.result
+        if isinstance(values, (list, tuple)):
+            sequences.append(values)
+
+    files = []
+    for i in range(max((len(seq) for seq in sequences), default=0)):
+        for seq in sequences:
+            if i < len(seq):
+                files.extend(_quetzal_files(seq[i]))
+    return files
+
+
+def _mapped_inputs(upstream_states) -> List[Optional[Dict[str, Any]]]:
+    """ Get the run keyword arguments of the children of a mapped task
+
+    Children whose mapped upstream states are not finished and successful
+    yet are ``None``.
+    """
+    constants, sequences = {}, {}
+    for edge, upstream_state in upstream_states.items():
+        if edge.key is None:
+            continue
+        if not edge.mapped:
+            if upstream_state.is_mapped():
+                # Reduced results of a mapped task: not worth resolving here
+                return []
+            constants[edge.key] = upstream_state.result
+        elif upstream_state.is_mapped():
+            sequences[edge.key] = [
+                child_state.result
+                if isinstance(child_state, State) and child_state.is_successful() else _UNKNOWN
+                for child_state in upstream_state.map_states
+            ]
+        elif isinstance(upstream_state.result, (list, tuple)):
+            sequences[edge.key] = upstream_state.result
+        else:
+            return []
+    if not sequences:
+        return []
+
+    children = []
+    for i in range(min(len(seq) for seq in sequences.values())):
+        values = {key: seq[i] for key, seq in sequences.items()}
+        if any(value is _UNKNOWN for value in values.values()):
+            children.append(None)
+        else:
+            children.append(dict(constants, **values))
+    return children
+
+
+_UNKNOWN = object()
+
+
+def _safe_prefetch(files: Iterable[QuetzalFile]) -> None:
+    files = list(files)
+    if not files:
+        return
+    try:
+        QuetzalFile.prefetch_metadata(files)
+    except Exception:
+        # Not a problem: each file will download its own metadata
+        logger.warning('Failed to prefetch the metadata of %d files', len(files),
+                       exc_info=True)
@@ -0,0 +1,264 @@
+""" Persistent cache of prefect task states
+
+Prefect looks up the previous states of a task on the ``caches`` dictionary of
+its context, keyed by the cache key (or name) of the task, to decide whether
+the task can reuse a cached result instead of running again. Iguazu used to
+load this dictionary from a pickle file when a flow started, and write it
+entirely when the flow ended. On large mapped flows this file grows without
+bound, takes a long time to read and write, and is lost when the flow crashes.
+
+:py:class:`FlowStateCache` replaces this dictionary with a mapping stored in a
+SQLite database, with one row per cached state:
+
+* Each task key is only read from the database when a task with this key
+  looks up its cached states, so starting a flow does not depend on the
+  number of cached states.
+* States are appended as soon as the task runner caches them (see
+  :py:class:`iguazu.core.runners.IguazuTaskRunner`), and again when prefect
+  updates the cache at the end of the flow run, in which case only new states
+  are written.
+* States expire after their ``cached_result_expiration`` (the ``cache_for``
+  option of the task, 7 days for Iguazu tasks). Expired states are never
+  returned, and are removed by :py:meth:`FlowStateCache.expire` and
+  :py:meth:`FlowStateCache.compact`. The latter also reclaims the space of the
+  database file, and is available as ``iguazu flows compact-cache``.
+
+The cache of ``iguazu flows run --cache`` is ``cache/task_states.sqlite3`` in
+the temporary directory of the flow.
+"""
+
+import hashlib
+import logging
+import os
+import pathlib
+import pickle
+import sqlite3
+import threading
+import time
+from collections.abc import MutableMapping
+from typing import Iterable, Iterator, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 7 * 24 * 60 * 60
+"""Time to live, in seconds, of the cached states without an expiration date."""
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS states (
+        key TEXT NOT NULL,
+        id TEXT NOT NULL,
+        expiration REAL NOT NULL,
+        state BLOB NOT NULL,
+        PRIMARY KEY (key, id)
+    )
+    """,
+    'CREATE INDEX IF NOT EXISTS states_expiration ON states (expiration)',
+)
+
+
+class FlowStateCache(MutableMapping):
+    """ Mapping of task keys to their cached states, stored on SQLite
+
+    Parameters
+    ----------
+    path
+        Location of the SQLite database. It is created if it does not exist.
+        ``None`` creates a cache in memory that is not persisted.
+    ttl
+        Time to live, in seconds, of the states that do not have an
+        expiration date.
+
+    """
+
+    def __init__(self, path: Optional[Union[str, pathlib.Path]] = None, ttl: float = DEFAULT_TTL):
+        self.path = None if path is None else pathlib.Path(path)
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._connection = None
+        self._pid = None
+        self._loaded = {}
+        self._stored = set()
+
+    def __getitem__(self, key: str) -> List:
+        with self._lock:
+            if key not in self._loaded:
+                rows = self._execute('SELECT id, state FROM states WHERE key = ? AND expiration > ? '
+                                     'ORDER BY rowid', (key, time.time()))
+                states = []
+                for state_id, payload in rows:
+                    try:
+                        states.append(pickle.loads(payload))
+                    except Exception:
+                        logger.warning('Could not read cached state %s of %s', state_id, key,
+                                       exc_info=True)
+                        continue
+                    self._stored.add((key, state_id))
+                self._loaded[key] = states
+                logger.debug('Loaded %d cached states of %s', len(states), key)
+            states = self._loaded[key]
+        if not states:
+            raise KeyError(key)
+        return list(states)
+
+    def __setitem__(self, key: str, states: Iterable) -> None:
+        # Append-only: states that are no longer in the list are kept on the
+        # database until they expire
+        states = list(states)
+        self.append(key, states)
+        with self._lock:
+            self._loaded[key] = states
+
+    def __delitem__(self, key: str) -> None:
+        with self._lock:
+            if key not in self:
+                raise KeyError(key)
+            self._execute('DELETE FROM states WHERE key = ?', (key, ), commit=True)
+            self._loaded.pop(key, None)
+            self._stored = {k for k in self._stored if k[0] != key}
+
+    def __contains__(self, key) -> bool:
+        rows = self._execute('SELECT 1 FROM states WHERE key = ? AND expiration > ? LIMIT 1',
+                             (key, time.time()))
+        return bool(rows)
+
+    def __iter__(self) -> Iterator[str]:
+        rows = self._execute('SELECT DISTINCT key FROM states WHERE expiration > ?', (time.time(), ))
+        return iter([row[0] for row in rows])
+
+    def __len__(self) -> int:
+        return self._execute('SELECT COUNT(DISTINCT key) FROM states WHERE expiration > ?',
+                             (time.time(), ))[0][0]
+
+    def __bool__(self) -> bool:
+        # Prefect tests the truth of the cache before each lookup; this is
+        # cheaper than counting the keys
+        return bool(self._execute('SELECT 1 FROM states LIMIT 1', ()))
+
+    def append(self, key: str, states: Iterable) -> int:
+        """ Save new cached states of a task key
+
+        States that were already saved or loaded by this instance are ignored.
+
+        Returns
+        -------
+        int
+            Number of states written.
+
+        """
+        rows = []
+        with self._lock:
+            for state in states:
+                state_id = _state_id(state)
+                if (key, state_id) in self._stored:
+                    continue
+                expiration = getattr(state, 'cached_result_expiration', None)
+                expiration = time.time() + self.ttl if expiration is None else expiration.timestamp()
+                rows.append((key, state_id, expiration,
+                             pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)))
+                self._stored.add((key, state_id))
+                if key in self._loaded and expiration > time.time():
+                    self._loaded[key].append(state)
+            if rows:
+                self._execute_many('INSERT OR IGNORE INTO states VALUES (?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def expire(self) -> int:
+        """ Remove the expired states
+
+        Returns
+        -------
+        int
+            Number of states removed.
+
+        """
+        with self._lock:
+            connection = self._connect()
+            count = connection.execute('DELETE FROM states WHERE expiration <= ?',
+                                       (time.time(), )).rowcount
+            connection.commit()
+        if count:
+            logger.debug('Removed %d expired states from %s', count, self.path)
+        return count
+
+    def compact(self) -> int:
+        """ Remove the expired states and reclaim their space on disk
+
+        Returns
+        -------
+        int
+            Number of states removed.
+
+        """
+        count = self.expire()
+        with self._lock:
+            self._connect().execute('VACUUM')
+        return count
+
+    def size(self) -> int:
+        """Number of states saved, including the expired ones"""
+        return self._execute('SELECT COUNT(*) FROM states', ())[0][0]
+
+    def _execute(self, sql, parameters, commit=False):
+        with self._lock:
+            connection = self._connect()
+            rows = connection.execute(sql, parameters).fetchall()
+            if commit:
+                connection.commit()
+            return rows
+
+    def _execute_many(self, sql, rows):
+        with self._lock:
+            connection = self._connect()
+            connection.executemany(sql, rows)
+            connection.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        # SQLite connections cannot be shared with a forked child process
+        if self._connection is None or self._pid != os.getpid():
+            if self.path is None:
+                database = ':memory:'
+            else:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                database = str(self.path)
+            self._connection = sqlite3.connect(database, timeout=30, check_same_thread=False)
+            for statement in _SCHEMA:
+                self._connection.execute(statement)
+            self._connection.commit()
+            self._pid = os.getpid()
+        return self._connection
+
+    def __getstate__(self):
+        # The cache is sent with the prefect context to each task run on a
+        # dask worker: only send its location, each process reads the keys
+        # that it needs
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_connection'] = None
+        state['_loaded'] = {}
+        state['_stored'] = set()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+
+def _state_id(state) -> str:
+    # Identify a state without pickling it: its expiration date is set with
+    # microseconds when it is cached, and the inputs distinguish the children
+    # of a mapped task
+    expiration = getattr(state, 'cached_result_expiration', None)
+    inputs = getattr(state, 'cached_inputs', None) or {}
+    parts = (
+        type(state).__name__,
+        None if expiration is None else expiration.isoformat(),
+        state.message,
+        sorted((k, repr(getattr(v, 'value', v))) for k, v in inputs.items()),
+    )
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def flow_state_cache(temp_dir: Union[str, pathlib.Path]) -> FlowStateCache:
+    """Get the state cache of the flows that use a temporary directory"""
+    return FlowStateCache(pathlib.Path(temp_dir) / 'cache' / 'task_states.sqlite3')
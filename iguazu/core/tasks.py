@@ -5,9 +5,10 @@ import inspect
 import logging
 import os
 import pathlib
+import sqlite3
 from typing import (
-    Any, Callable, Container, ContextManager, Iterable, List, Mapping, NoReturn,
-    Optional,
+    Any, Callable, Container, ContextManager, Hashable, Iterable, List, Mapping,
+    NoReturn, Optional,
 )
 
 import pandas as pd
@@ -16,12 +17,23 @@ from prefect.engine.signals import ENDRUN
 from prefect.utilities.exceptions import PrefectError
 
 from iguazu import __version__
+from iguazu.core.dataframes import (
+    DATAFRAME_CACHE, freeze, get_shared_dataframe, read_hdf_selection,
+)
 from iguazu.core.exceptions import PreviousResultsExist, SoftPreconditionFailed, GracefulFailWithResults
 from iguazu.core.options import TaskOptions, ALL_OPTIONS
 from iguazu.core.validators import GenericValidator
 from iguazu.core.files import FileAdapter, LocalFile, LocalURL, QuetzalFile, QuetzalURL
+from iguazu.core.files.metadata import buffered_metadata, current_metadata_writer
+from iguazu.core.files.quetzal import record_finds
 from iguazu.helpers.states import GracefulFail, SkippedResult
 from iguazu.core.handlers import garbage_collect_handler, logging_handler
+from iguazu.core.isolation import run_in_subprocess
+from iguazu.core.profiling import current_profile, profile_phase, profile_task, record_rows
+from iguazu.core.quetzal_client import account_calls, current_call_accounting
+from iguazu.core.result_cache import (
+    Uncacheable, default_result_cache, output_signature, outputs_exist, task_fingerprint,
+)
 from iguazu.utils import fullname
 
 logger = logging.getLogger(__name__)
@@ -63,30 +75,47 @@ class ManagedTask(prefect.Task):
         raise NotImplementedError
 
     def _managed_run(self, **inputs):
+        # Measure each phase of the task, on the profile of the task runner
+        # when there is one
+        with profile_task(reuse=True):
+            return self._profiled_run(**inputs)
+
+    def _profiled_run(self, **inputs):
         # Create context manager that handles dynamic contexts: a derived class
         # can add as many contexts as needed, but we need to do __enter__ and
         # __exit__ for each context manager. Fortunately, contextlib.ExitStack
         # was designed exactly for this case
         with contextlib.ExitStack() as stack:
 
-            # Add a prefect context so that any derived class can get the
-            # run keyword arguments
-            stack.enter_context(prefect.context(run_kwargs=inputs.copy()))
-            self._log_prefect_context()
+            with profile_phase('contexts'):
+                # Add a prefect context so that any derived class can get the
+                # run keyword arguments
+                stack.enter_context(prefect.context(run_kwargs=inputs.copy()))
+                self._log_prefect_context()
 
-            # Add all task context objects
-            for ctx in self.contexts():
-                stack.enter_context(ctx)
+                # Add all task context objects
+                for ctx in self.contexts():
+                    stack.enter_context(ctx)
 
             # Pre-process inputs. Failures are managed in the _safe... method
-            prepared_inputs = self._safe_prepare_inputs(None, **inputs)
-            prepared_inputs = prepared_inputs or {}  # handle empty kwargs so that it can be unpacked
+            with profile_phase('prepare_inputs'):
+                prepared_inputs = self._safe_prepare_inputs(None, **inputs)
+                prepared_inputs = prepared_inputs or {}  # handle empty kwargs so that it can be unpacked
+                record_rows(_count_rows(prepared_inputs.values()))
 
             # Run task. Failures are managed in the _safe... method
-            outputs = self._safe_run(None, **prepared_inputs)
+            with profile_phase('run'):
+                outputs = self._safe_run(None, **prepared_inputs)
+                record_rows(_count_rows(_iterate(outputs)))
 
             # Post-process outputs. Failures are managed in the _safe... method
-            prepared_outputs = self._safe_handle_outputs(outputs)
+            with profile_phase('handle_outputs'):
+                prepared_outputs = self._safe_handle_outputs(outputs)
+
+            # Leave the contexts here to measure them too (e.g. sending the
+            # buffered metadata). On failures, they are left by the with block
+            with profile_phase('contexts'):
+                stack.close()
 
             return prepared_outputs
 
@@ -176,7 +205,8 @@ class ManagedTask(prefect.Task):
             raise
 
         if exception is not None:
-            self._graceful_fail(exception)
+            with profile_phase('graceful_fail'):
+                self._graceful_fail(exception)
 
             # _graceful_fail does not return so this never occurs, but just
             # in case we make a mistake in the future, let us hard fail
@@ -206,6 +236,13 @@ class ManagedTask(prefect.Task):
 
 class Task(ManagedTask):
 
+    def __new__(cls, *args, **kwargs):
+        # Keep the constructor parameters, including those of derived
+        # classes, for the fingerprint of the result cache
+        instance = super().__new__(cls)
+        instance._init_arguments = (args, kwargs.copy())
+        return instance
+
     def __init__(self, **kwargs):
         # Manage prefect kwargs
         prefect_params = inspect.getfullargspec(prefect.Task.__init__).args[1:]
@@ -239,6 +276,49 @@ class Task(ManagedTask):
         super().__init__(**prefect_kwargs)
         self.logger.debug('Created %s with %s', self, self.meta)
 
+    def _managed_run(self, **inputs):
+        if not self.meta.result_cache or self.forced or not self.persist_outputs:
+            return super()._managed_run(**inputs)
+
+        cache = default_result_cache()
+        try:
+            key = task_fingerprint(self, inputs)
+        except Uncacheable as ex:
+            self.logger.debug('Result cache not used: %s', ex)
+            key = None
+        except Exception:
+            # e.g. the metadata of an input could not be downloaded: the task
+            # will deal with it when it runs
+            self.logger.warning('Could not fingerprint the inputs for the result cache',
+                                exc_info=True)
+            key = None
+        if cache is None or key is None:
+            return super()._managed_run(**inputs)
+
+        try:
+            hit, entry = cache.get(key)
+        except (sqlite3.Error, OSError):
+            self.logger.warning('Result cache %s failed', cache.path, exc_info=True)
+            return super()._managed_run(**inputs)
+        if hit:
+            outputs, signature = entry
+            if outputs_exist(outputs, signature):
+                self.logger.info('Using the outputs on the result cache')
+                raise ENDRUN(state=SkippedResult(message='Result cache hit', result=outputs))
+            self.logger.debug('Outputs on the result cache no longer exist')
+            cache.discard(key)
+
+        # Graceful and hard fails raise an ENDRUN signal and are not cached
+        outputs = super()._managed_run(**inputs)
+        try:
+            cache.put(key, self.name, (outputs, output_signature(outputs)))
+        except Uncacheable as ex:
+            self.logger.debug('Outputs not saved on the result cache: %s', ex)
+        except (sqlite3.Error, OSError):
+            self.logger.warning('Could not save outputs on result cache %s',
+                                cache.path, exc_info=True)
+        return outputs
+
     def contexts(self) -> Iterable[ContextManager]:
         ctxs = []
         pandas_mode = self.meta.pandas_chained_assignment
@@ -250,6 +330,14 @@ class Task(ManagedTask):
         # it is activated.
         ctxs.append(self._auto_clean_context)
 
+        # Count the Quetzal calls of this task, on the accounting of the task
+        # runner when there is one. Entered before the metadata buffer so
+        # that the calls sent when the buffer is flushed are counted too
+        ctxs.append(account_calls(reuse=True))
+
+        if self.meta.buffer_metadata:
+            ctxs.append(buffered_metadata())
+
         return tuple(ctxs)
 
     def preconditions(self, **inputs) -> NoReturn:
@@ -296,12 +384,8 @@ class Task(ManagedTask):
             # any call to create_file in default_outputs will delete any
             # pre-existing file
             default_output = self.default_outputs(**inputs)
-            if isinstance(default_output, FileAdapter):
-                default_output_meta = default_output.metadata.get(family, {})
-                default_base_meta = default_output.metadata['base']
-                if default_base_meta.get('state', None) != 'DELETED' and \
-                   default_output_meta.get('status', None) is not None:
-                    raise PreviousResultsExist('Previous results already exist')
+            if isinstance(default_output, FileAdapter) and self._is_previous_result(default_output):
+                raise PreviousResultsExist('Previous results already exist')
 
         # Precondition 2:
         # Inputs are *not* marked as a failed result from a previous task
@@ -321,6 +405,62 @@ class Task(ManagedTask):
     def postconditions(self, results) -> NoReturn:
         pass
 
+    def find_previous_results(self, inputs_list: List[Mapping]) -> List[Optional[FileAdapter]]:
+        """ Find the previous results of many runs of this task at once
+
+        This is the first precondition of :py:meth:`preconditions` for each
+        element of `inputs_list`, but the Quetzal files created by the
+        :py:meth:`default_outputs` of all the runs are searched with
+        :py:meth:`iguazu.core.files.QuetzalFile.find_many` instead of one
+        search per run. The task runner uses it before submitting the children
+        of a mapped task, so that the children with previous results are
+        skipped without running.
+
+        Parameters
+        ----------
+        inputs_list
+            The keyword arguments of the run method of each run.
+
+        Returns
+        -------
+        list
+            The previous result of each run, or ``None`` when there is none or
+            when it could not be determined without running the task.
+
+        """
+        results = [None] * len(inputs_list)
+        if self.forced or not self.meta.batch_previous_results:
+            return results
+
+        indices, requests = [], []
+        for i, inputs in enumerate(inputs_list):
+            # Record the searches of default_outputs instead of sending them
+            # Most default_outputs read the inputs from the context, as they
+            # do when they are called by the run method
+            with record_finds() as recorded, prefect.context(run_kwargs=dict(inputs)):
+                try:
+                    default_output = self.default_outputs(**inputs)
+                except Exception:
+                    self.logger.debug('Could not determine the default outputs of %s',
+                                      inputs, exc_info=True)
+                    continue
+            if isinstance(default_output, QuetzalFile) and len(recorded) == 1:
+                indices.append(i)
+                requests.append(recorded[0])
+        if not requests:
+            return results
+
+        for i, file in zip(indices, QuetzalFile.find_many(requests)):
+            if file is not None and self._is_previous_result(file):
+                results[i] = file
+        return results
+
+    def _is_previous_result(self, file: FileAdapter) -> bool:
+        """Whether a default output is a previous result of this task that was not deleted"""
+        family = self.meta.metadata_journal_family
+        return (file.metadata['base'].get('state', None) != 'DELETED' and
+                file.metadata.get(family, {}).get('status', None) is not None)
+
     def prepare_inputs(self, **inputs) -> Mapping:
 
         # Add inputs that are file adapters so they can be auto-cleaned when
@@ -369,6 +509,28 @@ class Task(ManagedTask):
             else:
                 key = None
 
+            # Inside a fused pipeline, the previous stage may have kept this
+            # dataframe in memory
+            if not args and not kwargs:
+                obj = get_shared_dataframe(file, key)
+                if obj is not None:
+                    self.logger.debug('managed_inputs: using in-memory dataframe for key=%s '
+                                      'for input %s on file %s, dataframe of shape %s',
+                                      key, k, file, obj.shape)
+                    inputs[k] = obj
+                    continue
+
+            # Try the process-wide dataframe cache before opening the file
+            cache_key = self._managed_input_cache_key(input_value, file, key, args, kwargs)
+            if cache_key is not None:
+                obj = DATAFRAME_CACHE.get(cache_key)
+                if obj is not None:
+                    self.logger.debug('managed_inputs: cache hit for key=%s for input %s '
+                                      'on file %s, dataframe of shape %s',
+                                      key, k, file, obj.shape)
+                    inputs[k] = obj
+                    continue
+
             self.logger.debug('managed_inputs: extracting key=%s for input %s on file %s',
                               key, k, file)
             with pd.HDFStore(file, 'r') as store:
@@ -384,7 +546,7 @@ class Task(ManagedTask):
                 else:
                     # Read the dataframe, but be careful when the key is a group and not a node
                     try:
-                        obj = pd.read_hdf(store, key, *args, **kwargs)
+                        obj, selection = read_hdf_selection(store, key, *args, **kwargs)
                     except TypeError:
                         self.logger.warning('Could read HDF5 key %s on file %s for input %s, '
                                             'yet the key does exists on the HDF5. '
@@ -404,10 +566,46 @@ class Task(ManagedTask):
                     else:
                         self.logger.debug('Input %s read into a dataframe of shape %s',
                                           k, obj.shape)
+                        if selection.bytes_avoided > 0:
+                            self.logger.debug('Input %s selection read %d of %d rows, '
+                                              'avoiding the read of %d bytes',
+                                              k, selection.rows_read, selection.rows_total,
+                                              selection.bytes_avoided)
+                        if cache_key is not None:
+                            # The entries added by this task are bounded by
+                            # its own budget
+                            DATAFRAME_CACHE.put(cache_key, obj, owner=self.name,
+                                                max_bytes=self.meta.managed_inputs_cache_size)
                     inputs[k] = obj
 
+        if self.meta.managed_inputs_cache_size > 0:
+            self.logger.debug('managed_inputs: dataframe cache stats %s',
+                              DATAFRAME_CACHE.stats())
+
         return inputs
 
+    def _managed_input_cache_key(self, input_value, file, key, args, kwargs) -> Optional[Hashable]:
+        """Key of a managed input on the process-wide dataframe cache
+
+        Quetzal files are immutable, so their identifier and checksum are
+        enough to identify their contents. Any other file (local files or
+        paths) can be overwritten in place, so they are identified by their
+        path, size and modification time.
+
+        Returns ``None`` when the cache is disabled for this task.
+        """
+        if self.meta.managed_inputs_cache_size <= 0:
+            return None
+
+        if isinstance(input_value, QuetzalFile) and input_value.id is not None:
+            checksum = input_value.metadata.get('base', {}).get('checksum', None)
+            identity = ('quetzal', input_value.id, checksum)
+        else:
+            file_stat = file.stat()
+            identity = ('local', str(file.resolve()), file_stat.st_size, file_stat.st_mtime_ns)
+
+        return identity + (key, freeze(args), freeze(kwargs))
+
     def handle_outputs(self, outputs) -> Any:
         # Set the metadata to the outputs that are file adapters.
         meta = self.default_metadata(None, **prefect.context.run_kwargs)
@@ -432,10 +630,19 @@ class Task(ManagedTask):
         self.postconditions(outputs)
 
         # Upload outputs that are file adapters
+        if not self.persist_outputs:
+            self.logger.debug('Outputs are not persisted: this task is an '
+                              'intermediate stage of a fused pipeline')
         for output in _iterate(outputs):
-            if isinstance(output, FileAdapter):
+            if isinstance(output, FileAdapter) and self.persist_outputs:
                 output.upload()
 
+        # Send the buffered metadata now, so that its errors are managed like
+        # those of the uploads. On a graceful fail, it is sent by
+        # _graceful_fail with the metadata of the failure
+        if not prefect.context.get('graceful_fail', False):
+            _flush_metadata()
+
         # Note: I tried to design and implement a mechanism here similar to
         #       prepare_inputs: It would use the .meta configuration to
         #       automatically convert any output dataframe into a hdf5 file.
@@ -471,10 +678,11 @@ class Task(ManagedTask):
                 'title': str(exception),
             }
 
+        family_name = self.meta.metadata_journal_family
         parents = []
         for value in inputs.values():
-            if isinstance(value, FileAdapter) and value.id is not None:
-                parents.append(value.id)
+            if isinstance(value, FileAdapter):
+                parents.extend(_parent_ids(value, family_name))
 
         # TODO: it would be useful to add the inputs to the journal.
         #       However, we need to "safe-convert" because if the __str__ of
@@ -483,7 +691,6 @@ class Task(ManagedTask):
         #       Maybe this would do the trick:
         #       'kwargs': prefect.context.get('input_kwargs', None),
 
-        family_name = self.meta.metadata_journal_family
         metadata = {
             family_name: {
                 'created_by': 'iguazu',
@@ -495,9 +702,30 @@ class Task(ManagedTask):
                 'parents': parents,
             }
         }
+        accounting = current_call_accounting()
+        if accounting is not None:
+            # Calls made so far: those made after this point (e.g. uploading
+            # the outputs) are only in the flow report
+            metadata[family_name]['quetzal_calls'] = accounting.summary()
+        profile = current_profile()
+        if profile is not None:
+            # Likewise, the phases measured so far
+            metadata[family_name]['profile'] = profile.summary()
         return metadata
 
     def auto_manage_input_dataframe(self, name, *args, **kwargs):
+        """ Declare a run parameter that is automatically read as a dataframe
+
+        When the task runs, the parameter `name` is converted from a
+        :py:class:`FileAdapter` (or a path) to a dataframe by reading the HDF5
+        key given by the first positional argument.
+
+        Use the `columns`, `where` and `time_range` keyword arguments to read
+        only a subset of the dataframe. These are pushed down to PyTables on
+        HDF5 nodes in table format, and applied after reading on nodes in
+        fixed format. See :py:func:`iguazu.core.dataframes.read_hdf_selection`.
+        Any other argument is passed to :py:func:`pandas.read_hdf`.
+        """
         if not hasattr(self, '_meta'):
             raise AttributeError(f'No meta member in {self.__class__.__name__}, '
                                  f'did you call the super constructor before '
@@ -544,16 +772,20 @@ class Task(ManagedTask):
         # Handle filenames, path, prefixes, etc
         parent_ids = []
         search_path = path or ''
+        journal_family = self.meta.metadata_journal_family
         if parent is not None:
-            search_path = path or '/'.join([url_object.path, parent.dirname])
+            if isinstance(url_object, QuetzalURL):
+                search_path = path or '/'.join([url_object.path, parent.dirname])
+            else:
+                # Local files are searched relative to the root of the URL
+                search_path = path or parent.dirname
             path = path or parent.dirname
             tmp = pathlib.Path(filename or parent.basename)
             filename = tmp.stem
             extension = extension or tmp.suffix
-            parent_ids = [parent.id]
+            parent_ids = _parent_ids(parent, journal_family)
         filename = ''.join([filename, suffix or '', extension or ''])
 
-        journal_family = self.meta.metadata_journal_family
         default_meta = self.default_metadata(None, **self.run_kwargs)
         match_meta = {journal_family: {}}
         important_keys = ('created_by', 'version', 'task', 'task_version')
@@ -613,6 +845,16 @@ class Task(ManagedTask):
     def run_kwargs(self) -> Mapping:
         return prefect.context.get('run_kwargs', {})
 
+    @property
+    def persist_outputs(self) -> bool:
+        """ Whether the file outputs of this task are uploaded to their backend
+
+        This is always true, except on the intermediate stages of a
+        :py:class:`iguazu.core.pipelines.FusedPipeline`, whose outputs are
+        only kept locally.
+        """
+        return prefect.context.get('persist_outputs', True)
+
     def _safe_prepare_inputs(self, safe_excs, **kws):
         safe_excs = safe_excs or ()
         safe_excs = tuple(set(safe_excs) | set(self.meta.graceful_exceptions))
@@ -621,8 +863,21 @@ class Task(ManagedTask):
     def _safe_run(self, safe_excs, **inputs) -> Any:
         safe_excs = safe_excs or ()
         safe_excs = tuple(set(safe_excs) | set(self.meta.graceful_exceptions))
+        if self.meta.isolation == 'subprocess':
+            # Exceptions of the child are raised again here, so the graceful
+            # and hard fails are managed exactly as without isolation
+            return self._generic_safe(functools.partial(self._isolated_run, **inputs),
+                                      graceful_excs=safe_excs)
         return super()._safe_run(safe_excs, **inputs)
 
+    def _isolated_run(self, **inputs) -> Any:
+        self.logger.debug('Running %s on a subprocess (timeout=%s, memory limit=%d)',
+                          self.name, self.meta.isolation_timeout,
+                          self.meta.isolation_memory_limit)
+        return run_in_subprocess(functools.partial(self.child_run, **inputs),
+                                 timeout=self.meta.isolation_timeout,
+                                 memory_limit=self.meta.isolation_memory_limit)
+
     def _graceful_fail(self, exc):
         kwargs = prefect.context.get('run_kwargs', {})
         meta = self.default_metadata(exc, **kwargs)
@@ -639,7 +894,8 @@ class Task(ManagedTask):
         # but then hijack it to set a custom state
         try:
             endrun = ENDRUN(state=GracefulFail())
-            super()._graceful_fail(exc)
+            with prefect.context(graceful_fail=True):
+                super()._graceful_fail(exc)
         except ENDRUN as signal:
             endrun = signal
 
@@ -652,7 +908,8 @@ class Task(ManagedTask):
             if isinstance(output, FileAdapter):
                 # TODO: update or replace?
                 output.metadata.update(meta)
-                output.upload()
+                if self.persist_outputs:
+                    output.upload()
 
         # Hijack/change the ManagedTask._graceful_fail for a different
         # state depending on the exception
@@ -665,6 +922,7 @@ class Task(ManagedTask):
                                      result=prepared_outputs)
             endrun.state = new_state
 
+        _flush_metadata()
         raise endrun
 
 
@@ -682,6 +940,12 @@ class AutoCleanContext:
         self._files: List[FileAdapter] = []
 
     def add(self, file: FileAdapter) -> None:
+        # Inside a fused pipeline, files are cleaned when the whole pipeline
+        # finishes, because the next stages may still need them
+        pipeline_context = prefect.context.get('pipeline_auto_clean', None)
+        if pipeline_context is not None and pipeline_context is not self:
+            pipeline_context.add(file)
+            return
         self._files.append(file)
 
     def __enter__(self):
@@ -696,6 +960,25 @@ class AutoCleanContext:
             file.clean()
 
 
+def _flush_metadata() -> None:
+    writer = current_metadata_writer()
+    if writer is not None:
+        writer.flush()
+
+
+def _parent_ids(file: FileAdapter, family: str) -> List[str]:
+    # A file that does not exist on its backend, such as the intermediate
+    # output of a fused pipeline that is not a checkpoint, has no id: its own
+    # parents take its place in the journal
+    if file.id is not None:
+        return [file.id]
+    return list(file.metadata.get(family, {}).get('parents', None) or [])
+
+
+def _count_rows(values) -> int:
+    return sum(len(v) for v in values if isinstance(v, (pd.DataFrame, pd.Series)))
+
+
 def _iterate(obj_or_tup):
     if obj_or_tup is None:
         return
@@ -0,0 +1,215 @@
+"""
+Timeline of a flow run in the Chrome trace event format
+
+The per-task numbers of :py:mod:`iguazu.core.profiling` do not show
+concurrency: which children of a mapped task overlapped, when the workers were
+idle, or how long a computation waited for a download. When tracing is
+enabled (with ``iguazu flows run --trace out.json``), Iguazu records a *span*,
+i.e. a named interval of time on a thread of a process, for:
+
+* each task run (category ``task``), by
+  :py:class:`iguazu.core.runners.IguazuTaskRunner`;
+* each phase of an Iguazu task (category ``phase``), by
+  :py:func:`iguazu.core.profiling.profile_phase`;
+* each I/O call of a :py:class:`iguazu.core.files.FileAdapter` (category
+  ``io``): ``find``, ``retrieve``, their batch versions, the metadata
+  prefetch, ``download_data``, ``download_metadata``, ``upload_data``,
+  ``upload_metadata`` and ``delete``.
+
+Spans are collected by thread, like the Quetzal calls: the spans of a task run
+are saved on the ``trace_spans`` attribute of its final state, which is sent
+back to the flow runner by any executor. Spans recorded on threads that do not
+run a task (e.g. the background downloads of :py:mod:`iguazu.core.prefetch`)
+are kept by their process until the next task run of the process ends, or
+until :py:func:`drain_spans` is called. Spans of the subprocesses of
+``isolation='subprocess'`` are sent back to their parent.
+
+:py:func:`write_chrome_trace` saves the spans in the Chrome trace event
+format, which can be opened with https://ui.perfetto.dev or ``chrome://tracing``.
+Timestamps are taken from the system clock, so that the spans of different
+processes of the same machine line up.
+"""
+
+import contextlib
+import functools
+import json
+import multiprocessing
+import os
+import pathlib
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Union
+
+_enabled = False
+_lock = threading.Lock()
+# Spans recorded outside a collect_spans context
+_orphans: List[Dict[str, Any]] = []
+_collectors = threading.local()
+
+
+def enable(enabled: bool = True) -> None:
+    """Enable (or disable) the recording of spans on this process"""
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled() -> bool:
+    """Whether spans are recorded on this process"""
+    return _enabled
+
+
+@contextlib.contextmanager
+def span(name: str, category: str, **args):
+    """ Record a span from the start to the end of this context
+
+    Nothing is recorded when tracing is not enabled. Keyword arguments are
+    saved with the span and shown by the trace viewers.
+    """
+    if not _enabled:
+        yield
+        return
+    start = time.time()
+    before = time.perf_counter()
+    try:
+        yield
+    finally:
+        thread = threading.current_thread()
+        add_spans([dict(
+            name=name,
+            cat=category,
+            ts=start * 1e6,
+            dur=(time.perf_counter() - before) * 1e6,
+            pid=os.getpid(),
+            tid=thread.ident,
+            process=multiprocessing.current_process().name,
+            thread=thread.name,
+            args={k: v for k, v in args.items() if v is not None},
+        )])
+
+
+def traced(category: str, name: Optional[str] = None,
+           describe: Optional[Callable[..., Dict[str, Any]]] = None) -> Callable:
+    """ Decorator that records a span for each call of a function
+
+    Parameters
+    ----------
+    category
+        Category of the spans.
+    name
+        Name of the spans. By default, the name of the function.
+    describe
+        Function called with the arguments of each call, which returns the
+        arguments saved with its span.
+
+    """
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            details = describe(*args, **kwargs) if describe is not None else {}
+            with span(span_name, category, **details):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def collect_spans() -> Iterator[List[Dict[str, Any]]]:
+    """ Collect the spans recorded by this thread until the end of this context
+
+    Contexts can be nested: spans are only added to the innermost context.
+    """
+    stack = _collectors.__dict__.setdefault('stack', [])
+    spans = []
+    stack.append(spans)
+    try:
+        yield spans
+    finally:
+        stack.pop()
+
+
+def add_spans(spans: Iterable[Dict[str, Any]]) -> None:
+    """Add spans, e.g. recorded by another process, to the current collection"""
+    stack = getattr(_collectors, 'stack', None)
+    if stack:
+        stack[-1].extend(spans)
+    else:
+        with _lock:
+            _orphans.extend(spans)
+
+
+def drain_spans() -> List[Dict[str, Any]]:
+    """Get and forget the spans recorded outside :py:func:`collect_spans` on this process"""
+    with _lock:
+        spans = list(_orphans)
+        _orphans.clear()
+    return spans
+
+
+def flow_spans(flow_state) -> List[Dict[str, Any]]:
+    """ Get the spans saved on the task states of a flow run
+
+    The spans recorded on this process outside the task runs are included.
+    """
+    spans = []
+    for state in (flow_state.result or {}).values():
+        spans.extend(getattr(state, 'trace_spans', None) or [])
+        if state.is_mapped():
+            for mapped_state in state.map_states:
+                spans.extend(getattr(mapped_state, 'trace_spans', None) or [])
+    spans.extend(drain_spans())
+    return spans
+
+
+def chrome_trace(spans: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """ Convert spans to the Chrome trace event format
+
+    Returns
+    -------
+    dict
+        A JSON-serializable dictionary with the ``traceEvents`` of the spans,
+        as complete (``X``) events, and the names of their processes and
+        threads, as metadata (``M``) events.
+    """
+    events = []
+    processes = {}
+    threads = {}
+    for s in sorted(spans, key=lambda s: s['ts']):
+        processes.setdefault(s['pid'], s['process'])
+        threads.setdefault((s['pid'], s['tid']), s['thread'])
+        events.append({
+            'name': s['name'],
+            'cat': s['cat'],
+            'ph': 'X',
+            'ts': round(s['ts'], 3),
+            'dur': round(s['dur'], 3),
+            'pid': s['pid'],
+            'tid': s['tid'],
+            'args': {k: v if isinstance(v, (int, float, bool)) else str(v) for k, v in s['args'].items()},
+        })
+    metadata = [
+        {'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+         'args': {'name': f'{name} ({pid})'}}
+        for pid, name in processes.items()
+    ] + [
+        {'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+        for (pid, tid), name in threads.items()
+    ]
+    return {'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}
+
+
+def write_chrome_trace(spans: Iterable[Dict[str, Any]], path: Union[str, pathlib.Path]) -> int:
+    """ Save spans as a Chrome trace JSON file
+
+    Returns
+    -------
+    int
+        Number of spans saved.
+    """
+    trace = chrome_trace(spans)
+    with open(path, 'w') as fd:
+        json.dump(trace, fd)
+    return sum(1 for e in trace['traceEvents'] if e['ph'] == 'X')
@@ -2,7 +2,7 @@ import logging
 
 from iguazu import __version__
 from iguazu.core.exceptions import SoftPreconditionFailed
-from iguazu.core.flows import PreparedFlow
+from iguazu.core.flows import IO_BOUND_EXECUTOR_DEFAULTS, PreparedFlow
 from iguazu.core.handlers import garbage_collect_handler, logging_handler
 from iguazu.flows.datasets import GenericDatasetFlow
 from iguazu.functions.behavior import SequenceNotFound
@@ -98,6 +98,7 @@ class BehaviorSummaryFlow(PreparedFlow):
     """Collect all  cardiac features in a single CSV file"""
 
     REGISTRY_NAME = 'summarize_behavior'
+    EXECUTOR_DEFAULTS = IO_BOUND_EXECUTOR_DEFAULTS
     DEFAULT_QUERY = f"""
         SELECT
                base->>'id'       AS id,        -- id is the bare minimum needed for the query task to work
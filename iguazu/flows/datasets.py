@@ -8,7 +8,7 @@ from prefect.tasks.control_flow import switch
 from prefect.tasks.control_flow.conditional import Merge
 from quetzal.client.cli import FamilyVersionListType
 
-from iguazu.core.flows import PreparedFlow
+from iguazu.core.flows import IO_BOUND_EXECUTOR_DEFAULTS, PreparedFlow
 from iguazu.tasks.common import AlwaysSucceed, Log, ListFiles
 from iguazu.core.handlers import logging_handler
 from iguazu.tasks.quetzal import CreateWorkspace, Query, ScanWorkspace
@@ -20,6 +20,7 @@ class LocalDatasetFlow(PreparedFlow):
     """Create a file dataset from a local directory"""
 
     REGISTRY_NAME = 'dataset_local'
+    EXECUTOR_DEFAULTS = IO_BOUND_EXECUTOR_DEFAULTS
 
     def _build(self, *,
                base_dir: str = None,
@@ -58,6 +59,7 @@ class QuetzalDatasetFlow(PreparedFlow):
     """Create a file dataset from a Quetzal query"""
 
     REGISTRY_NAME = 'dataset_quetzal'
+    EXECUTOR_DEFAULTS = IO_BOUND_EXECUTOR_DEFAULTS
 
     def _build(self, *,
                families=None,
@@ -66,6 +68,8 @@ class QuetzalDatasetFlow(PreparedFlow):
                workspace_name=None,
                limit=None,
                shuffle=False,
+               seed=None,
+               cache_ttl=None,
                **kwargs):
         # Manage parameters
         families = families or dict(base=None)
@@ -79,6 +83,7 @@ class QuetzalDatasetFlow(PreparedFlow):
         else:
             sql = None
         dialect = dialect or 'postgresql'
+        cache_ttl = cache_ttl or 0
 
         # Instantiate tasks
         create_or_retrieve = CreateWorkspace(
@@ -92,7 +97,7 @@ class QuetzalDatasetFlow(PreparedFlow):
         )
         scan = ScanWorkspace(
             # Iguazu task constructor arguments
-            # ... None ...
+            cache_ttl=cache_ttl,
             # Prefect task arguments
             name='ScanWorkspace',  # Needs to set name otherwise it will be named _WorkspaceOperation
             state_handlers=[logging_handler],
@@ -103,6 +108,8 @@ class QuetzalDatasetFlow(PreparedFlow):
             as_file_adapter=True,
             limit=limit,
             shuffle=shuffle,
+            seed=seed,
+            cache_ttl=cache_ttl,
             # Prefect task arguments
             state_handlers=[logging_handler],
             cache_validator=never_use,
@@ -115,7 +122,8 @@ class QuetzalDatasetFlow(PreparedFlow):
             upstream = AlwaysSucceed(name='trigger')
             wid = create_or_retrieve(upstream_tasks=[upstream])
             wid_ready = scan(wid)  # wid_ready == wid, but we are using to set the task dependencies
-            dataset = query(query=sql, dialect=sql_dialect, workspace_id=wid_ready)
+            dataset = query(query=sql, dialect=sql_dialect, workspace_id=wid_ready,
+                            families=list(families))
 
             self.set_reference_tasks([dataset])
 
@@ -143,6 +151,14 @@ class QuetzalDatasetFlow(PreparedFlow):
             click.option('--shuffle/--no-shuffle', is_flag=True, default=False,
                          help='Randomly shuffle the query results before selecting with '
                               '--limit and returning the results.'),
+            click.option('--seed', metavar='N', required=False, type=click.INT,
+                         help='Seed of the random order of --shuffle, to obtain the same '
+                              'sample of results on different executions.'),
+            click.option('--cache-ttl', metavar='SECONDS', required=False, type=click.FLOAT,
+                         help='Skip the scan of the workspace and reuse the results of the '
+                              'same query for SECONDS, unless the workspace was modified '
+                              'by Iguazu in the meantime. Changes made by other clients '
+                              'are not detected until then.'),
         )
 
 
@@ -150,6 +166,7 @@ class GenericDatasetFlow(PreparedFlow):
     """Create a file dataset from a local directory or Quetzal query"""
 
     REGISTRY_NAME = 'dataset_generic'
+    EXECUTOR_DEFAULTS = IO_BOUND_EXECUTOR_DEFAULTS
 
     def _build(self, *, data_source=None, **kwargs):
         local_flow = LocalDatasetFlow(**kwargs)
@@ -190,6 +207,7 @@ class ShowDatasetFlow(PreparedFlow):
     """Show all files from a file dataset"""
 
     REGISTRY_NAME = 'dataset_show'
+    EXECUTOR_DEFAULTS = IO_BOUND_EXECUTOR_DEFAULTS
 
     def _build(self, **kwargs):
         dataset_flow = GenericDatasetFlow(**kwargs)
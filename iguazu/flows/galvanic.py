@@ -1,8 +1,11 @@
 import logging
 
+import click
+
 from iguazu import __version__
 from iguazu.core.exceptions import SoftPreconditionFailed
-from iguazu.core.flows import PreparedFlow
+from iguazu.core.flows import IO_BOUND_EXECUTOR_DEFAULTS, PreparedFlow
+from iguazu.core.pipelines import FusedPipeline, PipelineStage
 from iguazu.flows.datasets import GenericDatasetFlow
 from iguazu.functions.galvanic import GSRArtifactCorruption
 from iguazu.tasks.common import LoadDataframe, MergeDataframes, SlackTask
@@ -38,7 +41,7 @@ class GalvanicFeaturesFlow(PreparedFlow):
     ORDER BY id                                     -- always in the same order
         """
 
-    def _build(self, **kwargs):
+    def _build(self, *, fused=False, fused_checkpoints=None, cvx_jobs=None, **kwargs):
         # Force required families: Quetzal workspace must have the following
         # families: (nb: None means "latest" version)
         required_families = dict(
@@ -83,6 +86,7 @@ class GalvanicFeaturesFlow(PreparedFlow):
         cvx = ApplyCVX(
             signals_hdf5_key='/iguazu/signal/gsr/downsampled',
             output_hdf5_key='/iguazu/signal/gsr/cvx',
+            n_jobs=cvx_jobs,
         )
         scrpeaks = DetectSCRPeaks(
             signals_hdf5_key='/iguazu/signal/gsr/cvx',
@@ -103,26 +107,48 @@ class GalvanicFeaturesFlow(PreparedFlow):
                                     'Task report:')
         with self:
             create_noresult = create_flow_metadata.map(parent=raw_signals)
-            # Signal processing branch
-            clean_signals = clean.map(signals=raw_signals,
-                                      annotations=raw_signals,
-                                      events=events,
+            if fused:
+                # Signal processing and feature extraction on a single task
+                pipeline = FusedPipeline(
+                    stages=[
+                        PipelineStage('clean', clean,
+                                      dict(signals='raw', annotations='raw', events='events')),
+                        PipelineStage('downsample', downsample,
+                                      dict(signals='clean', annotations='clean')),
+                        PipelineStage('cvx', cvx,
+                                      dict(signals='downsample', annotations='downsample')),
+                        PipelineStage('scrpeaks', scrpeaks,
+                                      dict(signals='cvx', annotations='cvx')),
+                        PipelineStage('features', extract_features,
+                                      dict(cvx='cvx', scrpeaks='scrpeaks', events='events', parent='raw')),
+                    ],
+                    checkpoints=fused_checkpoints,
+                    name='GalvanicFusedPipeline',
+                )
+                features = pipeline.map(raw=raw_signals,
+                                        events=events,
+                                        upstream_tasks=[create_noresult])
+            else:
+                # Signal processing branch
+                clean_signals = clean.map(signals=raw_signals,
+                                          annotations=raw_signals,
+                                          events=events,
+                                          upstream_tasks=[create_noresult])
+                downsample_signals = downsample.map(signals=clean_signals,
+                                                    annotations=clean_signals,
+                                                    upstream_tasks=[create_noresult])
+                cvx_signals = cvx.map(signals=downsample_signals,
+                                      annotations=downsample_signals,
                                       upstream_tasks=[create_noresult])
-            downsample_signals = downsample.map(signals=clean_signals,
-                                                annotations=clean_signals,
-                                                upstream_tasks=[create_noresult])
-            cvx_signals = cvx.map(signals=downsample_signals,
-                                  annotations=downsample_signals,
-                                  upstream_tasks=[create_noresult])
-            scr_peaks = scrpeaks.map(signals=cvx_signals,
-                                     annotations=cvx_signals,
-                                     upstream_tasks=[create_noresult])
-
-            # Feature extraction
-            features = extract_features.map(cvx=cvx_signals,
-                                            scrpeaks=scr_peaks,
-                                            events=events,
-                                            parent=raw_signals)
+                scr_peaks = scrpeaks.map(signals=cvx_signals,
+                                         annotations=cvx_signals,
+                                         upstream_tasks=[create_noresult])
+
+                # Feature extraction
+                features = extract_features.map(cvx=cvx_signals,
+                                                scrpeaks=scr_peaks,
+                                                events=events,
+                                                parent=raw_signals)
             features_with_metadata = propagate_metadata.map(parent=raw_signals, child=features)
             update_noresult = update_flow_metadata.map(parent=raw_signals, child=features_with_metadata)
             # Send slack notification
@@ -133,13 +159,26 @@ class GalvanicFeaturesFlow(PreparedFlow):
 
     @staticmethod
     def click_options():
-        return GenericDatasetFlow.click_options()
+        return GenericDatasetFlow.click_options() + (
+            click.option('--fused/--no-fused', is_flag=True, default=False,
+                         help='Run the signal processing and feature extraction of each '
+                              'file on a single task, without uploading the intermediate '
+                              'results.'),
+            click.option('--fused-checkpoints', multiple=True,
+                         type=click.Choice(['clean', 'downsample', 'cvx', 'scrpeaks']),
+                         help='Intermediate results that are uploaded even when using '
+                              '--fused. Can be used several times.'),
+            click.option('--cvx-jobs', type=click.INT, default=None,
+                         help='Number of worker processes used to solve the cvxEDA '
+                              'epochs of each file. Use -1 for one process per CPU.'),
+        )
 
 
 class GalvanicSummaryFlow(PreparedFlow):
     """Collect all  galvanic features in a single CSV file"""
 
     REGISTRY_NAME = 'summarize_galvanic'
+    EXECUTOR_DEFAULTS = IO_BOUND_EXECUTOR_DEFAULTS
     DEFAULT_QUERY = f"""
     SELECT
            base->>'id'       AS id,        -- id is the bare minimum needed for the query task to work
@@ -1,7 +1,7 @@
 import logging
 
 from iguazu import __version__
-from iguazu.core.flows import PreparedFlow
+from iguazu.core.flows import IO_BOUND_EXECUTOR_DEFAULTS, PreparedFlow
 from iguazu.flows.datasets import GenericDatasetFlow
 from iguazu.tasks.common import LoadDataframe, MergeDataframes, SlackTask
 from iguazu.tasks.metadata import CreateFlowMetadata, UpdateFlowMetadata, PropagateMetadata
@@ -106,6 +106,7 @@ class RespirationSummaryFlow(PreparedFlow):
     """Collect all  respiration features in a single CSV file"""
 
     REGISTRY_NAME = 'summarize_respiration'
+    EXECUTOR_DEFAULTS = IO_BOUND_EXECUTOR_DEFAULTS
     DEFAULT_QUERY = f"""
     SELECT
            base->>'id'       AS id,        -- id is the bare minimum needed for the query task to work
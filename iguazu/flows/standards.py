@@ -6,10 +6,7 @@ from iguazu.flows.datasets import GenericDatasetFlow
 from iguazu.tasks.common import MergeHDF5, SlackTask
 from iguazu.tasks.metadata import CreateFlowMetadata, UpdateFlowMetadata
 from iguazu.tasks.standards import Report
-from iguazu.tasks.vr import (
-    ExtractNexusGSRSignal, ExtractNexusSignal,
-    ExtractStandardEvents,
-)
+from iguazu.tasks.vr import ExtractNexusSignals, ExtractStandardEvents
 
 logger = logging.getLogger(__name__)
 
@@ -67,26 +64,18 @@ class StandardizeVRFlow(PreparedFlow):
             output_hdf5_key='/iguazu/events/standard',
         )
         # filter_vr = FilterVRSequences()
-        standardize_ppg_signals = ExtractNexusSignal(
-            name='NexusToStandardPPG',
+        # All Nexus signals are standardized from a single read of the raw
+        # file and a single resampling pass
+        standardize_signals = ExtractNexusSignals(
+            name='NexusToStandardSignals',
             signals_hfd5_key='/nexus/signal/nexus_signal_raw',
-            output_hdf5_key='/iguazu/signal/ppg/standard',
-            source_column='G',
-            target_column='PPG',
-        )
-        standardize_gsr_signals = ExtractNexusGSRSignal(
-            name='NexusToStandardGSR',
-            signals_hfd5_key='/nexus/signal/nexus_signal_raw',
-            output_hdf5_key='/iguazu/signal/gsr/standard',
-            source_column='F',
-            target_column='GSR',
-        )
-        standardize_pzt_signals = ExtractNexusSignal(
-            name='NexusToStandardPZT',
-            signals_hfd5_key='/nexus/signal/nexus_signal_raw',
-            output_hdf5_key='/iguazu/signal/pzt/standard',
-            source_column='H',
-            target_column='PZT',
+            channels={
+                'G': 'PPG',
+                'F': 'GSR',
+                'H': 'PZT',
+            },
+            gsr_column='GSR',
+            output_hdf5_key_template='/iguazu/signal/{name}/standard',
         )
         merge = MergeHDF5(
             suffix='_standard',
@@ -106,15 +95,11 @@ class StandardizeVRFlow(PreparedFlow):
             create_noresult = create_flow_metadata.map(parent=raw_files)
             standard_events = standardize_events.map(events=raw_files, upstream_tasks=[create_noresult])
             # vr_sequences = filter_vr.map(events=standard_events)
-            standard_ppg = standardize_ppg_signals.map(signals=raw_files, upstream_tasks=[create_noresult])
-            standard_gsr = standardize_gsr_signals.map(signals=raw_files, upstream_tasks=[create_noresult])
-            standard_pzt = standardize_pzt_signals.map(signals=raw_files, upstream_tasks=[create_noresult])
+            standard_signals = standardize_signals.map(signals=raw_files, upstream_tasks=[create_noresult])
             merged = merge.map(
                 parent=raw_files,
                 events=standard_events,
-                PPG=standard_ppg,
-                GSR=standard_gsr,
-                PZT=standard_pzt,
+                signals=standard_signals,
             )
             update_noresult = update_flow_metadata.map(parent=raw_files, child=merged)
             message = report(files=merged, upstream_tasks=[update_noresult])
@@ -2,7 +2,7 @@ import logging
 
 from iguazu import __version__
 from iguazu.core.exceptions import SoftPreconditionFailed
-from iguazu.core.flows import PreparedFlow
+from iguazu.core.flows import IO_BOUND_EXECUTOR_DEFAULTS, PreparedFlow
 from iguazu.flows.datasets import GenericDatasetFlow
 from iguazu.functions.surveys import NoSurveyReport
 from iguazu.tasks.common import SlackTask, LoadDataframe, MergeDataframes
@@ -17,6 +17,7 @@ class SurveysFeaturesFlow(PreparedFlow):
     """Extract all surveys features from a file dataset"""
 
     REGISTRY_NAME = 'features_surveys'
+    EXECUTOR_DEFAULTS = IO_BOUND_EXECUTOR_DEFAULTS
     DEFAULT_QUERY = f"""
     SELECT base->>'id'       AS id,        -- id is the bare minimum needed for the query task to work
            base->>'filename' AS filename,  -- this is just to help the human debugging this
@@ -112,6 +113,7 @@ class SurveysSummaryFlow(PreparedFlow):
     """Collect all  cardiac features in a single CSV file"""
 
     REGISTRY_NAME = 'summarize_surveys'
+    EXECUTOR_DEFAULTS = IO_BOUND_EXECUTOR_DEFAULTS
     DEFAULT_QUERY = f"""
         SELECT
                base->>'id'       AS id,        -- id is the bare minimum needed for the query task to work
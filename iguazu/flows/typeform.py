@@ -3,7 +3,7 @@ from prefect import unmapped
 from prefect.tasks.core.operators import GetItem
 
 from iguazu import __version__
-from iguazu.core.flows import PreparedFlow
+from iguazu.core.flows import IO_BOUND_EXECUTOR_DEFAULTS, PreparedFlow
 from iguazu.flows.datasets import GenericDatasetFlow
 from iguazu.tasks.common import LoadDataframe, LoadJSON, MergeDataframes, SlackTask
 from iguazu.tasks.metadata import (
@@ -19,6 +19,7 @@ class DownloadTypeform(PreparedFlow):
     """Download typeform responses to files"""
 
     REGISTRY_NAME = 'download_typeform'
+    EXECUTOR_DEFAULTS = IO_BOUND_EXECUTOR_DEFAULTS
 
     def _build(self, *,
                base_url=DEFAULT_BASE_URL,
@@ -76,6 +77,7 @@ class ExtractTypeformFeatures(PreparedFlow):
     """Extract all psychological features from typeform responses"""
 
     REGISTRY_NAME = 'features_typeform'
+    EXECUTOR_DEFAULTS = IO_BOUND_EXECUTOR_DEFAULTS
     DEFAULT_QUERY = f"""
 SELECT base->>'id'         AS id,        -- id is the bare minimum needed for the query task to work
        base->>'filename'   AS filename   -- this is just to help the human debugging this
@@ -148,6 +150,7 @@ class SummarizeTypeformFlow(PreparedFlow):
     """ Collect all typeform features in a single CSV file """
 
     REGISTRY_NAME = 'summarize_typeform'
+    EXECUTOR_DEFAULTS = IO_BOUND_EXECUTOR_DEFAULTS
     DEFAULT_QUERY = f"""
 SELECT base->>'id'       AS id,        -- id is the bare minimum needed for the query task to work
        base->>'filename' AS filename  -- this is just to help the human debugging this
@@ -1,4 +1,6 @@
 import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
 
 import numpy as np
@@ -12,6 +14,7 @@ from dsu.pandas_helpers import estimate_rate
 from sklearn.metrics import auc
 from sklearn.preprocessing import RobustScaler
 
+from iguazu.core.exceptions import SoftPreconditionFailed
 from iguazu.core.features import dataclass_to_dataframe
 from iguazu.functions.unity import VALID_SEQUENCE_KEYS
 
@@ -129,8 +132,99 @@ def downsample(signals, sampling_rate):
     return drop_rows(signals, sampling_rate)
 
 
+CVX_BYTES_PER_SAMPLE = 3 << 10
+"""Approximate memory used by cvxEDA per sample of the signal, in bytes"""
+
+CVX_DELTA_KNOT = 10
+"""Time, in seconds, between the spline knots of the cvxEDA tonic component"""
+
+
+def cvx_memory_estimate(n_samples, fs, delta_knot=CVX_DELTA_KNOT):
+    """ Estimate the memory used by cvxEDA to solve a signal
+
+    The estimate has a term linear on the number of samples, for the sparse
+    matrices of the problem and the solver iterations, and a quadratic term on
+    the number of spline knots, for the dense blocks of the tonic component.
+    It is an approximation meant to be conservative; compare it with the peak
+    memory of the process when tuning :py:data:`CVX_BYTES_PER_SAMPLE`.
+
+    Parameters
+    ----------
+    n_samples: int
+        Number of samples of the signal.
+    fs: float
+        Sampling rate of the signal, in Hz.
+    delta_knot: float
+        Time between spline knots, as in the `delta_knot` parameter of cvxEDA.
+
+    Returns
+    -------
+    int
+        Estimated memory, in bytes.
+
+    """
+    n_knots = n_samples / (delta_knot * fs) + 3
+    return int(CVX_BYTES_PER_SAMPLE * n_samples + 8 * n_knots ** 2)
+
+
+def cvx_epoch_size(n_samples, fs, memory_budget, warmup_duration=15, epoch_overlap=60,
+                   n_jobs=None, cvxeda_params=None):
+    """ Choose the cvxEDA epoch size that fits in a memory budget
+
+    Parameters
+    ----------
+    n_samples: int
+        Number of samples of the signal.
+    fs: float
+        Sampling rate of the signal, in Hz.
+    memory_budget: int
+        Memory, in bytes, that the cvxEDA deconvolution may use.
+    warmup_duration: float
+        Warm up duration, as in :py:func:`galvanic_cvx`.
+    epoch_overlap: float
+        Epoch overlap, as in :py:func:`galvanic_cvx`. This is the smallest
+        epoch size that can be chosen.
+    n_jobs: int | None
+        Number of worker processes, as in :py:func:`galvanic_cvx`. Each worker
+        solves one epoch at a time, so the budget is shared among them.
+    cvxeda_params:
+        Keywords arguments of cvxEDA, used for its `delta_knot` parameter.
+
+    Returns
+    -------
+    epoch_size: float | None
+        Epoch size, in seconds, or ``None`` when the whole signal can be
+        solved at once.
+    estimate: int
+        Estimated memory, in bytes, of the chosen path.
+
+    """
+    delta_knot = (cvxeda_params or {}).get('delta_knot', CVX_DELTA_KNOT)
+    whole = cvx_memory_estimate(n_samples, fs, delta_knot)
+    if whole <= memory_budget:
+        return None, whole
+
+    n_workers = resolve_n_jobs(n_jobs)
+    n_warmup = int(warmup_duration * fs)
+    # Largest epoch size, in whole seconds, whose footprint times the number
+    # of workers fits in the budget. The estimate is monotonic on the size.
+    lo, hi = int(epoch_overlap), max(int(n_samples / fs), int(epoch_overlap))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if n_workers * cvx_memory_estimate(int(mid * fs) + n_warmup, fs, delta_knot) <= memory_budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    estimate = n_workers * cvx_memory_estimate(int(lo * fs) + n_warmup, fs, delta_knot)
+    if estimate > memory_budget:
+        logger.warning('Smallest cvxEDA epoch of %d s needs an estimated %.2f GB, '
+                       'which exceeds the memory budget of %.2f GB',
+                       lo, estimate / (1 << 30), memory_budget / (1 << 30))
+    return lo, estimate
+
+
 def galvanic_cvx(signals, annotations, column=None, warmup_duration=15, threshold_scr=4.0,
-                 cvxeda_params=None, epoch_size=None, epoch_overlap=None):
+                 cvxeda_params=None, epoch_size=None, epoch_overlap=None, n_jobs=None):
     """ Separate galvanic components using a convex deconvolution.
 
     This function separates the phasic (SCR) and tonic (SCL) galvanic components
@@ -141,6 +235,8 @@ def galvanic_cvx(signals, annotations, column=None, warmup_duration=15, threshol
     Python global interpreter lock (GIL). This makes everything more difficult,
     in particular for Iguazu. In order to manage this, one can do the algorithm
     by epochs using both the `epoch_size` and `epoch_overlap` parameters.
+    Epochs are independent, so they can also be solved in parallel worker
+    processes with the `n_jobs` parameter.
 
     Parameters
     ----------
@@ -161,6 +257,10 @@ def galvanic_cvx(signals, annotations, column=None, warmup_duration=15, threshol
     epoch_overlap: float
         Size in seconds of the epoch overlap. When set to ``None``, cvxEDA will
         be applied only once on the whole signal.
+    n_jobs: int | None
+        Number of worker processes used to solve the epochs. When set to
+        ``None`` or 1, epochs are solved serially in the current process.
+        When set to -1, one process per CPU is used.
 
     Returns
     -------
@@ -205,28 +305,29 @@ def galvanic_cvx(signals, annotations, column=None, warmup_duration=15, threshol
     else:
         logger.debug('cvxEDA complete implementation')
 
-    epochs = []
-    for i, idx in enumerate(idx_epochs):
-        logger.debug('Epoch %d / %d', i + 1, len(idx_epochs))
-        chunk = signals.iloc[idx][[column]].dropna()
-        if not chunk.empty:
-            chunk = (
-                apply_cvxEDA(chunk, **cvxeda_params)
-                    .iloc[idx_warmup]
-                    .rename_axis(index='epoched_index')
-                    .reset_index()
-            )
-            epochs.append(chunk)
-
-    if not epochs:
+    # keep the integer positions of each chunk so that the epochs can be
+    # merged back even when the index has duplicated timestamps
+    valid = signals[column].notna().to_numpy()
+    positions = [idx[valid[idx]] for idx in idx_epochs]
+    positions = [pos for pos in positions if len(pos) > 0]
+    chunks = [signals.iloc[pos][[column]] for pos in positions]
+    if not chunks:
         return pd.DataFrame(), pd.DataFrame()  # or None?
 
-    signals = (
-        pd.concat(epochs, ignore_index=False)
-            .groupby('epoched_index')
-            .mean()
-            .rename_axis(index=signals.index.name)
-    )
+    n_workers = min(resolve_n_jobs(n_jobs), len(chunks))
+    if n_workers > 1:
+        logger.debug('Solving %d epochs with %d worker processes', len(chunks), n_workers)
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            epochs = list(executor.map(_cvx_epoch, chunks,
+                                       [cvxeda_params] * len(chunks),
+                                       [idx_warmup] * len(chunks)))
+    else:
+        epochs = []
+        for i, chunk in enumerate(chunks):
+            logger.debug('Epoch %d / %d', i + 1, len(chunks))
+            epochs.append(_cvx_epoch(chunk, cvxeda_params, idx_warmup))
+
+    signals = _overlap_add(epochs, signals.index, [pos[idx_warmup] for pos in positions])
 
     # add an annotation rejection boolean on amplitude criteria
     # todo: helpers with inputs: data, annotations, and index or bool condition, that sets values in data to NaN and annotate in annotations
@@ -244,6 +345,69 @@ def galvanic_cvx(signals, annotations, column=None, warmup_duration=15, threshol
     return signals, annotations
 
 
+def resolve_n_jobs(n_jobs):
+    """ Get the number of worker processes of the `n_jobs` parameter of :py:func:`galvanic_cvx`
+
+    Parameters
+    ----------
+    n_jobs: int | None
+        Number of worker processes, as in :py:func:`galvanic_cvx`.
+
+    Returns
+    -------
+    int
+        Number of worker processes, which is at least one.
+
+    """
+    if n_jobs is None:
+        return 1
+    if n_jobs < 0:
+        return os.cpu_count() or 1
+    return max(n_jobs, 1)
+
+
+def _cvx_epoch(chunk, cvxeda_params, idx_warmup):
+    """ Apply cvxEDA on one epoch and drop its warm up samples
+
+    This is a module-level function so that it can be sent to worker processes.
+    """
+    return apply_cvxEDA(chunk, **cvxeda_params).iloc[idx_warmup]
+
+
+def _overlap_add(epochs, index, positions=None):
+    """ Merge overlapping epochs by averaging the values of each sample
+
+    Each epoch is accumulated on arrays that span the complete `index`, along
+    with the number of valid (non-NaN) values per sample. Samples not covered
+    by any epoch are dropped. This is equivalent to concatenating the epochs
+    and taking the mean grouped by index, without the cost of the groupby.
+
+    Epochs are placed by the labels of their index, which must then be
+    unique. When `index` has duplicated labels (e.g. resampled data), the
+    integer `positions` in `index` of the samples of each epoch must be given.
+    """
+    if positions is None:
+        if not index.is_unique:
+            raise SoftPreconditionFailed('Cannot merge the cvxEDA epochs of signals '
+                                         'whose index has duplicated timestamps')
+        positions = [index.get_indexer(epoch.index) for epoch in epochs]
+
+    columns = epochs[0].columns
+    totals = np.zeros((len(index), len(columns)))
+    counts = np.zeros((len(index), len(columns)))
+    covered = np.zeros(len(index), dtype=bool)
+    for epoch, epoch_positions in zip(epochs, positions):
+        values = epoch[columns].to_numpy(dtype=float)
+        valid = ~np.isnan(values)
+        totals[epoch_positions] += np.where(valid, values, 0)
+        counts[epoch_positions] += valid
+        covered[epoch_positions] = True
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = totals[covered] / counts[covered]
+    return pd.DataFrame(means, index=index[covered], columns=columns)
+
+
 def galvanic_scrpeaks(signals, annotations, column='GSR_SCR', peaks_kwargs=None, max_increase_duration=7):
     """ Detect peaks of SCR component and estimate their characteristics.
 
@@ -0,0 +1,168 @@
+""" Functions to standardize signals acquired with a Nexus device """
+
+import logging
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+from dsu.exceptions import DSUException
+from dsu.dsp.resample import uniform_sampling
+from dsu.pandas_helpers import estimate_rate
+
+from iguazu.core.exceptions import SoftPreconditionFailed
+
+logger = logging.getLogger(__name__)
+
+
+def standardize_nexus_signals(raw: pd.DataFrame,
+                              sampling_rate: int) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Resample raw Nexus signals to a uniform sampling rate
+
+    Timeflux manages the timestamps of Nexus signals using an estimation that
+    results in a jittered, non-uniformly sampled signal. This function
+    resamples all the columns of `raw` in a single pass, since all Nexus
+    channels share the same timestamps.
+
+    Parameters
+    ----------
+    raw
+        Dataframe with one column per Nexus channel to standardize.
+    sampling_rate
+        Target sampling rate for the result.
+
+    Returns
+    -------
+    A tuple with the resampled signals and their annotations dataframe,
+    where samples that are NaN are annotated as ``'unknown'``.
+
+    Raises
+    ------
+    SoftPreconditionFailed
+        When the sampling rate of the raw signals cannot be estimated.
+
+    """
+    # Estimate the sampling frequency: weird signals that have a heavy jitter
+    # will fail here early and raise a ValueError. See issue #44
+    try:
+        fs = estimate_rate(raw)
+    except DSUException as ex:
+        logger.warning('Failed to estimate rate: %s, raising a precondition fail', ex)
+        raise SoftPreconditionFailed(str(ex)) from ex
+
+    logger.debug('Uniform resampling of %s from %.3f Hz to %d Hz',
+                 list(raw.columns), fs, sampling_rate)
+    # Uniform sampling, with linear interpolation.
+    # sample-and-hold is not a good strategy, see issue 48:
+    # https://github.com/OpenMindInnovation/iguazu/issues/48
+    raw_uniform = uniform_sampling(raw, sampling_rate, interpolation_kind='linear')
+
+    # Create the annotations companion dataframe and mark any nan as a
+    # "unknown" problem since it must come from the device / driver.
+    # idx_sparse = raw_uniform.isna().any(axis='columns')
+    #raw_annotations = raw_uniform.loc[idx_sparse].isna().replace({True: 'unknown', False: ''})
+    # I have changed my mind: sparse complicates the code, and we are only saving so little space
+    raw_annotations = raw_uniform.isna().replace({True: 'unknown', False: ''})
+
+    n_samples = raw_uniform.shape[0]
+    for column in raw_uniform.columns:
+        n_nans = (raw_annotations[column] != '').sum()
+        logger.debug('Finished standardization of Nexus signal %s. '
+                     'Result has %d samples (%.1f seconds, %.1f minutes) '
+                     '%d samples are NaN (%.1f %%).',
+                     column,
+                     n_samples,
+                     n_samples / sampling_rate,
+                     n_samples / sampling_rate / 60,
+                     n_nans,
+                     100 * n_nans / n_samples if n_samples else 0)
+    if n_samples > 0:
+        logger.debug('Extract of result:\n%s',
+                     raw_uniform.to_string(max_rows=5))
+
+    return raw_uniform, raw_annotations
+
+
+def convert_nexus_gsr(raw: pd.DataFrame,
+                      annotations: pd.DataFrame,
+                      *,
+                      column: str = 'GSR',
+                      linear_offset: float = 0,
+                      linear_slope: float = 1,
+                      sampling_rate: int = 512) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Convert a standardized Nexus GSR signal to µS and annotate saturations
+
+    This function implements the Nexus-specific particularities of their GSR
+    signals:
+
+    * It has a particular saturation behavior, where larger values are set
+      to zero
+    * There is a linear relationship between the saved value and the
+      corresponding resistance, which need to be inversed to obtain conductance
+
+    Only `column` is modified, so `raw` may have other Nexus signals.
+
+    Parameters
+    ----------
+    raw
+        Standardized Nexus signals, as returned by
+        :py:func:`standardize_nexus_signals`.
+    annotations
+        Annotations of `raw`.
+    column
+        Name of the GSR column.
+    linear_offset
+        Offset of the linear relationship between amplifier values and kΩ.
+    linear_slope
+        Slope of the linear relationship between amplifier values and kΩ.
+    sampling_rate
+        Sampling rate of `raw`, only used for logging.
+
+    Returns
+    -------
+    A tuple with the converted signals and their updated annotations.
+
+    """
+    # Avoid modifying the inputs in-place
+    raw = raw.copy()
+    annotations = annotations.copy()
+    gsr = raw[column]
+
+    # Nexus max-saturation:
+    # Because Nexus is weird, saturation should be >= 2000 but they set it to 0
+    saturation_max = (gsr == 0) | (gsr >= 2000)
+    # Nexus min-saturation:
+    # We are choosing zero, which has been observed with real resistances
+    # to be 10 to 100 Ω, that is, between 1e6 and 1e5 µS, so this is
+    # outside the amplifier range (which is documented to be
+    # between 0.1 and 1000 µS)
+    saturation_min = (gsr < 0)
+
+    # Convert from mV (amplifier values) to kΩ, then invert for µS
+    raw[column] = 1000 / (gsr * linear_slope + linear_offset)
+
+    # Mark saturations with nan and annotate them. Note that we need to
+    # do this AFTER converting to µS
+    raw.loc[saturation_min | saturation_max, column] = np.nan
+    annotations.loc[saturation_min, column] = 'saturated low'
+    annotations.loc[saturation_max, column] = 'saturated high'
+
+    n_samples = raw.shape[0]
+    n_saturated_min = saturation_min.sum()
+    n_saturated_max = saturation_max.sum()
+    if n_samples > 0:
+        logger.debug('Finished GSR-specific standardization of Nexus signal. '
+                     'Result has %d samples (%.1f seconds, %.1f minutes) '
+                     '%d samples are NaN (%.1f %%) due to '
+                     '%d samples being low-saturated (%.1f %%) and '
+                     '%d samples being high-saturated (%.1f %%)',
+                     n_samples,
+                     n_samples / sampling_rate,
+                     n_samples / sampling_rate / 60,
+                     n_saturated_min + n_saturated_max,
+                     100 * (n_saturated_min + n_saturated_max) / n_samples,
+                     n_saturated_min,
+                     100 * n_saturated_min / n_samples,
+                     n_saturated_max,
+                     100 * n_saturated_max / n_samples)
+
+    return raw, annotations
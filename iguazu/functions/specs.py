@@ -7,6 +7,8 @@ from typing import NoReturn, Optional
 import numpy as np
 import pandas as pd
 
+from iguazu.core.dataframes import share_dataframe
+
 logger = logging.getLogger()
 
 
@@ -519,9 +521,16 @@ def infer_standard_groups(hdf_path) -> dict:
 
 def store_output(f: pathlib.Path, key: str, *, dataframe: Optional[pd.DataFrame],
                  annotations: Optional[pd.DataFrame]) -> NoReturn:
-    """ Store dataframe and annotations into a HDF file """
+    """ Store dataframe and annotations into a HDF file
+
+    When this function is used inside a fused pipeline, the dataframes are also
+    kept in memory for the next stage of the pipeline.
+    See :py:func:`iguazu.core.dataframes.share_dataframe`.
+    """
     with pd.HDFStore(str(f.resolve()), 'w') as store:
         if dataframe is not None:
             dataframe.to_hdf(store, key)
+            share_dataframe(f, key, dataframe)
         if annotations is not None:
             annotations.to_hdf(store, key + '/annotations')
+            share_dataframe(f, key + '/annotations', annotations)
@@ -3,15 +3,18 @@ from typing import Dict, Optional
 
 import pandas as pd
 import prefect
+from dsu.exceptions import DSUException
+from dsu.pandas_helpers import estimate_rate
 
 import iguazu
 from iguazu.core.exceptions import SoftPreconditionFailed
 from iguazu.core.files import FileAdapter
 from iguazu.functions.galvanic import (
-    downsample, galvanic_cvx, galvanic_scrpeaks, galvanic_clean, gsr_features
+    cvx_epoch_size, downsample, galvanic_cvx, galvanic_scrpeaks, galvanic_clean, gsr_features
 )
 from iguazu.functions.specs import infer_standard_groups, store_output
 from iguazu.functions.unity import VALID_SEQUENCE_KEYS
+from iguazu.utils import peak_rss
 
 
 class CleanGSRSignal(iguazu.Task):
@@ -161,6 +164,7 @@ class ApplyCVX(iguazu.Task):
                  epoch_size: int = 300,
                  epoch_overlap: int = 60,
                  cvxeda_kwargs: Optional[Dict] = None,
+                 n_jobs: Optional[int] = None,
                  **kwargs):
         super().__init__(**kwargs)
 
@@ -171,6 +175,7 @@ class ApplyCVX(iguazu.Task):
         self.epoch_size = epoch_size
         self.epoch_overlap = epoch_overlap
         self.cvxeda_kwargs = cvxeda_kwargs or {}
+        self.n_jobs = n_jobs
 
         self.auto_manage_input_dataframe('signals', signals_hdf5_key)
         self.auto_manage_input_dataframe('annotations', signals_hdf5_key + '/annotations')
@@ -183,14 +188,41 @@ class ApplyCVX(iguazu.Task):
 
         output = self.default_outputs()
 
+        epoch_size, epoch_overlap = self.epoch_size, self.epoch_overlap
+        if self.meta.memory_budget > 0:
+            try:
+                fs = estimate_rate(signals)
+            except DSUException as ex:
+                raise SoftPreconditionFailed(f'Could not estimate the sampling rate '
+                                             f'for the memory budget: {ex}') from ex
+            epoch_size, estimate = cvx_epoch_size(signals.shape[0], fs,
+                                                  self.meta.memory_budget,
+                                                  warmup_duration=self.warmup_duration,
+                                                  epoch_overlap=self.epoch_overlap,
+                                                  n_jobs=self.n_jobs,
+                                                  cvxeda_params=self.cvxeda_kwargs)
+            if epoch_size is None:
+                epoch_overlap = None
+            self.logger.info('Memory budget of %.2f GB: cvxEDA with %s, estimated memory %.2f GB',
+                             self.meta.memory_budget / (1 << 30),
+                             'the whole signal' if epoch_size is None else f'epochs of {epoch_size} s',
+                             estimate / (1 << 30))
+
+        # The peak RSS is the maximum of the lifetime of the process: only its
+        # increase during this computation is relevant for this file
+        rss_before = peak_rss()
         cvx, cvx_annotations = galvanic_cvx(signals=signals,
                                             annotations=annotations,
                                             column=self.column,
                                             warmup_duration=self.warmup_duration,
                                             threshold_scr=self.threshold_scr,
-                                            epoch_size=self.epoch_size,
-                                            epoch_overlap=self.epoch_overlap,
+                                            epoch_size=epoch_size,
+                                            epoch_overlap=epoch_overlap,
+                                            cvxeda_params=self.cvxeda_kwargs,
+                                            n_jobs=self.n_jobs,
                                             )
+        self.logger.info('cvxEDA increased the peak RSS by %.2f GB',
+                         (peak_rss() - rss_before) / (1 << 30))
 
         store_output(output.file, self.output_hdf5_key, dataframe=cvx, annotations=cvx_annotations)
         return output
@@ -1,16 +1,25 @@
+import collections
 import copy
 import datetime
 import functools
+import hashlib
+import pathlib
+import pickle
 import random
 import string
-from typing import Any, Dict, List, Optional, Union
+import time
+from typing import Any, Dict, List, Optional, Sequence, Union
 
 from prefect import context, Task
 from prefect.engine import signals
 from quetzal.client import helpers
 
 from iguazu.core.files import QuetzalFile
-from iguazu.core.files.quetzal import quetzal_client_from_secret
+from iguazu.core.files.quetzal import (
+    mark_workspace_modified, mark_workspace_scanned, quetzal_client_from_secret,
+    workspace_last_change, workspace_scan_is_fresh
+)
+from iguazu.core.quetzal_client import api_call, get_client
 
 ResultSetType = Union[QuetzalFile, Dict[str, Dict[str, Any]]]
 
@@ -62,7 +71,7 @@ class QuetzalBaseTask(Task):
     @property
     def client(self):
         if 'quetzal_client' in context:  #TODO: change order context < task
-            return helpers.get_client(**context.quetzal_client)
+            return get_client(**context.quetzal_client)
         elif self._client is None:
             # self._client = helpers.get_client(**self._client_args)
             self._client = quetzal_client_from_secret()
@@ -90,6 +99,12 @@ class Query(QuetzalBaseTask):
     Typically, this task will be used as one of the first tasks of a flow that
     uses Quetzal as a data source.
 
+    When `cache_ttl` is set, the results of the query are saved in the
+    ``cache`` directory of the ``temp_dir`` of the prefect context, and reused
+    for `cache_ttl` seconds by the executions of the same query on the same
+    workspace, unless Iguazu modified the workspace in the meantime (see
+    :py:func:`iguazu.core.files.quetzal.mark_workspace_modified`).
+
     """
     # TODO: In the docstring above,
     #       put back reference to :py:ref:`quetzal.client.helpers.query` when
@@ -102,17 +117,22 @@ class Query(QuetzalBaseTask):
                  as_file_adapter: bool = False,
                  shuffle: bool = False,
                  limit: Optional[int] = None,
+                 seed: Optional[int] = None,
+                 cache_ttl: float = 0,
                  **kwargs):
         super().__init__(**kwargs)
         self._as_file_adapter = as_file_adapter
         self.limit = limit
         self.shuffle = shuffle
+        self.seed = seed
+        self.cache_ttl = cache_ttl
 
     def run(self,
             query: str,
             dialect: str = 'postgresql',
             workspace_id: Optional[int] = None,
-            id_column: Optional[str] = None) -> List[ResultSetType]:
+            id_column: Optional[str] = None,
+            families: Optional[Sequence[str]] = None) -> List[ResultSetType]:
         """ Perform the Quetzal SQL query
 
         Parameters
@@ -126,6 +146,15 @@ class Query(QuetzalBaseTask):
             the global workspace.
         id_column: str
             Name of the column on the query that represents a Quetzal file id.
+        families: list
+            Names of the metadata families of the workspace. When the task
+            converts the results to file adapters and a result row has a
+            column for each of these families (and ``base``), such as with
+            ``SELECT base, iguazu, ... FROM metadata`` on the
+            ``postgresql_json`` dialect, the file is created from the row
+            without requesting its metadata again. The metadata of the
+            remaining rows is requested with one query for each batch of
+            files.
 
         Returns
         -------
@@ -136,29 +165,161 @@ class Query(QuetzalBaseTask):
         if not query:
             raise signals.FAIL('Query is empty')
 
-        self.logger.info('Querying Quetzal at %s with SQL (dialect %s)=\n%s',
-                         self.client.configuration.host,
-                         dialect, query)
-        rows, total = helpers.query(self.client, workspace_id, query, dialect)
+        # Shuffle and limit the results on the server when possible, so that
+        # only the needed rows are transferred
+        server_side = dialect in SAMPLING_DIALECTS and (self.shuffle or self.limit is not None)
+        if server_side:
+            seed = self.seed if self.seed is not None else random.randrange(1 << 31)
+            query = sample_query(query,
+                                 id_column=id_column or 'id',
+                                 limit=self.limit,
+                                 seed=seed if self.shuffle else None)
+            if self.shuffle:
+                self.logger.info('Shuffling query results with seed %d', seed)
+
+        # A random shuffle cannot be cached: the same query must give another
+        # sample on each execution
+        cacheable = self.cache_ttl > 0 and not (self.shuffle and self.seed is None)
+        cache_file = self._cache_file(query, dialect, workspace_id) if cacheable else None
+        cached = self._load_cache(cache_file, workspace_id)
+        if cached is not None:
+            rows, total = cached
+            self.logger.info('Reusing %d cached results of the query (dialect %s)=\n%s',
+                             total, dialect, query)
+        else:
+            self.logger.info('Querying Quetzal at %s with SQL (dialect %s)=\n%s',
+                             self.client.configuration.host,
+                             dialect, query)
+            # Note: the limit also stops the pagination of the results
+            with api_call('query'):
+                rows, total = helpers.query(self.client, workspace_id, query, dialect, limit=self.limit)
+            self._save_cache(cache_file, rows, total)
+
+            # Handle results
+            self.logger.info('Query gave %d results', total)
+
+        if not server_side:
+            # Shuffle the results
+            if self.shuffle:
+                random.Random(self.seed).shuffle(rows)
+
+            # Only keep N results
+            if self.limit is not None and total > self.limit:
+                rows = rows[:self.limit]
+                total = len(rows)
+                self.logger.info('Query was limited to %d results', total)
 
-        # Handle results
-        self.logger.info('Query gave %d results', total)
+        if self._as_file_adapter:
+            rows = self._to_file_adapters(rows, workspace_id, families)
 
-        # Shuffle the results
-        if self.shuffle:
-            random.shuffle(rows)
+        return rows
 
-        # Only keep N results
-        if self.limit is not None and total > self.limit:
-            rows = rows[:self.limit]
-            total = len(rows)
-            self.logger.info('Query was limited to %d results', total)
+    def _to_file_adapters(self, rows, workspace_id, families) -> List[Optional[QuetzalFile]]:
+        required = None if families is None else {'base'} | set(families)
+        results = [None] * len(rows)
+        pending = collections.defaultdict(list)
+        for i, row in enumerate(rows):
+            if required is not None and all(isinstance(row.get(f, None), dict) for f in required):
+                meta = {f: row[f] for f in required}
+                results[i] = QuetzalFile.from_metadata(meta, workspace_id=workspace_id)
+            else:
+                file_id = row['id'] if 'id' in row else row['base']['id']
+                pending[str(file_id)].append(i)
+
+        self.logger.debug('Created %d files from the query results, retrieving %d more',
+                          len(rows) - sum(len(idx) for idx in pending.values()), len(pending))
+        retrieved = QuetzalFile.retrieve_many(file_ids=list(pending), workspace_id=workspace_id) if pending else {}
+        for file_id, indices in pending.items():
+            if file_id in retrieved:
+                file = retrieved[file_id]
+            else:
+                file = QuetzalFile.retrieve(file_id=file_id, workspace_id=workspace_id)
+            for i in indices:
+                results[i] = file
+
+        return results
+
+    def _cache_file(self, query, dialect, workspace_id) -> Optional[pathlib.Path]:
+        temp_dir = context.get('temp_dir', None)
+        if not temp_dir:
+            return None
+        key = repr((self.client.configuration.host, workspace_id, dialect, query,
+                    self.limit, self.shuffle, self.seed))
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return pathlib.Path(temp_dir) / 'cache' / 'quetzal' / f'query-{digest}.pickle'
+
+    def _load_cache(self, cache_file, workspace_id):
+        if cache_file is None or not cache_file.exists():
+            return None
+        saved_at = cache_file.stat().st_mtime
+        modified_at = workspace_last_change(workspace_id)
+        if time.time() - saved_at > self.cache_ttl:
+            self.logger.debug('Cached query results expired')
+            return None
+        if modified_at is not None and modified_at >= saved_at:
+            self.logger.debug('Workspace was modified after the query results were cached')
+            return None
+        try:
+            with cache_file.open('rb') as fd:
+                return pickle.load(fd)
+        except Exception:
+            self.logger.warning('Could not read cached query results %s', cache_file,
+                                exc_info=True)
+            return None
+
+    def _save_cache(self, cache_file, rows, total) -> None:
+        if cache_file is None:
+            return
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            # Write and rename, so that a concurrent flow never reads a
+            # partial file
+            partial = cache_file.with_suffix('.partial')
+            with partial.open('wb') as fd:
+                pickle.dump((rows, total), fd)
+            partial.replace(cache_file)
+        except Exception:
+            self.logger.warning('Could not save query results to cache %s', cache_file,
+                                exc_info=True)
+
+
+SAMPLING_DIALECTS = ('postgresql', 'postgresql_json')
+"""Query dialects where :py:class:`Query` can shuffle and limit on the server"""
+
+
+def sample_query(query: str, *, id_column: str = 'id',
+                 limit: Optional[int] = None, seed: Optional[int] = None) -> str:
+    """ Wrap a SQL query to limit or randomly sample its results on the server
 
-        if self._as_file_adapter:
-            for i, row in enumerate(rows):
-                rows[i] = QuetzalFile.retrieve(file_id=row['id'], workspace_id=workspace_id)
+    Parameters
+    ----------
+    query: str
+        A PostgreSQL query.
+    id_column: str
+        Column of the query results used to shuffle them.
+    limit: int
+        Maximum number of results. ``None`` means no limit.
+    seed: int
+        When set, the results are shuffled in a pseudo-random order that only
+        depends on this seed and the values of `id_column`. This order is
+        reproducible, so that two queries with the same seed and limit give
+        the same sample.
+
+    Returns
+    -------
+    str
+        A new query that selects the same columns as `query`.
 
-        return rows
+    """
+    # Remove any trailing semicolon. The new line before the closing
+    # parenthesis avoids closing it inside a trailing -- comment
+    inner = query.strip().rstrip(';')
+    wrapped = f'SELECT * FROM (\n{inner}\n) AS iguazu_query'
+    if seed is not None:
+        wrapped += f""" ORDER BY md5(CAST(iguazu_query."{id_column}" AS TEXT) || '{int(seed)}')"""
+    if limit is not None:
+        wrapped += f' LIMIT {int(limit)}'
+    return wrapped
 
 
 class CreateWorkspace(QuetzalBaseTask):
@@ -231,12 +392,14 @@ class CreateWorkspace(QuetzalBaseTask):
         description = description or self.description
 
         # Check if the requested workspace already exists
-        workspaces, total = helpers.workspace.list_(self.client, name=workspace_name)
+        with api_call('list_workspaces'):
+            workspaces, total = helpers.workspace.list_(self.client, name=workspace_name)
         if total == 0:
             # There was no workspace with such name, create it
             # This function will block until the workspace is initialized
-            details = helpers.workspace.create(self.client, workspace_name, description,
-                                               families, temporary, wait=True)
+            with api_call('create_workspace'):
+                details = helpers.workspace.create(self.client, workspace_name, description,
+                                                   families, temporary, wait=True)
             # After initialization of a workspace, it can be INVALID, which
             # means that something went wrong
             if details.status != 'READY':
@@ -299,15 +462,28 @@ class _WorkspaceOperation(QuetzalBaseTask):
         delete=helpers.workspace.delete,
     )
 
-    def __init__(self, operation: str, **kwargs):
+    def __init__(self, operation: str, cache_ttl: float = 0, **kwargs):
         if operation not in _WorkspaceOperation._known_operations:
             raise ValueError(f'Invalid workspace operation "{operation}"')
         super().__init__(**kwargs)
         self._operation = operation
+        # Only used by scan: number of seconds that a previous scan remains
+        # valid when the workspace was not modified by Iguazu
+        self.cache_ttl = cache_ttl
 
     def run(self, workspace_id: str) -> int:
+        if self._operation == 'scan' and workspace_scan_is_fresh(workspace_id, self.cache_ttl):
+            self.logger.info('Workspace %s was not modified since its last scan, '
+                             'skipping scan', workspace_id)
+            return workspace_id
+
         function = _WorkspaceOperation._known_operations[self._operation]
-        details = function(self.client, wid=workspace_id, wait=True)
+        with api_call(f'{self._operation}_workspace'):
+            details = function(self.client, wid=workspace_id, wait=True)
+        if self._operation == 'scan':
+            mark_workspace_scanned(details.id)
+        else:
+            mark_workspace_modified(details.id)
         return details.id
 
 
@@ -315,7 +491,11 @@ CommitWorkspace = functools.partial(_WorkspaceOperation, 'commit')
 CommitWorkspace.__doc__ = """Commit the metadata and new files on a Quetzal workspace"""
 
 ScanWorkspace = functools.partial(_WorkspaceOperation, 'scan')
-ScanWorkspace.__doc__ = """Update the metadata view of a Quetzal workspace"""
+ScanWorkspace.__doc__ = """Update the metadata view of a Quetzal workspace
+
+A scan is skipped when the workspace was scanned less than `cache_ttl`
+seconds ago and was not modified by Iguazu since then.
+"""
 
 DeleteWorkspace = functools.partial(_WorkspaceOperation, 'delete')
 DeleteWorkspace.__doc__ = """Delete a workspace"""
@@ -1,21 +1,19 @@
 """ Tasks related to standardization of data from the VR protocol """
 
 import logging
-from typing import List, Optional
+from typing import List, Mapping, Optional, Tuple
 
-import numpy as np
 import pandas as pd
 import prefect
-from dsu.exceptions import DSUException
-from dsu.dsp.resample import uniform_sampling
-from dsu.pandas_helpers import estimate_rate
 
 import iguazu
 from iguazu.core.exceptions import (
-    PostconditionFailed, SoftPreconditionFailed
+    GracefulFailWithResults, PostconditionFailed, SoftPreconditionFailed
 )
+from iguazu.functions.nexus import convert_nexus_gsr, standardize_nexus_signals
 from iguazu.functions.specs import (
-    check_event_specification, check_signal_specification, EventSpecificationError
+    check_event_specification, check_signal_specification, EventSpecificationError,
+    SignalSpecificationError,
 )
 from iguazu.functions.unity import extract_standardized_events
 from iguazu.core.files import FileAdapter
@@ -344,10 +342,19 @@ class ExtractNexusSignal(iguazu.Task):
         self.source_column = source_column
         self.target_column = target_column
         self.sampling_rate = sampling_rate
-        self.auto_manage_input_dataframe('signals', signals_hfd5_key)
+        # Only read the source column: raw Nexus files have many channels
+        self.auto_manage_input_dataframe('signals', signals_hfd5_key,
+                                         columns=[source_column])
 
     def run(self, signals: pd.DataFrame) -> FileAdapter:
         """Extract and pre-process signals"""
+        raw_uniform, raw_annotations = self.standardize(signals)
+        return self.save(raw_uniform, raw_annotations)
+
+    # Refactored this method out of run so that it can be reused by a child
+    # class such as ExtractGSRSignal without saving and reading the
+    # intermediate results
+    def standardize(self, signals: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
         logger.info('Extracting Nexus signal %s -> %s on file %s',
                     self.source_column, self.target_column,
                     prefect.context.run_kwargs['signals'])
@@ -356,45 +363,7 @@ class ExtractNexusSignal(iguazu.Task):
             signals[[self.source_column]]
             .rename(columns={self.source_column: self.target_column})
         )
-
-        # Estimate the sampling frequency: weird signals that have a heavy jitter
-        # will fail here early and raise a ValueError. See issue #44
-        try:
-            fs = estimate_rate(raw)
-        except DSUException as ex:
-            logger.warning('Failed to estimate rate: %s, raising a precondition fail', ex)
-            raise SoftPreconditionFailed(str(ex)) from ex
-
-        logger.debug('Uniform resampling from %.3f Hz to %d Hz', fs, self.sampling_rate)
-        # Uniform sampling, with linear interpolation.
-        # sample-and-hold is not a good strategy, see issue 48:
-        # https://github.com/OpenMindInnovation/iguazu/issues/48
-        raw_uniform = uniform_sampling(raw, self.sampling_rate,
-                                       interpolation_kind='linear')
-
-        # Create the annotations companion dataframe and mark any nan as a
-        # "unknown" problem since it must come from the device / driver.
-        # idx_sparse = raw_uniform.isna().any(axis='columns')
-        #raw_annotations = raw_uniform.loc[idx_sparse].isna().replace({True: 'unknown', False: ''})
-        # I have changed my mind: sparse complicates the code, and we are only saving so little space
-        raw_annotations = raw_uniform.isna().replace({True: 'unknown', False: ''})
-
-        n_samples = raw_uniform.shape[0]
-        n_nans = (raw_annotations != '').sum()
-        logger.debug('Finished standardization of Nexus signal %s -> %s. '
-                     'Result has %d samples (%.1f seconds, %.1f minutes) '
-                     '%d samples are NaN (%.1f %%).',
-                     self.source_column, self.target_column,
-                     n_samples,
-                     n_samples / self.sampling_rate,
-                     n_samples / self.sampling_rate / 60,
-                     n_nans,
-                     100 * n_nans / n_samples)
-        if n_samples > 0:
-            logger.debug('Extract of result:\n%s',
-                         raw_uniform.to_string(max_rows=5))
-
-        return self.save(raw_uniform, raw_annotations)
+        return standardize_nexus_signals(raw, self.sampling_rate)
 
     # Refactored this method out of run so that it can be reused by a child
     # class such as ExtractGSRSignal
@@ -469,54 +438,167 @@ class ExtractNexusGSRSignal(ExtractNexusSignal):
 
     def run(self, signals: pd.DataFrame) -> FileAdapter:
         # Call the regular extraction, then annotate known Nexus GSR problems.
-        parent_output_file = super().run(signals=signals)
+        raw, annotations = self.standardize(signals)
 
         logger.info('Running GSR-specific processing of Nexus signals')
-
-        # We need to re-read the dataframe
-        with pd.HDFStore(str(parent_output_file.file.resolve()), 'r') as store:
-            raw = pd.read_hdf(store, self.output_hdf5_key)
-            annotations = pd.read_hdf(store, self.output_annotations_hdf5_key)
-
-        # Quell typing checks because read_hdf returns object or dataframe
-        assert isinstance(raw, pd.DataFrame)
-        assert isinstance(annotations, pd.DataFrame)
-
-        # Nexus max-saturation:
-        # Because Nexus is weird, saturation should be >= 2000 but they set it to 0
-        saturation_max = (raw[self.target_column] == 0) | (raw[self.target_column] >= 2000)
-        # Nexus min-saturation:
-        # We are choosing zero, which has been observed with real resistances
-        # to be 10 to 100 Ω, that is, between 1e6 and 1e5 µS, so this is
-        # outside the amplifier range (which is documented to be
-        # between 0.1 and 1000 µS)
-        saturation_min = (raw[self.target_column] < 0)
-
-        # Convert from mV (amplifier values) to kΩ, then invert for µS
-        raw = 1000 / (raw * self.m + self.b)  # type: pd.DataFrame
-
-        # Mark saturations with nan and annotate them. Note that we need to
-        # do this AFTER converting to µS
-        raw.loc[saturation_min | saturation_max, self.target_column] = np.nan
-        annotations.loc[saturation_min, self.target_column] = 'saturated low'
-        annotations.loc[saturation_max, self.target_column] = 'saturated high'
-
-        n_samples = raw.shape[0]
-        n_saturated_min = saturation_min.sum()
-        n_saturated_max = saturation_max.sum()
-        logger.debug('Finished GSR-specific standardization of Nexus signal. '
-                     'Result has %d samples (%.1f seconds, %.1f minutes) '
-                     '%d samples are NaN (%.1f %%) due to '
-                     '%d samples being low-saturated (%.1f %%) and '
-                     '%d samples being high-saturated (%.1f %%)',
-                     n_samples,
-                     n_samples / self.sampling_rate,
-                     n_samples / self.sampling_rate / 60,
-                     n_saturated_min + n_saturated_max,
-                     100 * (n_saturated_min + n_saturated_max) / n_samples,
-                     n_saturated_min,
-                     100 * n_saturated_min / n_samples,
-                     n_saturated_max,
-                     100 * n_saturated_max / n_samples)
+        raw, annotations = convert_nexus_gsr(raw, annotations,
+                                             column=self.target_column,
+                                             linear_offset=self.b,
+                                             linear_slope=self.m,
+                                             sampling_rate=self.sampling_rate)
 
         return self.save(raw, annotations)
+
+
+class ExtractNexusSignals(iguazu.Task):
+    """Extract and pre-process several signals from a Nexus device at once
+
+    This task is equivalent to several :py:class:`ExtractNexusSignal` and
+    :py:class:`ExtractNexusGSRSignal` tasks on the same file, but the raw
+    Nexus dataframe is only read once, all channels are resampled in a single
+    pass and all the standard signals are saved on the same file.
+
+    A signal that does not follow the signal specification is not saved,
+    but the other signals are: the task then gracefully fails with the file
+    of the valid signals as its result, so that the partial failure is
+    reported. The task fails without results when no signal follows the
+    specification. Unlike separate tasks, since the raw dataframe is read and
+    resampled once for all channels, a missing source column or a raw signal
+    whose sampling rate cannot be estimated fails all the signals of the file.
+
+    Parameters
+    ----------
+    signals_hdf5_key
+        Name of the HDF5 key where the raw Nexus signals are stored.
+    channels
+        Mapping of the dataframe columns that will be converted to the name
+        of their resulting signal, for example ``{'F': 'GSR', 'G': 'PPG'}``.
+    gsr_column
+        Name of the resulting signal that needs the GSR-specific processing
+        of :py:class:`ExtractNexusGSRSignal`, if any.
+    linear_offset
+        Offset of the Nexus GSR linear conversion.
+    linear_slope
+        Slope of the Nexus GSR linear conversion.
+    sampling_rate
+        Target sampling rate for the result.
+    output_hdf5_key_template
+        Template of the HDF5 key where each pre-processed signal will be
+        stored. The ``{name}`` field is replaced by the lowercase name of the
+        resulting signal.
+
+    """
+
+    def __init__(self, *,
+                 signals_hfd5_key: str = '/nexus/signal/nexus_signal_raw',
+                 channels: Mapping[str, str],
+                 gsr_column: Optional[str] = None,
+                 linear_offset: float = 0,
+                 linear_slope: float = 1,
+                 sampling_rate: int = 512,
+                 output_hdf5_key_template: str = '/iguazu/signal/{name}/standard',
+                 **kwargs):
+        super().__init__(**kwargs)
+        if not channels:
+            raise ValueError('At least one Nexus channel is needed')
+        if gsr_column is not None and gsr_column not in channels.values():
+            raise ValueError(f'GSR column {gsr_column} is not one of the '
+                             f'extracted signals {list(channels.values())}')
+
+        self.channels = dict(channels)
+        self.gsr_column = gsr_column
+        self.b = linear_offset
+        self.m = linear_slope
+        self.sampling_rate = sampling_rate
+        self.output_hdf5_keys = {
+            target: output_hdf5_key_template.format(name=target.lower())
+            for target in self.channels.values()
+        }
+        # Only read the source columns: raw Nexus files have many channels
+        self.auto_manage_input_dataframe('signals', signals_hfd5_key,
+                                         columns=list(self.channels))
+
+    def run(self, signals: pd.DataFrame) -> FileAdapter:
+        """Extract and pre-process signals"""
+        logger.info('Extracting Nexus signals %s on file %s',
+                    ', '.join(f'{source} -> {target}' for source, target in self.channels.items()),
+                    prefect.context.run_kwargs['signals'])
+
+        raw = signals[list(self.channels)].rename(columns=self.channels)
+        raw_uniform, raw_annotations = standardize_nexus_signals(raw, self.sampling_rate)
+
+        if self.gsr_column is not None:
+            logger.info('Running GSR-specific processing of Nexus signals')
+            raw_uniform, raw_annotations = convert_nexus_gsr(raw_uniform, raw_annotations,
+                                                             column=self.gsr_column,
+                                                             linear_offset=self.b,
+                                                             linear_slope=self.m,
+                                                             sampling_rate=self.sampling_rate)
+
+        # Verify each signal on its own, so that one invalid signal does not
+        # lose the others
+        valid_keys = {}
+        errors = {}
+        for target, key in self.output_hdf5_keys.items():
+            try:
+                check_signal_specification(raw_uniform[[target]], raw_annotations[[target]])
+            except SignalSpecificationError as ex:
+                logger.warning('Nexus signal %s does not follow the signal specification '
+                               'and will not be saved: %s', target, ex)
+                errors[target] = ex
+                continue
+            valid_keys[target] = key
+        if not valid_keys:
+            raise list(errors.values())[-1]
+
+        output_file = self.default_outputs()
+        with pd.HDFStore(str(output_file.file.resolve()), 'w') as store:
+            for target, key in valid_keys.items():
+                raw_uniform[[target]].to_hdf(store, key)
+                raw_annotations[[target]].to_hdf(store, '/'.join([key, 'annotations']))
+                node = store.get_node(key)
+                node._v_attrs['standard'] = {
+                    'sampling_rate': self.sampling_rate,
+                }
+
+        if errors:
+            raise GracefulFailWithResults(output_file,
+                                          f'Nexus signals {", ".join(errors)} do not follow '
+                                          f'the signal specification and were not saved')
+
+        return output_file
+
+    def default_outputs(self, **kwargs):
+        original_kws = prefect.context.run_kwargs
+        signals = original_kws['signals']
+        names = '_'.join(f'{source}_{target}' for source, target in self.channels.items())
+        output = self.create_file(
+            parent=signals,
+            suffix=f'_standard_{names}'
+        )
+        return output
+
+    def preconditions(self, *, signals, **kwargs):
+        super().preconditions(signals=signals, **kwargs)
+
+        # Precondition: input signals is not empty
+        if signals.empty:
+            raise SoftPreconditionFailed('Input signals are empty')
+
+    def postconditions(self, results):
+        super().postconditions(results)
+
+        if not isinstance(results, FileAdapter):
+            raise PostconditionFailed('Output was not a file')
+
+        # Postcondition: file is empty
+        if results.empty:
+            return
+
+        # Postcondition: when file is not empty, all saved signals follow the spec
+        with pd.HDFStore(str(results.file.resolve()), 'r') as store:
+            for key in self.output_hdf5_keys.values():
+                if key not in store:
+                    continue
+                dataframe = pd.read_hdf(store, key)
+                check_signal_specification(dataframe)
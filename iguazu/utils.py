@@ -7,6 +7,8 @@ import importlib
 import pathlib
 import pickle
 import pkgutil
+import resource
+import sys
 from typing import Any, Dict, Mapping
 
 
@@ -123,3 +125,16 @@ def deep_update(dest: Dict, src: Dict) -> Dict:
         else:
             dest[k] = v
     return dest
+
+
+def peak_rss() -> int:
+    """ Get the peak resident set size of this process and its children, in bytes
+
+    Children are only accounted once they have terminated, which is the case of
+    the workers of a process pool after it has been shut down.
+    """
+    usage = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+             resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # ru_maxrss is in kilobytes on Linux but in bytes on macOS
+    factor = 1 if sys.platform == 'darwin' else 1024
+    return max(usage) * factor
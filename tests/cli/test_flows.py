@@ -0,0 +1,37 @@
+import pytest
+from prefect.engine.executors import DaskExecutor, LocalDaskExecutor, LocalExecutor
+
+from iguazu.cli.flows import prepare_executor
+from iguazu.core.flows import REGISTRY
+
+
+def test_prepare_executor_processes():
+    executor = prepare_executor('processes', workers=3, threads_per_worker=1, memory_limit='1GB')
+    assert isinstance(executor, DaskExecutor)
+    assert executor.local_processes
+    assert executor.kwargs == dict(n_workers=3, threads_per_worker=1, memory_limit='1GB')
+
+
+def test_prepare_executor_threads():
+    executor = prepare_executor('threads', workers=7)
+    assert isinstance(executor, LocalDaskExecutor)
+    assert executor.scheduler == 'threads'
+    assert executor.kwargs == dict(num_workers=7)
+
+
+def test_prepare_executor_local():
+    assert isinstance(prepare_executor('local'), LocalExecutor)
+
+
+def test_prepare_executor_unknown():
+    with pytest.raises(ValueError):
+        prepare_executor('qwerty')
+
+
+@pytest.mark.parametrize('flow_name', list(REGISTRY))
+@pytest.mark.parametrize('executor_type', ['processes', 'threads'])
+def test_executor_defaults(flow_name, executor_type):
+    defaults = REGISTRY[flow_name].executor_defaults(executor_type)
+    assert defaults['workers'] >= 1
+    # the defaults must be valid parameters of prepare_executor
+    prepare_executor(executor_type, **defaults)
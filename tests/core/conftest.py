@@ -1,7 +1,12 @@
+import sqlite3
+
 import prefect
 import pytest
+from quetzal.client import helpers
 
-from iguazu.core.files import LocalURL
+from iguazu.core.files import LocalURL, QuetzalURL
+from iguazu.core.quetzal_client import get_client
+from iguazu.core.quetzal_server import MIN_SQLITE_VERSION, LocalQuetzalServer
 
 
 @pytest.fixture(scope='function')
@@ -13,3 +18,24 @@ def temp_url(tmpdir):
     url = LocalURL(path=tmpdir)
     with prefect.context(temp_url=url):
         yield url
+
+
+@pytest.fixture(scope='function')
+def quetzal_server(tmpdir):
+    """Start a local Quetzal server with a workspace and set a prefect context
+
+    The context has the client secrets of the server, and the temporary and
+    output URLs of a new workspace named ``test``. Tests are skipped when the
+    SQLite version does not support the server.
+    """
+    if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+        pytest.skip(f'The local Quetzal server needs a newer SQLite than {sqlite3.sqlite_version}')
+    with LocalQuetzalServer() as server:
+        client = get_client(**server.client_kwargs)
+        details = helpers.workspace.create(client, 'test', 'Test workspace',
+                                           {'iguazu': None, 'standard': None}, wait=True)
+        url = QuetzalURL(path='', workspace_name='test', workspace_id=details.id)
+        with prefect.context(secrets={'QUETZAL_CLIENT_KWARGS': server.client_kwargs},
+                             quetzal_client=server.client_kwargs,
+                             temp_url=url, output_url=url, temp_dir=str(tmpdir)):
+            yield server
@@ -153,3 +153,47 @@ def test_auto_manage_dataframe_many_inputs(local_file):
     assert isinstance(df_bar, pd.DataFrame)
 
     tm.assert_equal(result, df_foo.mean() + df_bar.mean() + 1.23)
+
+
+class TaskWithInputSelection(Task):
+
+    def __init__(self, input_one_key='/foo', **kwargs):
+        # Separate the selection arguments from the task options
+        selection = {k: kwargs.pop(k) for k in ('columns', 'time_range', 'where') if k in kwargs}
+        super().__init__(**kwargs)
+        self.auto_manage_input_dataframe('input_one', input_one_key, **selection)
+
+    def run(self, *, input_one):
+        return input_one
+
+
+@pytest.fixture(scope='function')
+def time_file(tmpdir):
+    filename = 'timeseries.hdf5'
+    path = tmpdir / filename
+    df = tm.makeTimeDataFrame(nper=100)
+
+    with pd.HDFStore(path, 'w') as store:
+        df.to_hdf(store, '/fixed')
+        df.to_hdf(store, '/table', format='table')
+
+    url = LocalURL(path=tmpdir)
+    with prefect.context(temp_url=url):
+        yield LocalFile(filename=filename, path='', temporary=True), df
+
+
+@pytest.mark.parametrize('key', ['/fixed', '/table'])
+def test_auto_manage_dataframe_selection(time_file, key):
+    local_file, df = time_file
+    begin, end = df.index[10], df.index[19]
+    task = TaskWithInputSelection(input_one_key=key, columns=['B', 'C'], time_range=(begin, end))
+
+    with Flow('test_auto_manage_dataframe_selection') as flow:
+        file = prefect.Parameter('local_file', default=local_file)
+        task(input_one=file)
+
+    with raise_on_exception(), prefect.context(caches={}):
+        flow_state = flow.run()
+
+    result = list(flow_state.result.values())[0].result
+    tm.assert_frame_equal(result, df.loc[begin:end, ['B', 'C']])
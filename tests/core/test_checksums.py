@@ -0,0 +1,39 @@
+import os
+
+from quetzal.client.utils import get_readable_info
+
+from iguazu.core.files.checksums import ChecksumIndex
+
+
+def test_checksum_index(tmpdir):
+    index = ChecksumIndex(tmpdir / 'index.sqlite3')
+    filename = tmpdir / 'file.bin'
+    filename.write_binary(b'abc' * 1000)
+    with open(filename, 'rb') as fd:
+        expected = get_readable_info(fd)
+
+    assert index.checksum(filename) == expected
+    assert index.checksum(filename) == expected
+    assert (index.hits, index.misses) == (1, 1)
+
+    # The index is persisted
+    other_index = ChecksumIndex(tmpdir / 'index.sqlite3')
+    assert other_index.checksum(filename) == expected
+    assert (other_index.hits, other_index.misses) == (1, 0)
+
+
+def test_checksum_index_modified_file(tmpdir):
+    index = ChecksumIndex()
+    filename = tmpdir / 'file.bin'
+    filename.write_binary(b'abc')
+    index.checksum(filename)
+
+    # Same size, different contents and modification time
+    filename.write_binary(b'xyz')
+    stat = os.stat(filename)
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    with open(filename, 'rb') as fd:
+        expected = get_readable_info(fd)
+
+    assert index.checksum(filename) == expected
+    assert (index.hits, index.misses) == (0, 2)
@@ -0,0 +1,185 @@
+import pandas as pd
+import pandas.util.testing as tm
+import pytest
+import prefect
+from prefect import Flow
+from prefect.utilities.debug import raise_on_exception
+
+from iguazu import Task
+from iguazu.core.dataframes import DATAFRAME_CACHE, DataFrameCache, freeze
+from iguazu.core.files import LocalFile, LocalURL
+
+
+@pytest.fixture(scope='function')
+def clean_cache():
+    DATAFRAME_CACHE.clear()
+    yield DATAFRAME_CACHE
+    DATAFRAME_CACHE.clear()
+    DATAFRAME_CACHE.max_bytes = 0
+
+
+def _size(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def test_cache_disabled_by_default():
+    cache = DataFrameCache()
+    df = tm.makeDataFrame()
+    assert not cache.put('a', df)
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_cache_hit_returns_copy():
+    df = tm.makeDataFrame()
+    cache = DataFrameCache(max_bytes=10 * _size(df))
+    assert cache.put('a', df)
+
+    cached = cache.get('a')
+    tm.assert_frame_equal(cached, df)
+
+    # Modifying the retrieved dataframe should not modify the cached one
+    cached.iloc[:, :] = 0
+    tm.assert_frame_equal(cache.get('a'), df)
+    assert cache.hits == 2
+    assert cache.misses == 0
+
+
+def test_cache_lru_eviction():
+    df = tm.makeDataFrame()
+    cache = DataFrameCache(max_bytes=2 * _size(df))
+    cache.put('a', df)
+    cache.put('b', df)
+    cache.get('a')  # a is now the most recently used
+    cache.put('c', df)
+
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert 'c' in cache
+    assert cache.evictions == 1
+    assert cache.total_bytes == 2 * _size(df)
+
+
+def test_cache_shrink_evicts():
+    df = tm.makeDataFrame()
+    cache = DataFrameCache(max_bytes=2 * _size(df))
+    cache.put('a', df)
+    cache.put('b', df)
+    cache.max_bytes = _size(df)
+
+    assert len(cache) == 1
+    assert 'b' in cache
+
+
+def test_cache_owner_budgets():
+    df = tm.makeDataFrame()
+    cache = DataFrameCache()
+    assert cache.put('a1', df, owner='a', max_bytes=2 * _size(df))
+    assert cache.put('b1', df, owner='b', max_bytes=_size(df))
+    # An owner evicts its own entries to respect its budget
+    assert cache.put('b2', df, owner='b', max_bytes=_size(df))
+    assert set(cache._entries) == {'a1', 'b2'}
+
+    # The whole cache is bounded by the largest budget: the least recently
+    # used entry of any owner is evicted
+    assert cache.put('c1', df, owner='c', max_bytes=2 * _size(df))
+    assert set(cache._entries) == {'b2', 'c1'}
+    assert cache.total_bytes == 2 * _size(df)
+    assert cache.evictions == 2
+    # Entries of any owner can be retrieved
+    tm.assert_frame_equal(cache.get('b2'), df)
+
+    # A cache budget bounds the total instead
+    cache.max_bytes = _size(df)
+    assert set(cache._entries) == {'b2'}
+    assert cache.evictions == 3
+
+
+def test_freeze_is_hashable():
+    key = freeze(((['a', 'b'],), {'columns': ['x'], 'where': None}))
+    hash(key)
+    assert key == freeze(((['a', 'b'],), {'where': None, 'columns': ['x']}))
+
+
+class TaskWithCachedInput(Task):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.auto_manage_input_dataframe('input_one', '/foo')
+
+    def run(self, *, input_one):
+        # Modify input in-place, this should not corrupt the cache
+        input_one.iloc[:, :] = 0
+        return input_one
+
+
+@pytest.fixture(scope='function')
+def local_file(tmpdir):
+    filename = 'dataframe.hdf5'
+    path = tmpdir / filename
+    foo = tm.makeDataFrame()
+
+    with pd.HDFStore(path, 'w') as store:
+        foo.to_hdf(store, '/foo')
+
+    url = LocalURL(path=tmpdir)
+    with prefect.context(temp_url=url):
+        yield LocalFile(filename=filename, path='', temporary=True)
+
+
+def test_managed_input_uses_cache(mocker, local_file, clean_cache):
+    read_hdf = mocker.spy(pd, 'read_hdf')
+    task1 = TaskWithCachedInput(name='task1', managed_inputs_cache_size=1 << 24)
+    task2 = TaskWithCachedInput(name='task2', managed_inputs_cache_size=1 << 24)
+
+    with Flow('test_managed_input_uses_cache') as flow:
+        file = prefect.Parameter('local_file', default=local_file)
+        task1(input_one=file)
+        task2(input_one=file)
+
+    with raise_on_exception(), prefect.context(caches={}):
+        flow.run()
+
+    assert read_hdf.call_count == 1
+    assert clean_cache.hits == 1
+
+    # The cached version was not modified by the tasks
+    df_foo = pd.read_hdf(local_file.file, '/foo')
+    cache_key = next(iter(clean_cache._entries))
+    tm.assert_frame_equal(clean_cache.get(cache_key), df_foo)
+
+
+def test_managed_input_no_cache(mocker, local_file, clean_cache):
+    read_hdf = mocker.spy(pd, 'read_hdf')
+    task1 = TaskWithCachedInput(name='task1', managed_inputs_cache_size=0)
+    task2 = TaskWithCachedInput(name='task2', managed_inputs_cache_size=0)
+
+    with Flow('test_managed_input_no_cache') as flow:
+        file = prefect.Parameter('local_file', default=local_file)
+        task1(input_one=file)
+        task2(input_one=file)
+
+    with raise_on_exception(), prefect.context(caches={}):
+        flow.run()
+
+    assert read_hdf.call_count == 2
+    assert len(clean_cache) == 0
+
+
+def test_managed_input_cache_budget_per_task(local_file, clean_cache):
+    df_size = _size(pd.read_hdf(local_file.file, '/foo'))
+    task1 = TaskWithCachedInput(name='task1', managed_inputs_cache_size=10 * df_size)
+    task2 = TaskWithCachedInput(name='task2', managed_inputs_cache_size=df_size // 2)
+
+    with Flow('test_managed_input_cache_budget_per_task') as flow:
+        file = prefect.Parameter('local_file', default=local_file)
+        task1(input_one=file)
+        task2(input_one=file)
+
+    with raise_on_exception(), prefect.context(caches={}):
+        flow.run()
+
+    # The smaller budget of task2 does not evict the entry of task1, nor
+    # changes the budget of the cache
+    assert len(clean_cache) == 1
+    assert clean_cache.max_bytes == 0
@@ -0,0 +1,95 @@
+import hashlib
+import multiprocessing
+import os
+
+import pytest
+
+from iguazu.core.files.cache import DownloadCache
+
+
+def make_download(contents, calls=None):
+    def download(path):
+        if calls is not None:
+            calls.append(path)
+        path.write_bytes(contents)
+    return download
+
+
+def checksum(contents):
+    return hashlib.md5(contents).hexdigest()
+
+
+@pytest.fixture(scope='function')
+def cache(tmpdir):
+    return DownloadCache(tmpdir / 'cache')
+
+
+def test_fetch_downloads_once(cache, tmpdir):
+    contents = b'abc' * 100
+    calls = []
+    first = tmpdir / 'a' / 'file.bin'
+    second = tmpdir / 'b' / 'file.bin'
+
+    cache.fetch(checksum(contents), len(contents), first, make_download(contents, calls))
+    cache.fetch(checksum(contents), len(contents), second, make_download(contents, calls))
+
+    assert len(calls) == 1
+    assert first.read_binary() == second.read_binary() == contents
+    # Hard links to the same cached file
+    assert os.stat(first).st_ino == os.stat(second).st_ino
+
+
+def test_release_reference_counts(cache, tmpdir):
+    contents = b'abc'
+    path = tmpdir / 'file.bin'
+    cache.fetch(checksum(contents), len(contents), path, make_download(contents))
+    cache.acquire(path)
+
+    assert not cache.release(path)
+    assert path.exists()
+    assert cache.release(path)
+    assert not path.exists()
+
+
+def _fetch_in_child(cache, path, contents):
+    cache.fetch(checksum(contents), len(contents), path, make_download(contents))
+
+
+def test_release_other_process(cache, tmpdir):
+    contents = b'abc'
+    path = tmpdir / 'file.bin'
+    cache.fetch(checksum(contents), len(contents), path, make_download(contents))
+
+    # A process that ended does not hold its references anymore
+    process = multiprocessing.get_context('fork').Process(target=_fetch_in_child,
+                                                          args=(cache, path, contents))
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+
+    assert cache.release(path)
+    assert not path.exists()
+
+
+def test_evict_least_recently_used(cache, tmpdir):
+    files = [bytes([i]) * 100 for i in range(3)]
+    for i, contents in enumerate(files):
+        path = tmpdir / f'file{i}.bin'
+        cache.fetch(checksum(contents), len(contents), path, make_download(contents))
+        cache.release(path)
+
+    freed = cache.evict(150)
+
+    assert freed == 200
+    assert not cache._object_path(checksum(files[0])).exists()
+    assert not cache._object_path(checksum(files[1])).exists()
+    assert cache._object_path(checksum(files[2])).exists()
+
+
+def test_evict_keeps_referenced(cache, tmpdir):
+    contents = b'abc' * 100
+    path = tmpdir / 'file.bin'
+    cache.fetch(checksum(contents), len(contents), path, make_download(contents))
+
+    assert cache.evict(0) == 0
+    assert cache._object_path(checksum(contents)).exists()
@@ -0,0 +1,123 @@
+import os
+import time
+
+import pandas.util.testing as tm
+import prefect
+import psutil
+import pytest
+from prefect import Flow
+from prefect.engine.signals import ENDRUN
+from prefect.engine.state import Finished
+from prefect.utilities.debug import raise_on_exception
+
+from iguazu import Task
+from iguazu.core.dataframes import get_shared_dataframe, share_dataframe, shared_dataframes
+from iguazu.core.exceptions import GracefulFailWithResults, SubprocessFailed, SubprocessTimeout
+from iguazu.core.isolation import run_in_subprocess
+
+
+class CustomException(Exception):
+    pass
+
+
+class PidTask(Task):
+    """Task that returns the process id where it runs"""
+    def run(self, *, value):
+        if value < 0:
+            raise CustomException
+        elif value > 0:
+            time.sleep(value)
+        return os.getpid()
+
+
+def test_invalid_isolation():
+    with pytest.raises(ValueError):
+        Task(isolation='thread')
+
+
+def test_isolation_subprocess(temp_url):
+    with Flow('test_isolation_subprocess') as flow:
+        task = PidTask(isolation='subprocess')
+        task(value=0)
+
+    with raise_on_exception(), prefect.context(caches={}):
+        flow_state = flow.run()
+
+    result = list(flow_state.result.values())[0].result
+    assert isinstance(result, int)
+    assert result != os.getpid()
+
+
+def test_isolation_graceful_exceptions(mocker, temp_url):
+    graceful_fail_task_method = mocker.patch('iguazu.core.tasks.Task._graceful_fail',
+                                             side_effect=[ENDRUN(state=Finished())])
+
+    with Flow('test_isolation_graceful_exceptions') as flow:
+        task = PidTask(isolation='subprocess', graceful_exceptions=(CustomException, ))
+        task(value=-1)
+
+    with prefect.context(caches={}):
+        flow.run()
+
+    graceful_fail_task_method.assert_called_once()
+    call_args = graceful_fail_task_method.call_args[0]
+    assert isinstance(call_args[0], CustomException)
+
+
+def test_isolation_timeout(temp_url):
+    with Flow('test_isolation_timeout') as flow:
+        task = PidTask(isolation='subprocess', isolation_timeout=0.5)
+        task(value=10)
+
+    t0 = time.monotonic()
+    with raise_on_exception(), prefect.context(caches={}), pytest.raises(SubprocessTimeout):
+        flow.run()
+    assert time.monotonic() - t0 < 10
+
+
+def test_run_in_subprocess_memory_limit():
+    def allocate():
+        return bytearray(1 << 30)
+
+    # The limit is added to the address space inherited by the child
+    with pytest.raises(MemoryError):
+        run_in_subprocess(allocate, memory_limit=256 << 20)
+
+
+def test_run_in_subprocess_memory_limit_is_relative():
+    def allocate():
+        return len(bytearray(64 << 20))
+
+    assert psutil.Process().memory_info().vms > 256 << 20
+    assert run_in_subprocess(allocate, memory_limit=256 << 20) == 64 << 20
+
+
+def test_run_in_subprocess_killed():
+    def suicide():
+        os._exit(1)
+
+    with pytest.raises(SubprocessFailed):
+        run_in_subprocess(suicide)
+
+
+def test_run_in_subprocess_graceful_with_results():
+    def fail():
+        raise GracefulFailWithResults(['partial'], 'some message')
+
+    with pytest.raises(GracefulFailWithResults) as excinfo:
+        run_in_subprocess(fail)
+    assert excinfo.value.results == ['partial']
+
+
+def test_run_in_subprocess_shared_dataframes(tmpdir):
+    df = tm.makeDataFrame()
+    path = tmpdir / 'file.hdf5'
+
+    def share():
+        share_dataframe(path, '/key', df)
+
+    with shared_dataframes():
+        run_in_subprocess(share)
+        shared = get_shared_dataframe(path, '/key')
+
+    tm.assert_frame_equal(shared, df)
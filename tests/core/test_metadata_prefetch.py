@@ -0,0 +1,128 @@
+import pickle
+import time
+import uuid
+
+import prefect
+import pytest
+from prefect import Flow, Task
+
+from iguazu.core.files import QuetzalFile, QuetzalURL
+from iguazu.core.files.quetzal import file_modified_since_scan, mark_file_modified, mark_workspace_scanned
+from iguazu.core.runners import IguazuFlowRunner
+
+
+@pytest.fixture(scope='function')
+def quetzal_context(tmpdir):
+    url = QuetzalURL(path='', workspace_name='test', workspace_id=1)
+    with prefect.context(temp_url=url, output_url=url, temp_dir=str(tmpdir)):
+        yield url
+
+
+@pytest.fixture(scope='function')
+def quetzal_files(quetzal_context):
+    files = []
+    for i in range(5):
+        file = QuetzalFile(filename=f'file{i}.hdf5', path='data', workspace_id=1)
+        file._file_id = str(uuid.uuid4())
+        files.append(file)
+    return files
+
+
+@pytest.fixture(scope='function')
+def query_mock(mocker, quetzal_files):
+    mocker.patch('iguazu.core.files.quetzal.quetzal_client_from_secret')
+    rows = [
+        {'base': {'id': f.id, 'filename': f'file{i}.hdf5'}, 'iguazu': {'status': 'SUCCESS'}, 'omind': None}
+        for i, f in enumerate(quetzal_files)
+    ]
+
+    def query(client, workspace_id, sql, dialect, limit=None):
+        # Only the rows of the ids of the query
+        batch = [row for row in rows if f"'{row['base']['id']}'" in sql]
+        return batch, len(batch)
+
+    return mocker.patch('quetzal.client.helpers.query', side_effect=query)
+
+
+def test_prefetch_metadata(mocker, quetzal_files, query_mock):
+    metadata_mock = mocker.patch('quetzal.client.helpers.file.metadata')
+
+    count = QuetzalFile.prefetch_metadata(quetzal_files, batch_size=2)
+
+    assert count == len(quetzal_files)
+    assert query_mock.call_count == 3
+    assert [c[1]['limit'] for c in query_mock.call_args_list] == [2, 2, 1]
+    for i, file in enumerate(quetzal_files):
+        assert file.metadata['base']['filename'] == f'file{i}.hdf5'
+        assert file.metadata['iguazu']['status'] == 'SUCCESS'
+        assert 'omind' not in file.metadata
+    metadata_mock.assert_not_called()
+
+
+def test_prefetch_metadata_pickle(quetzal_files, query_mock):
+    # Metadata is not sent when it was not prefetched
+    copied = pickle.loads(pickle.dumps(quetzal_files[0]))
+    assert not copied._metadata
+
+    QuetzalFile.prefetch_metadata(quetzal_files)
+
+    copied = pickle.loads(pickle.dumps(quetzal_files[0]))
+    assert copied.metadata['iguazu']['status'] == 'SUCCESS'
+    # The metadata is only sent once: a second copy downloads it again
+    copied_again = pickle.loads(pickle.dumps(copied))
+    assert not copied_again._metadata
+
+
+def test_prefetch_metadata_local_changes(quetzal_files, query_mock):
+    QuetzalFile.prefetch_metadata(quetzal_files)
+    quetzal_files[0].metadata['iguazu']['status'] = 'FAILED'
+
+    # Prefetching again does not discard the change that was not uploaded
+    count = QuetzalFile.prefetch_metadata(quetzal_files)
+
+    assert count == len(quetzal_files) - 1
+    assert quetzal_files[0].metadata['iguazu']['status'] == 'FAILED'
+    assert quetzal_files[1].metadata['iguazu']['status'] == 'SUCCESS'
+
+
+def test_prefetch_metadata_modified_since_scan(mocker, quetzal_files, query_mock):
+    metadata_mock = mocker.patch('quetzal.client.helpers.file.metadata')
+    metadata_mock.return_value = {'base': {'id': quetzal_files[0].id}, 'iguazu': {'status': 'FAILED'}}
+    mark_workspace_scanned(1)
+    mark_file_modified(1, quetzal_files[0].id)
+
+    # The query would only see the metadata of the last scan
+    count = QuetzalFile.prefetch_metadata(quetzal_files)
+
+    assert count == len(quetzal_files) - 1
+    assert not quetzal_files[0]._metadata
+    assert quetzal_files[0].metadata['iguazu']['status'] == 'FAILED'
+    metadata_mock.assert_called_once()
+
+    # A new scan sees the modification
+    time.sleep(0.05)
+    mark_workspace_scanned(1)
+    assert QuetzalFile.prefetch_metadata(quetzal_files[1:2]) == 1
+    assert not file_modified_since_scan(1, quetzal_files[0].id)
+
+
+class Identity(Task):
+    def run(self, file):
+        return file
+
+
+def test_runner_prefetch_mapped(mocker, quetzal_files):
+    prefetch_mock = mocker.patch('iguazu.core.files.QuetzalFile.prefetch_metadata')
+    # prefect uses the repr of the files, which downloads their metadata
+    metadata_mock = mocker.patch('quetzal.client.helpers.file.metadata')
+    metadata_mock.return_value = {'base': {}}
+    mocker.patch('iguazu.core.files.quetzal.quetzal_client_from_secret')
+
+    with Flow('test_runner_prefetch_mapped') as flow:
+        Identity().map(file=quetzal_files)
+
+    state = flow.run(runner_cls=IguazuFlowRunner)
+
+    assert state.is_successful()
+    prefetch_mock.assert_called_once()
+    assert list(prefetch_mock.call_args[0][0]) == quetzal_files
@@ -0,0 +1,116 @@
+import copy
+
+import prefect
+import pytest
+from prefect import Flow
+
+from iguazu import Task
+from iguazu.core.files import QuetzalFile, QuetzalURL
+from iguazu.core.files.metadata import buffered_metadata, diff
+
+METADATA = {
+    'base': {'id': 'abc', 'filename': 'file.hdf5', 'path': 'data', 'state': 'READY'},
+    'iguazu': {'status': None, 'flows': {'flow_a': {'status': None}}},
+}
+
+
+@pytest.fixture(scope='function')
+def quetzal_context(mocker, tmpdir):
+    mocker.patch('iguazu.core.files.quetzal.quetzal_client_from_secret')
+    url = QuetzalURL(path='', workspace_name='test', workspace_id=1)
+    with prefect.context(temp_url=url, output_url=url, temp_dir=str(tmpdir)):
+        yield url
+
+
+@pytest.fixture(scope='function')
+def update_mock(mocker, quetzal_context):
+    return mocker.patch('quetzal.client.helpers.workspace.update_metadata')
+
+
+def make_file():
+    return QuetzalFile.from_metadata(copy.deepcopy(METADATA), workspace_id=1)
+
+
+def test_diff():
+    old = {'a': {'x': 1, 'y': {'z': 2}}, 'b': 1}
+    new = {'a': {'x': 1, 'y': {'z': 3}}, 'b': 1, 'c': None}
+    assert diff(new, old) == {'a': {'y': {'z': 3}}, 'c': None}
+
+
+def test_unbuffered_upload(update_mock):
+    file = make_file()
+    file.metadata['iguazu']['status'] = 'SUCCESS'
+    file.upload_metadata()
+    update_mock.assert_called_once()
+
+
+def test_buffered_uploads_are_merged(update_mock):
+    with buffered_metadata() as writer:
+        file = make_file()
+        file.metadata['iguazu']['status'] = 'FAILURE'
+        file.upload_metadata()
+        file.metadata['iguazu']['status'] = 'SUCCESS'
+        file.upload_metadata()
+
+        # Another instance of the same file changes another key
+        other = make_file()
+        other.metadata['iguazu']['flows']['flow_b'] = {'status': 'SUCCESS'}
+        other.upload_metadata()
+        update_mock.assert_not_called()
+
+    update_mock.assert_called_once()
+    sent = update_mock.call_args[0][3]
+    assert sent['iguazu'] == {
+        'status': 'SUCCESS',
+        'flows': {'flow_a': {'status': None}, 'flow_b': {'status': 'SUCCESS'}},
+    }
+    assert 'base' not in sent
+    assert (writer.requested, writer.sent, writer.saved) == (3, 1, 2)
+
+
+def test_buffered_upload_deleted_file(mocker, update_mock):
+    mocker.patch('quetzal.client.helpers.file.delete')
+    with buffered_metadata():
+        file = make_file()
+        file.metadata['iguazu']['status'] = 'SUCCESS'
+        file.upload_metadata()
+        file.delete()
+
+    update_mock.assert_not_called()
+
+
+def test_saved_counts_merged_uploads(update_mock):
+    with buffered_metadata() as writer:
+        first, second = make_file(), make_file()
+        first.upload_metadata()
+        second.upload_metadata()
+        third = QuetzalFile.from_metadata(dict(copy.deepcopy(METADATA), base=dict(METADATA['base'], id='def')),
+                                          workspace_id=1)
+        third.upload_metadata()
+        # Pending uploads are not saved yet
+        assert writer.saved == 0
+
+    assert (writer.requested, writer.sent, writer.saved) == (3, 2, 1)
+
+
+class OutputTask(Task):
+    def run(self):
+        file = make_file()
+        file._local_path.parent.mkdir(parents=True, exist_ok=True)
+        file._local_path.write_bytes(b'contents')
+        return file
+
+
+def test_flush_errors_are_managed_by_handle_outputs(mocker, update_mock):
+    mocker.patch('iguazu.core.files.QuetzalFile.upload_data')
+    update_mock.side_effect = RuntimeError('Quetzal is down')
+    hard_fail = mocker.patch.object(OutputTask, '_hard_fail')
+    task = OutputTask()
+    with Flow('test_flush_errors_are_managed_by_handle_outputs') as flow:
+        output = task()
+
+    with prefect.context(caches={}):
+        state = flow.run()
+
+    assert state.result[output].is_failed()
+    hard_fail.assert_called_once()
@@ -0,0 +1,160 @@
+import pandas as pd
+import pandas.util.testing as tm
+import prefect
+import pytest
+from prefect import Flow
+
+from iguazu import Task
+from iguazu.core.exceptions import SoftPreconditionFailed
+from iguazu.core.files import LocalFile
+from iguazu.core.pipelines import FusedPipeline, PipelineStage
+from iguazu.functions.specs import store_output
+from iguazu.helpers.states import GracefulFail, SkippedResult
+
+
+class AddOne(Task):
+
+    def __init__(self, *, input_key, output_key, suffix, fail=False, **kwargs):
+        super().__init__(**kwargs)
+        self.output_key = output_key
+        self.suffix = suffix
+        self.fail = fail
+        self.auto_manage_input_dataframe('signals', input_key)
+
+    def run(self, *, signals):
+        if self.fail or signals.empty:
+            raise SoftPreconditionFailed('Failed by design')
+        output = self.default_outputs()
+        store_output(output.file, self.output_key, dataframe=signals + 1, annotations=None)
+        return output
+
+    def default_outputs(self, **kwargs):
+        return self.create_file(parent=prefect.context.run_kwargs['signals'],
+                                suffix=self.suffix)
+
+
+@pytest.fixture(scope='function')
+def raw_file(temp_url):
+    df = tm.makeDataFrame()
+    path = temp_url.path / 'raw.hdf5'
+    with pd.HDFStore(str(path), 'w') as store:
+        df.to_hdf(store, '/raw')
+    return LocalFile(filename='raw.hdf5', path='', temporary=True), df
+
+
+def _pipeline(fail_first=False, checkpoints=None):
+    first = AddOne(name='first', input_key='/raw', output_key='/first',
+                   suffix='_first', fail=fail_first)
+    second = AddOne(name='second', input_key='/first', output_key='/second',
+                    suffix='_second')
+    return FusedPipeline(
+        stages=[
+            PipelineStage('first', first, dict(signals='raw')),
+            PipelineStage('second', second, dict(signals='first')),
+        ],
+        checkpoints=checkpoints,
+    )
+
+
+def test_pipeline_bad_definition():
+    task = AddOne(input_key='/raw', output_key='/first', suffix='_first')
+    with pytest.raises(ValueError):
+        FusedPipeline(stages=[])
+    with pytest.raises(ValueError):
+        FusedPipeline(stages=[PipelineStage('a', task), PipelineStage('a', task)])
+    with pytest.raises(ValueError):
+        FusedPipeline(stages=[PipelineStage('a', task)], checkpoints=['b'])
+
+
+def test_pipeline_in_memory(mocker, raw_file):
+    raw, df = raw_file
+    upload = mocker.patch('iguazu.core.files.local.LocalFile.upload')
+    read_hdf = mocker.spy(pd, 'read_hdf')
+    pipeline = _pipeline()
+
+    with Flow('test_pipeline_in_memory') as flow:
+        fused = pipeline(raw=raw)
+
+    with prefect.context(caches={}):
+        flow_state = flow.run()
+
+    result = flow_state.result[fused].result
+    tm.assert_frame_equal(pd.read_hdf(result.file, '/second'), df + 2)
+    # Only the raw file was read, the second stage received the first stage
+    # results in memory
+    assert read_hdf.call_count == 1
+    # Only the last stage output was uploaded
+    assert upload.call_count == 1
+    assert result.metadata['iguazu']['task'].endswith('AddOne')
+
+
+def test_pipeline_checkpoints(mocker, raw_file):
+    raw, _ = raw_file
+    upload = mocker.patch('iguazu.core.files.local.LocalFile.upload')
+    pipeline = _pipeline(checkpoints=['first'])
+
+    with Flow('test_pipeline_checkpoints') as flow:
+        pipeline(raw=raw)
+
+    with prefect.context(caches={}):
+        flow.run()
+
+    assert upload.call_count == 2
+
+
+def test_pipeline_previous_results(mocker, raw_file):
+    raw, df = raw_file
+    raw.upload()
+    pipeline = _pipeline()
+
+    with Flow('test_pipeline_previous_results') as flow:
+        fused = pipeline(raw=raw)
+
+    with prefect.context(caches={}):
+        first = flow.run().result[fused]
+    run = mocker.spy(AddOne, 'run')
+    with prefect.context(caches={}):
+        second = flow.run().result[fused]
+
+    assert first.is_successful() and not isinstance(first, SkippedResult)
+    # The previous result of the last stage is found before running any stage
+    assert isinstance(second, SkippedResult)
+    assert second.result.basename == 'raw_first_second.hdf5'
+    tm.assert_frame_equal(pd.read_hdf(second.result.file, '/second'), df + 2)
+    assert run.call_count == 0
+    # The intermediate output was not saved: the journal refers to its parent
+    assert first.result.metadata['iguazu']['parents'] == [raw.id]
+
+
+def test_pipeline_graceful_fail(raw_file):
+    raw, _ = raw_file
+    pipeline = _pipeline(fail_first=True)
+
+    with Flow('test_pipeline_graceful_fail') as flow:
+        fused = pipeline(raw=raw)
+
+    with prefect.context(caches={}):
+        flow_state = flow.run()
+
+    state = flow_state.result[fused]
+    assert isinstance(state, GracefulFail)
+    assert state.result.metadata['iguazu']['status'] == 'FAILED'
+
+
+def test_pipeline_failed_input(raw_file):
+    raw, _ = raw_file
+    raw.metadata['iguazu'] = {'status': 'FAILURE'}
+    pipeline = _pipeline()
+
+    with Flow('test_pipeline_failed_input') as flow:
+        fused = pipeline(raw=raw)
+
+    with prefect.context(caches={}):
+        flow_state = flow.run()
+
+    # Like the chain of separate tasks: each stage creates a failed output
+    state = flow_state.result[fused]
+    assert isinstance(state, GracefulFail)
+    assert state.result is not None
+    assert state.result.basename == 'raw_first_second.hdf5'
+    assert state.result.metadata['iguazu']['status'] == 'FAILED'
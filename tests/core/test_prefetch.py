@@ -0,0 +1,84 @@
+import threading
+import uuid
+
+import prefect
+import pytest
+from prefect import Flow, Task
+
+from iguazu.core.files import QuetzalFile, QuetzalURL
+from iguazu.core.prefetch import InputPrefetcher
+from iguazu.core.runners import IguazuFlowRunner
+
+
+@pytest.fixture(scope='function')
+def quetzal_files(tmpdir):
+    url = QuetzalURL(path='', workspace_name='test', workspace_id=1)
+    with prefect.context(temp_url=url, output_url=url, temp_dir=str(tmpdir)):
+        files = []
+        for i in range(6):
+            file = QuetzalFile(filename=f'file{i}.bin', path='data', workspace_id=1, temporary=True)
+            file._file_id = str(uuid.uuid4())
+            file._metadata['base'].update(id=file._file_id, filename=f'file{i}.bin', size=100)
+            files.append(file)
+        yield files
+
+
+@pytest.fixture(scope='function')
+def download_mock(mocker):
+    downloaded = []
+    lock = threading.Lock()
+
+    def download(self):
+        with lock:
+            downloaded.append(self._local_path.name)
+        self._local_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local_path.write_bytes(b'x' * 100)
+
+    mocker.patch('iguazu.core.files.QuetzalFile.download_data', autospec=True, side_effect=download)
+    mocker.patch('iguazu.core.files.quetzal.quetzal_client_from_secret')
+    return downloaded
+
+
+def test_prefetcher_lookahead(quetzal_files, download_mock):
+    prefetcher = InputPrefetcher(quetzal_files, lookahead=2)
+
+    prefetcher.consumed(quetzal_files[0])
+    # The first file was waited for, the next ones are being downloaded
+    assert 'file0.bin' in download_mock
+    prefetcher.consumed(quetzal_files[1])
+    prefetcher.consumed(quetzal_files[2])
+    prefetcher.close()
+
+    # Never more than lookahead files ahead of the last consumed file
+    assert set(download_mock) <= {f'file{i}.bin' for i in range(5)}
+    assert {'file0.bin', 'file1.bin', 'file2.bin'} <= set(download_mock)
+
+
+def test_prefetcher_budget(quetzal_files, download_mock):
+    prefetcher = InputPrefetcher(quetzal_files, lookahead=10, budget=250)
+    prefetcher.consumed(quetzal_files[0])
+    prefetcher.close()
+
+    # 100 bytes per file: only two files can wait for their consumer
+    assert 'file0.bin' in download_mock
+    assert len(download_mock) <= 3
+
+
+class ReadFile(Task):
+    def run(self, file):
+        return file.file.read_bytes()
+
+
+def test_runner_prefetch_mapped(mocker, quetzal_files, download_mock):
+    mocker.patch('iguazu.core.files.QuetzalFile.prefetch_metadata')
+    task = ReadFile()
+    task.meta = mocker.Mock(prefetch_inputs=2, prefetch_workers=2, prefetch_budget=0)
+
+    with Flow('test_runner_prefetch_mapped') as flow:
+        task.map(file=quetzal_files)
+
+    state = flow.run(runner_cls=IguazuFlowRunner)
+
+    assert state.is_successful()
+    # Each file was downloaded once, by the prefetcher or by the task
+    assert sorted(download_mock) == sorted(f.basename for f in quetzal_files)
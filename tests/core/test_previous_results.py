@@ -0,0 +1,75 @@
+import prefect
+import pytest
+from prefect import Flow
+from quetzal.client import helpers
+
+from iguazu import Task
+from iguazu.core.files import QuetzalFile
+from iguazu.core.files.quetzal import record_finds
+from iguazu.core.quetzal_client import get_client
+from iguazu.core.runners import IguazuFlowRunner
+from iguazu.helpers.states import SkippedResult
+
+
+class CopyTask(Task):
+
+    def run(self, *, file):
+        output = self.default_outputs(file=file)
+        output.file.write_bytes(file.file.read_bytes())
+        return output
+
+    def default_outputs(self, **inputs):
+        return self.create_file(parent=inputs['file'], suffix='_copy')
+
+
+class ContextCopyTask(CopyTask):
+    """Copy task whose default outputs read the inputs from the context, like most tasks"""
+
+    def default_outputs(self, **inputs):
+        return self.create_file(parent=prefect.context.run_kwargs['file'], suffix='_copy')
+
+
+def create_inputs(count):
+    workspace_id = prefect.context.temp_url.workspace_id
+    files = []
+    for i in range(count):
+        file = QuetzalFile(filename=f'file{i}.bin', path='data', workspace_id=workspace_id, temporary=True)
+        file.file.write_bytes(b'contents')
+        file.upload()
+        files.append(file)
+    return files
+
+
+def test_record_finds(quetzal_server):
+    with record_finds() as recorded:
+        found = QuetzalFile.find(filename='file.bin', path='data', metadata={}, workspace_id=1)
+
+    assert found is None
+    assert recorded == [dict(filename='file.bin', path='data', metadata={}, workspace_id=1)]
+    assert 'file_fetch' not in quetzal_server.stats()['requests']
+
+
+@pytest.mark.parametrize('task_class', [CopyTask, ContextCopyTask])
+def test_mapped_children_with_previous_results_are_skipped(quetzal_server, task_class):
+    inputs = create_inputs(3)
+    task = task_class()
+    with Flow('test_mapped_children_with_previous_results_are_skipped') as flow:
+        mapped = task.map(file=inputs)
+
+    with prefect.context(caches={}):
+        first = flow.run(runner_cls=IguazuFlowRunner)
+    assert first.is_successful()
+    assert not any(isinstance(s, SkippedResult) for s in first.result[mapped].map_states)
+
+    # Queries only see the files of the last scan of the workspace
+    client = get_client(**quetzal_server.client_kwargs)
+    helpers.workspace.scan(client, prefect.context.temp_url.workspace_id, wait=True)
+    finds_before = quetzal_server.stats()['requests'].get('file_fetch', 0)
+
+    with prefect.context(caches={}):
+        second = flow.run(runner_cls=IguazuFlowRunner)
+
+    map_states = second.result[mapped].map_states
+    assert all(isinstance(s, SkippedResult) for s in map_states)
+    assert [s.result.basename for s in map_states] == ['file0_copy.bin', 'file1_copy.bin', 'file2_copy.bin']
+    assert quetzal_server.stats()['requests'].get('file_fetch', 0) == finds_before
@@ -0,0 +1,81 @@
+import time
+
+import pandas as pd
+import prefect
+from prefect import Flow
+
+from iguazu import Task
+from iguazu.core.profiling import PHASES, profile_phase, profile_task, record_rows
+from iguazu.core.runners import IguazuFlowRunner
+
+
+def test_phases_are_added_up():
+    with profile_task() as profile:
+        with profile_phase('run'):
+            record_rows(10)
+            time.sleep(0.01)
+            # Nested phases with the same name are only measured once
+            with profile_phase('run'):
+                record_rows(5)
+                time.sleep(0.01)
+            with profile_phase('graceful_fail'):
+                pass
+        with profile_phase('contexts'):
+            pass
+
+    summary = profile.summary()
+    assert list(summary) == ['contexts', 'run', 'graceful_fail', 'total']
+    assert summary['run']['rows'] == 15
+    assert 0.02 <= summary['run']['wall_seconds'] < 1
+    assert summary['total']['wall_seconds'] >= summary['run']['wall_seconds']
+    assert summary['total']['rows'] == 15
+    assert set(summary['run']) == {'wall_seconds', 'cpu_seconds', 'peak_rss_delta',
+                                   'read_bytes', 'written_bytes', 'rows'}
+
+
+def test_without_profile():
+    # Phases and rows outside a profile are ignored
+    with profile_phase('run'):
+        record_rows(1)
+
+
+class SleepTask(Task):
+    def run(self):
+        time.sleep(0.01)
+        return 1
+
+
+def test_runner_saves_profile(temp_url):
+    task = SleepTask()
+    with Flow('test_runner_saves_profile') as flow:
+        result = task()
+
+    with prefect.context(caches={}):
+        state = flow.run(runner_cls=IguazuFlowRunner)
+
+    assert state.is_successful()
+    profile = state.result[result].task_profile
+    assert set(profile) <= set(PHASES) | {'total'}
+    assert {'contexts', 'prepare_inputs', 'run', 'handle_outputs'} <= set(profile)
+    assert profile['run']['wall_seconds'] >= 0.01
+
+
+class HeadTask(Task):
+    def run(self, *, dataframe):
+        return dataframe.head(3)
+
+
+def test_rows_counted_once(temp_url):
+    task = HeadTask()
+    with Flow('test_rows_counted_once') as flow:
+        result = task(dataframe=pd.DataFrame({'x': range(10)}))
+
+    with prefect.context(caches={}):
+        state = flow.run(runner_cls=IguazuFlowRunner)
+
+    assert state.is_successful()
+    profile = state.result[result].task_profile
+    # Input rows are counted when they are prepared, not again when run
+    assert profile['prepare_inputs']['rows'] == 10
+    assert profile['run']['rows'] == 3
+    assert profile['total']['rows'] == 13
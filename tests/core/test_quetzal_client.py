@@ -0,0 +1,94 @@
+import threading
+import time
+
+import prefect
+import pytest
+from quetzal.client import Configuration
+from urllib3.exceptions import EmptyPoolError
+
+from iguazu.core.quetzal_client import (
+    RequestLimiter, _ManagedRestClient, account_calls, api_call, api_call_stats, get_client
+)
+from iguazu.core.runners import IguazuFlowRunner
+
+
+def test_get_client_is_shared():
+    first = get_client(url='https://localhost/api/v1', username='user', password='secret')
+    second = get_client(url='https://localhost/api/v1', username='user', password='secret')
+    other = get_client(url='https://localhost/api/v1', username='other', password='secret')
+
+    assert first is second
+    assert first is not other
+    assert first.rest_client.pool_manager.connection_pool_kw['block']
+
+
+def test_pool_timeout():
+    client = _ManagedRestClient(Configuration(), pool_size=1, keepalive=True, pool_timeout=0.1)
+    pool = client.pool_manager.connection_from_url('http://localhost:1')
+    # A connection that is never released, like an unread streamed response
+    pool._get_conn()
+
+    start = time.monotonic()
+    with pytest.raises(EmptyPoolError):
+        client.pool_manager.urlopen('GET', 'http://localhost:1/')
+    assert time.monotonic() - start < 5
+
+
+def test_request_limiter():
+    limiter = RequestLimiter(max_requests=2)
+    max_in_flight = []
+
+    def request():
+        with limiter.request():
+            max_in_flight.append(limiter.stats()['in_flight'])
+            time.sleep(0.05)
+
+    threads = [threading.Thread(target=request) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = limiter.stats()
+    assert max(max_in_flight) <= 2
+    assert stats['total'] == 6
+    assert stats['in_flight'] == stats['queued'] == 0
+    assert sum(stats['latency_histogram'].values()) == 6
+    assert stats['latency_sum'] >= 6 * 0.05
+
+
+def test_account_calls():
+    with account_calls() as outer:
+        with api_call('find'):
+            pass
+        with account_calls(reuse=True) as reused:
+            assert reused is outer
+            with api_call('find'):
+                pass
+        with account_calls() as inner:
+            with pytest.raises(ValueError):
+                with api_call('retrieve'):
+                    raise ValueError('Not found')
+
+    assert outer.summary()['find']['count'] == 2
+    assert 'retrieve' not in outer.summary()
+    assert inner.summary()['retrieve']['errors'] == 1
+    assert api_call_stats()['find']['count'] >= 2
+
+
+class QuetzalTask(prefect.Task):
+    def run(self):
+        with api_call('query'):
+            pass
+        return 1
+
+
+def test_runner_accounts_calls():
+    task = QuetzalTask()
+    with prefect.Flow('test_runner_accounts_calls') as flow:
+        result = task()
+
+    state = flow.run(runner_cls=IguazuFlowRunner)
+
+    assert state.is_successful()
+    assert state.result[result].quetzal_calls['query']['count'] == 1
@@ -0,0 +1,76 @@
+import sqlite3
+import time
+
+import prefect
+import pytest
+from prefect import Flow
+
+from iguazu.core.files import QuetzalFile
+from iguazu.core.quetzal_client import get_client
+from iguazu.core.quetzal_server import MIN_SQLITE_VERSION, LocalQuetzalServer
+from iguazu.tasks.quetzal import Query, ScanWorkspace
+
+pytestmark = pytest.mark.skipif(sqlite3.sqlite_version_info < MIN_SQLITE_VERSION,
+                                reason='The local Quetzal server needs a newer SQLite')
+
+CONTENTS = b'0123456789' * 1000
+
+
+def create_file(filename, status):
+    workspace_id = prefect.context.temp_url.workspace_id
+    file = QuetzalFile(filename=filename, path='data', workspace_id=workspace_id, temporary=True)
+    file.file.write_bytes(CONTENTS)
+    file.metadata['iguazu']['status'] = status
+    file.upload()
+    return file
+
+
+def test_file_roundtrip(quetzal_server):
+    file = create_file('file.bin', 'SUCCESS')
+    file_id = file.id
+    file.clean()
+
+    retrieved = QuetzalFile.retrieve(file_id=file_id, workspace_id=prefect.context.temp_url.workspace_id)
+    assert retrieved.metadata['iguazu']['status'] == 'SUCCESS'
+    assert retrieved.file.read_bytes() == CONTENTS
+
+    stats = quetzal_server.stats()
+    assert stats['requests']['file_create'] == 1
+    assert stats['bytes_sent'] >= len(CONTENTS)
+
+
+def test_query_scanned_metadata(quetzal_server):
+    workspace_id = prefect.context.temp_url.workspace_id
+    for i in range(4):
+        create_file(f'file{i}.bin', 'SUCCESS' if i % 2 else 'FAILURE')
+
+    sql = """
+        SELECT base->>'id' AS id, base->>'filename' AS filename
+        FROM   metadata
+        WHERE  iguazu->>'status' = 'SUCCESS'
+        ORDER BY filename
+    """
+    scan = ScanWorkspace()
+    query = Query(as_file_adapter=True)
+    with Flow('test_query_scanned_metadata') as flow:
+        wid = scan(workspace_id=workspace_id)
+        results = query(query=sql, dialect='postgresql_json', workspace_id=wid)
+
+    state = flow.run()
+
+    assert state.is_successful()
+    files = state.result[results].result
+    assert [f.basename for f in files] == ['file1.bin', 'file3.bin']
+
+
+def test_latency():
+    with LocalQuetzalServer(latency=0.1) as server:
+        client = get_client(**server.client_kwargs)
+        client.login()
+        t0 = time.perf_counter()
+        response = client.workspace_fetch()
+        elapsed = time.perf_counter() - t0
+
+    assert response.total == 0
+    assert elapsed >= 0.1
+    assert server.stats()['requests'] == {'auth_token': 1, 'workspace_fetch': 1}
@@ -0,0 +1,105 @@
+import collections
+import hashlib
+
+import prefect
+import pytest
+
+from iguazu.core.files import QuetzalFile, QuetzalURL
+from iguazu.core.files.checksums import ChecksumIndex
+
+CONTENTS = b'0123456789' * 1000
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+        self.released = False
+
+    def stream(self, amt):
+        for start in range(0, len(self.data), amt):
+            yield self.data[start:start + amt]
+
+    def release_conn(self):
+        self.released = True
+
+
+@pytest.fixture(scope='function')
+def checksum_index(mocker, tmpdir):
+    index = ChecksumIndex()
+    mocker.patch('iguazu.core.files.checksums.default_index', return_value=index)
+    return index
+
+
+@pytest.fixture(scope='function')
+def quetzal_file(mocker, tmpdir, checksum_index):
+    url = QuetzalURL(path='', workspace_name='test', workspace_id=1)
+    client = mocker.Mock()
+    mocker.patch('iguazu.core.files.quetzal.quetzal_client_from_secret', return_value=client)
+    with prefect.context(temp_url=url, output_url=url, temp_dir=str(tmpdir)):
+        file = QuetzalFile(filename='file.bin', path='data', workspace_id=1, temporary=True)
+        yield file
+
+
+def test_stream_download(quetzal_file, checksum_index):
+    response = FakeResponse(CONTENTS)
+    quetzal_file.client.workspace_file_details.return_value = response
+    quetzal_file._file_id = 'abc'
+    quetzal_file._metadata['base'].update(checksum=hashlib.md5(CONTENTS).hexdigest(),
+                                          size=len(CONTENTS))
+
+    path = quetzal_file.file
+
+    assert path.read_bytes() == CONTENTS
+    assert response.released
+    # The downloaded file is in the index: checking it does not read it
+    assert quetzal_file.checksum_local(path)
+    assert (checksum_index.hits, checksum_index.misses) == (1, 0)
+
+
+def test_stream_download_corrupted(quetzal_file):
+    quetzal_file.client.workspace_file_details.return_value = FakeResponse(CONTENTS[:-1])
+    quetzal_file._file_id = 'abc'
+    quetzal_file._metadata['base'].update(checksum=hashlib.md5(CONTENTS).hexdigest(),
+                                          size=len(CONTENTS))
+
+    with pytest.raises(ValueError):
+        quetzal_file.download_data()
+    assert not quetzal_file._local_path.exists()
+    assert not list(quetzal_file._local_path.parent.iterdir())
+
+
+def test_stream_download_concurrent(quetzal_file):
+    # Another download of the same file (e.g. by another process) starts and
+    # finishes while the first one is still writing
+    quetzal_file._file_id = 'abc'
+    quetzal_file._metadata['base'].update(checksum=hashlib.md5(CONTENTS).hexdigest(),
+                                          size=len(CONTENTS))
+    target = quetzal_file._local_path
+
+    class InterruptedResponse(FakeResponse):
+        def stream(self, amt):
+            chunks = super().stream(amt)
+            yield next(chunks)
+            quetzal_file.client.workspace_file_details.return_value = FakeResponse(CONTENTS)
+            quetzal_file._stream_download(target)
+            yield from chunks
+
+    quetzal_file.client.workspace_file_details.return_value = InterruptedResponse(CONTENTS)
+    quetzal_file._stream_download(target)
+
+    assert target.read_bytes() == CONTENTS
+    assert list(target.parent.iterdir()) == [target]
+
+
+def test_upload_records_checksum(mocker, quetzal_file, checksum_index):
+    details = collections.namedtuple('Details', ['id', 'checksum', 'size'])
+    upload_mock = mocker.patch('quetzal.client.helpers.workspace.upload')
+    upload_mock.return_value = details('abc', hashlib.md5(CONTENTS).hexdigest(), len(CONTENTS))
+    quetzal_file.file.write_bytes(CONTENTS)
+
+    quetzal_file.upload_data()
+
+    upload_mock.assert_called_once()
+    assert quetzal_file.id == 'abc'
+    assert checksum_index.checksum(quetzal_file.file) == (upload_mock.return_value.checksum, len(CONTENTS))
+    assert (checksum_index.hits, checksum_index.misses) == (1, 0)
@@ -0,0 +1,115 @@
+import time
+
+import prefect
+import pytest
+from prefect import Flow
+
+from iguazu import Task
+from iguazu.core.files import LocalFile
+from iguazu.core.result_cache import ResultCache, task_fingerprint
+from iguazu.helpers.states import SkippedResult
+
+
+def test_put_get(tmpdir):
+    cache = ResultCache(tmpdir / 'results.sqlite3')
+    cache.put('abc', 'task', {'value': 1})
+
+    assert cache.get('abc') == (True, {'value': 1})
+    assert cache.get('xyz') == (False, None)
+    assert cache.stats() == dict(hits=1, misses=1, stores=1, evictions=0, entries=1)
+
+    # The entries persist on another instance
+    other = ResultCache(tmpdir / 'results.sqlite3')
+    assert other.get('abc') == (True, {'value': 1})
+
+
+def test_eviction():
+    cache = ResultCache(max_age=0, max_entries=2)
+    for key in ('a', 'b', 'c'):
+        cache.put(key, 'task', key)
+        time.sleep(0.01)
+    assert cache.get('a') == (False, None)
+    assert cache.stats()['entries'] == 2
+    assert cache.evictions == 1
+
+    cache.max_age = 0.01
+    time.sleep(0.02)
+    assert cache.get('c') == (False, None)
+    cache.evict()
+    assert cache.stats()['entries'] == 0
+
+
+_runs = []
+
+
+class CopyTask(Task):
+
+    def run(self, *, file, suffix):
+        _runs.append(file)
+        output = LocalFile(filename=file.basename + suffix, path='', temporary=True)
+        output.file.write_text(file.file.read_text())
+        return output
+
+
+@pytest.fixture(scope='function')
+def result_cache_env(monkeypatch, tmpdir):
+    monkeypatch.setenv('IGUAZU_RESULT_CACHE_PATH', str(tmpdir / 'cache' / 'results.sqlite3'))
+    monkeypatch.setenv('IGUAZU_CHECKSUM_INDEX', '')
+    _runs.clear()
+
+
+def test_task_result_cache(temp_url, result_cache_env):
+    input_file = LocalFile(filename='input.txt', path='', temporary=True)
+    input_file.file.write_text('contents')
+
+    task = CopyTask(result_cache=True)
+    with Flow('test_task_result_cache') as flow:
+        copied = task(file=input_file, suffix='.copy')
+
+    def run():
+        with prefect.context(caches={}):
+            return flow.run().result[copied]
+
+    first = run()
+    second = run()
+    assert first.is_successful() and not isinstance(first, SkippedResult)
+    assert isinstance(second, SkippedResult)
+    assert second.result.file.read_text() == 'contents'
+    assert len(_runs) == 1
+
+    # Different input contents are a different fingerprint
+    input_file.file.write_text('other contents')
+    third = run()
+    assert not isinstance(third, SkippedResult)
+    assert len(_runs) == 2
+
+    # Missing outputs are not used
+    third.result.delete()
+    fourth = run()
+    assert not isinstance(fourth, SkippedResult)
+    assert len(_runs) == 3
+
+
+def test_fingerprint_input_status(temp_url):
+    input_file = LocalFile(filename='input.txt', path='', temporary=True)
+    input_file.file.write_text('contents')
+    task = CopyTask(result_cache=True)
+
+    before = task_fingerprint(task, dict(file=input_file, suffix='.copy'))
+    input_file.metadata['iguazu'] = {'status': 'FAILURE'}
+    assert task_fingerprint(task, dict(file=input_file, suffix='.copy')) != before
+
+
+def test_fingerprint_errors_run_the_task(mocker, temp_url, result_cache_env):
+    mocker.patch('iguazu.core.tasks.task_fingerprint', side_effect=ConnectionError)
+    input_file = LocalFile(filename='input.txt', path='', temporary=True)
+    input_file.file.write_text('contents')
+
+    task = CopyTask(result_cache=True)
+    with Flow('test_fingerprint_errors_run_the_task') as flow:
+        copied = task(file=input_file, suffix='.copy')
+
+    with prefect.context(caches={}):
+        state = flow.run().result[copied]
+    assert state.is_successful() and not isinstance(state, SkippedResult)
+    assert len(_runs) == 1
@@ -0,0 +1,53 @@
+import pickle
+
+import pendulum
+import prefect
+from prefect import Flow
+from prefect.engine.state import Cached
+from prefect.utilities.debug import raise_on_exception
+
+from iguazu import Task
+from iguazu.core.runners import IguazuFlowRunner
+from iguazu.core.state_cache import FlowStateCache
+
+
+def test_append_and_expire(tmpdir):
+    path = tmpdir / 'task_states.sqlite3'
+    cache = FlowStateCache(path)
+    fresh = Cached(result=1, cached_result_expiration=pendulum.now('utc').add(days=1))
+    expired = Cached(result=2, cached_result_expiration=pendulum.now('utc').subtract(days=1))
+
+    assert not cache
+    assert cache.get('task', []) == []
+    assert cache.append('task', [fresh, expired]) == 2
+    assert cache.append('task', [fresh]) == 0
+
+    # Another process only sees the states that did not expire
+    other = pickle.loads(pickle.dumps(cache))
+    assert [s.result for s in other['task']] == [1]
+    assert list(FlowStateCache(path)) == ['task']
+
+    assert cache.size() == 2
+    assert cache.compact() == 1
+    assert cache.size() == 1
+
+
+def test_flow_uses_persisted_cache(mocker, temp_url, tmpdir):
+    run_method = mocker.patch('iguazu.Task.run',
+                              side_effect=['result1', Exception('should not be called')])
+    task = Task(force=False)
+    path = tmpdir / 'task_states.sqlite3'
+
+    with Flow('test_flow_uses_persisted_cache') as flow:
+        result = task()
+
+    with prefect.context(caches=FlowStateCache(path)):
+        flow_state1 = flow.run(run_on_schedule=True, runner_cls=IguazuFlowRunner)
+
+    # A new instance reads the states saved by the previous flow run
+    with raise_on_exception(), prefect.context(caches=FlowStateCache(path)):
+        flow_state2 = flow.run(run_on_schedule=True, runner_cls=IguazuFlowRunner)
+
+    assert flow_state1.result[result].result == 'result1'
+    assert flow_state2.result[result].result == 'result1'
+    assert run_method.call_count == 1
@@ -0,0 +1,93 @@
+import json
+import threading
+
+import prefect
+import pytest
+from prefect import Flow
+
+from iguazu import Task
+from iguazu.core import tracing
+from iguazu.core.files import QuetzalFile
+from iguazu.core.runners import IguazuFlowRunner
+
+
+@pytest.fixture(scope='function')
+def enable_tracing():
+    tracing.enable()
+    try:
+        yield
+    finally:
+        tracing.enable(False)
+        tracing.drain_spans()
+
+
+def test_disabled():
+    with tracing.collect_spans() as spans:
+        with tracing.span('nothing', 'test'):
+            pass
+    assert spans == []
+
+
+def test_spans_by_thread(enable_tracing, tmpdir):
+    def background():
+        with tracing.span('background', 'test'):
+            pass
+
+    with tracing.collect_spans() as spans:
+        with tracing.span('outer', 'test', value=1):
+            with tracing.span('inner', 'test'):
+                thread = threading.Thread(target=background, name='worker')
+                thread.start()
+                thread.join()
+
+    # Spans of other threads are kept until they are drained
+    assert [s['name'] for s in spans] == ['inner', 'outer']
+    orphans = tracing.drain_spans()
+    assert [s['name'] for s in orphans] == ['background']
+    assert spans[1]['ts'] <= spans[0]['ts']
+    assert spans[1]['dur'] >= spans[0]['dur']
+
+    path = tmpdir / 'trace.json'
+    assert tracing.write_chrome_trace(spans + orphans, path) == 3
+    with open(path) as fd:
+        events = json.load(fd)['traceEvents']
+    assert {e['args']['name'] for e in events if e['name'] == 'thread_name'} == {'MainThread', 'worker'}
+    assert [e['name'] for e in events if e['ph'] == 'X'] == ['outer', 'inner', 'background']
+    assert events[-3]['args'] == {'value': 1}
+
+
+class CopyTask(Task):
+
+    def run(self, *, file):
+        output = self.default_outputs(file=file)
+        output.file.write_bytes(file.file.read_bytes())
+        return output
+
+    def default_outputs(self, **inputs):
+        return self.create_file(parent=inputs['file'], suffix='_copy')
+
+
+def test_flow_spans(enable_tracing, quetzal_server):
+    workspace_id = prefect.context.temp_url.workspace_id
+    inputs = []
+    for i in range(2):
+        file = QuetzalFile(filename=f'file{i}.bin', path='data', workspace_id=workspace_id, temporary=True)
+        file.file.write_bytes(b'contents')
+        file.upload()
+        inputs.append(file)
+
+    task = CopyTask()
+    with Flow('test_flow_spans') as flow:
+        task.map(file=inputs)
+
+    with prefect.context(caches={}, trace=True):
+        state = flow.run(runner_cls=IguazuFlowRunner)
+    assert state.is_successful()
+
+    spans = tracing.flow_spans(state)
+    names = {(s['cat'], s['name']) for s in spans}
+    assert ('task', 'CopyTask[0]') in names
+    assert ('task', 'CopyTask[1]') in names
+    assert ('phase', 'run') in names
+    assert ('phase', 'handle_outputs') in names
+    assert ('io', 'QuetzalFile.upload_data') in names
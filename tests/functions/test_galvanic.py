@@ -0,0 +1,150 @@
+import logging
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pandas.util.testing as tm
+import pytest
+
+from iguazu.core.exceptions import SoftPreconditionFailed
+from iguazu.functions.galvanic import (
+    _overlap_add, cvx_epoch_size, cvx_memory_estimate, galvanic_cvx, resolve_n_jobs
+)
+
+logger = logging.getLogger(__name__)
+
+
+def synthetic_gsr(duration, fs, seed=42):
+    """Create a zscored GSR-like signal: slow tonic drift plus random SCR bumps"""
+    rng = np.random.RandomState(seed)
+    n = int(duration * fs)
+    t = np.arange(n) / fs
+    tonic = 0.5 * np.sin(2 * np.pi * t / 600) + 0.001 * t / 60
+    # phasic responses: impulses convolved with a bi-exponential (Bateman) kernel
+    impulses = np.zeros(n)
+    impulses[rng.randint(0, n, size=max(int(duration / 20), 1))] = rng.uniform(0.5, 2, size=max(int(duration / 20), 1))
+    tk = np.arange(int(20 * fs)) / fs
+    kernel = np.exp(-tk / 2) - np.exp(-tk / 0.75)
+    phasic = np.convolve(impulses, kernel)[:n]
+    values = tonic + phasic + 0.01 * rng.randn(n)
+    values = (values - values.mean()) / values.std()
+    index = pd.date_range('2020-01-01', periods=n, freq=pd.Timedelta(seconds=1 / fs), tz='UTC')
+    signals = pd.DataFrame({'GSR_filtered_clean_zscored': values}, index=index)
+    annotations = pd.DataFrame({'GSR': ''}, index=index)
+    return signals, annotations
+
+
+def test_overlap_add_equals_groupby():
+    df = tm.makeTimeDataFrame(100)
+    df.iloc[10:15, 1] = np.NaN
+    epochs = [df.iloc[0:40], df.iloc[20:70], df.iloc[50:90]]
+
+    result = _overlap_add(epochs, df.index)
+    expected = (
+        pd.concat([e.rename_axis(index='epoched_index').reset_index() for e in epochs])
+            .groupby('epoched_index')
+            .mean()
+            .rename_axis(index=df.index.name)
+    )
+
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_overlap_add_duplicated_index():
+    df = tm.makeTimeDataFrame(100)
+    # duplicated timestamps, as in resampled data
+    df.index = df.index[[0] + list(range(99))]
+    positions = [np.arange(0, 40), np.arange(20, 70), np.arange(50, 90)]
+    epochs = [df.iloc[pos] for pos in positions]
+
+    with pytest.raises(SoftPreconditionFailed):
+        _overlap_add(epochs, df.index)
+
+    result = _overlap_add(epochs, df.index, positions)
+    expected = (
+        pd.concat([e.reset_index(drop=True).set_index(pos) for e, pos in zip(epochs, positions)])
+            .groupby(level=0)
+            .mean()
+    )
+    expected.index = df.index[expected.index]
+
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_galvanic_cvx_parallel_equals_serial():
+    signals, annotations = synthetic_gsr(duration=240, fs=16)
+    kws = dict(column='GSR_filtered_clean_zscored', warmup_duration=5,
+               epoch_size=60, epoch_overlap=20)
+
+    serial, serial_annotations = galvanic_cvx(signals, annotations.copy(), **kws)
+    parallel, parallel_annotations = galvanic_cvx(signals, annotations.copy(), n_jobs=2, **kws)
+
+    pd.testing.assert_frame_equal(serial, parallel)
+    pd.testing.assert_frame_equal(serial_annotations, parallel_annotations)
+
+
+def test_cvx_epoch_size_whole_signal():
+    n, fs = 10 * 60 * 256, 256
+    budget = cvx_memory_estimate(n, fs)
+
+    epoch_size, estimate = cvx_epoch_size(n, fs, budget)
+
+    assert epoch_size is None
+    assert estimate == budget
+
+
+@pytest.mark.parametrize('n_jobs', [None, 4])
+def test_cvx_epoch_size_fits_budget(n_jobs):
+    n, fs = 60 * 60 * 256, 256
+    budget = 1 << 30
+    workers = n_jobs or 1
+
+    epoch_size, estimate = cvx_epoch_size(n, fs, budget, warmup_duration=15,
+                                          epoch_overlap=60, n_jobs=n_jobs)
+
+    assert 60 <= epoch_size < 60 * 60
+    assert estimate <= budget
+    # one more second would exceed the budget
+    assert workers * cvx_memory_estimate(int((epoch_size + 1) * fs) + 15 * fs, fs) > budget
+
+
+def test_cvx_epoch_size_delta_knot():
+    n, fs = 60 * 60 * 256, 256
+    budget = 1 << 30
+
+    default_size, _ = cvx_epoch_size(n, fs, budget)
+    sparse_size, _ = cvx_epoch_size(n, fs, budget, cvxeda_params={'delta_knot': 60})
+
+    # Fewer spline knots need less memory, so epochs can be larger
+    assert cvx_memory_estimate(n, fs, delta_knot=60) < cvx_memory_estimate(n, fs)
+    assert sparse_size is None or sparse_size >= default_size
+
+
+@pytest.mark.parametrize('n_jobs, expected', [(None, 1), (1, 1), (0, 1), (3, 3), (-1, os.cpu_count() or 1)])
+def test_resolve_n_jobs(n_jobs, expected):
+    assert resolve_n_jobs(n_jobs) == expected
+
+
+@pytest.mark.skipif('IGUAZU_BENCHMARKS' not in os.environ,
+                    reason='Benchmarks are only run when IGUAZU_BENCHMARKS is set')
+def test_galvanic_cvx_benchmark():
+    # 60 minutes of GSR, epoched as ApplyCVX does by default
+    signals, annotations = synthetic_gsr(duration=60 * 60, fs=64)
+    kws = dict(column='GSR_filtered_clean_zscored', warmup_duration=15,
+               epoch_size=300, epoch_overlap=60)
+
+    t0 = time.perf_counter()
+    serial, _ = galvanic_cvx(signals, annotations.copy(), **kws)
+    t_serial = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    parallel, _ = galvanic_cvx(signals, annotations.copy(), n_jobs=-1, **kws)
+    t_parallel = time.perf_counter() - t0
+
+    logger.info('galvanic_cvx on 60 minutes: serial %.1fs, parallel (%d CPUs) %.1fs, speedup %.2fx',
+                t_serial, os.cpu_count(), t_parallel, t_serial / t_parallel)
+    pd.testing.assert_frame_equal(serial, parallel)
+    if os.cpu_count() > 1:
+        # The 12 epochs are solved concurrently
+        assert t_parallel < t_serial
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import prefect
+import pytest
+from prefect import Flow
+
+from iguazu.core.files import LocalFile, LocalURL
+from iguazu.functions.nexus import convert_nexus_gsr, standardize_nexus_signals
+from iguazu.helpers.states import GracefulFail
+from iguazu.tasks.vr import ExtractNexusSignals
+
+
+def raw_nexus(duration=10, fs=512, seed=0):
+    """Create raw Nexus signals with a jittered time index, like timeflux does"""
+    rng = np.random.RandomState(seed)
+    n = int(duration * fs)
+    jitter = pd.to_timedelta(rng.uniform(-0.1, 0.1, size=n) / fs, unit='s')
+    index = pd.date_range('2020-01-01', periods=n, freq=pd.Timedelta(seconds=1 / fs), tz='UTC') + jitter
+    return pd.DataFrame({
+        'F': rng.uniform(400, 600, size=n),
+        'G': rng.randn(n),
+        'H': rng.randn(n),
+    }, index=index)
+
+
+def test_standardize_nexus_signals():
+    raw = raw_nexus()
+    standard, annotations = standardize_nexus_signals(raw, 256)
+
+    assert list(standard.columns) == ['F', 'G', 'H']
+    assert list(annotations.columns) == ['F', 'G', 'H']
+    assert standard.index.equals(annotations.index)
+    steps = np.diff(standard.index.values).astype('timedelta64[ns]').astype(np.int64)
+    assert np.all(steps == 1e9 / 256)
+    assert standard.shape[0] == pytest.approx(10 * 256, abs=2)
+
+
+def test_convert_nexus_gsr():
+    index = pd.date_range('2020-01-01', periods=5, freq='1s', tz='UTC')
+    raw = pd.DataFrame({'GSR': [500.0, 0.0, 2500.0, -1.0, 250.0], 'PPG': np.arange(5.0)}, index=index)
+    annotations = pd.DataFrame('', index=index, columns=['GSR', 'PPG'])
+
+    converted, converted_annotations = convert_nexus_gsr(raw, annotations, column='GSR',
+                                                         linear_offset=0, linear_slope=1)
+
+    # mV -> kΩ -> µS, saturations are NaN
+    np.testing.assert_allclose(converted['GSR'].values, [2.0, np.nan, np.nan, np.nan, 4.0])
+    assert list(converted_annotations['GSR']) == ['', 'saturated high', 'saturated high', 'saturated low', '']
+    # Other signals and the inputs are not modified
+    pd.testing.assert_series_equal(converted['PPG'], raw['PPG'])
+    assert (annotations == '').all().all()
+    assert raw['GSR'].iloc[1] == 0
+
+
+def test_extract_nexus_signals(tmpdir):
+    with prefect.context(temp_url=LocalURL(path=tmpdir), output_url=LocalURL(path=tmpdir)):
+        raw_file = LocalFile(filename='raw.hdf5', path='', temporary=True)
+        raw_nexus().to_hdf(str(raw_file.file), '/nexus/signal/nexus_signal_raw', format='table')
+
+        # BAD is not a standard signal name: it does not follow the signal
+        # specification, but the other signals are saved and the task
+        # gracefully fails with them
+        task = ExtractNexusSignals(channels={'F': 'GSR', 'G': 'PPG', 'H': 'BAD'},
+                                   gsr_column='GSR', sampling_rate=256)
+        with Flow('test_extract_nexus_signals') as flow:
+            extracted = task(signals=raw_file)
+
+        with prefect.context(caches={}):
+            state = flow.run()
+
+    assert isinstance(state.result[extracted], GracefulFail)
+    output = state.result[extracted].result
+    assert output.metadata['iguazu']['status'] == 'FAILED'
+    with pd.HDFStore(str(output.file), 'r') as store:
+        keys = set(store.keys())
+        gsr = pd.read_hdf(store, '/iguazu/signal/gsr/standard')
+        ppg_annotations = pd.read_hdf(store, '/iguazu/signal/ppg/standard/annotations')
+    assert {'/iguazu/signal/gsr/standard', '/iguazu/signal/gsr/standard/annotations',
+            '/iguazu/signal/ppg/standard', '/iguazu/signal/ppg/standard/annotations'} <= keys
+    assert not any(key.startswith('/iguazu/signal/bad') for key in keys)
+    assert list(gsr.columns) == ['GSR']
+    # 400 to 600 mV is 1.67 to 2.5 µS
+    assert gsr['GSR'].dropna().between(1000 / 600, 1000 / 400).all()
+    assert list(ppg_annotations.columns) == ['PPG']
@@ -6,7 +6,8 @@ import prefect
 import pytest
 from prefect import Flow, Parameter
 from iguazu.core.files import FileAdapter, LocalURL
-from iguazu.tasks.quetzal import CreateWorkspace, Query
+from iguazu.core.files.quetzal import mark_workspace_modified
+from iguazu.tasks.quetzal import CreateWorkspace, Query, ScanWorkspace, sample_query
 
 
 @pytest.fixture(scope='function')
@@ -90,6 +91,155 @@ def test_query_convert(mocker, fake_files, tmpdir):
     assert [p.id for p in state.result[rows].result] == [f['id'] for f in fake_files]
 
 
+def test_query_convert_from_families(mocker, fake_files, tmpdir):
+    rows = [{'id': f['id'], 'base': copy.deepcopy(f), 'iguazu': {'status': 'SUCCESS'}} for f in fake_files]
+    query_mock = mocker.patch('quetzal.client.helpers.query')
+    query_mock.return_value = rows, len(rows)
+    metadata_mock = mocker.patch('quetzal.client.helpers.file.metadata')
+
+    query_task = Query(url='https://localhost/api/v1',
+                       username='user',
+                       password='password',
+                       insecure=True,
+                       as_file_adapter=True)
+    url = LocalURL(path=tmpdir)
+
+    with Flow('test_query_convert_from_families flow') as flow:
+        sql = Parameter('input_sql')
+        files = query_task(query=sql, families=['iguazu'])
+
+    parameters = dict(
+        input_sql='SELECT id, base, iguazu FROM metadata',
+    )
+    with prefect.context(output_url=url):
+        state = flow.run(parameters=parameters)
+
+    assert state.is_successful()
+    assert [p.id for p in state.result[files].result] == [f['id'] for f in fake_files]
+    assert all(p.metadata['iguazu']['status'] == 'SUCCESS' for p in state.result[files].result)
+    query_mock.assert_called_once()
+    metadata_mock.assert_not_called()
+
+
+def test_query_convert_missing_families(mocker, fake_files, tmpdir):
+    query_mock = mocker.patch('quetzal.client.helpers.query')
+    query_mock.side_effect = [
+        # the user query, without families
+        ([{'id': f['id']} for f in fake_files], len(fake_files)),
+        # the metadata query of the missing files
+        ([{'base': copy.deepcopy(f), 'iguazu': None} for f in fake_files], len(fake_files)),
+    ]
+    metadata_mock = mocker.patch('quetzal.client.helpers.file.metadata')
+
+    query_task = Query(url='https://localhost/api/v1',
+                       username='user',
+                       password='password',
+                       insecure=True,
+                       as_file_adapter=True)
+    url = LocalURL(path=tmpdir)
+
+    with Flow('test_query_convert_missing_families flow') as flow:
+        sql = Parameter('input_sql')
+        files = query_task(query=sql, families=['iguazu'])
+
+    parameters = dict(
+        input_sql='SELECT id FROM metadata',
+    )
+    with prefect.context(output_url=url):
+        state = flow.run(parameters=parameters)
+
+    assert state.is_successful()
+    assert [p.id for p in state.result[files].result] == [f['id'] for f in fake_files]
+    assert query_mock.call_count == 2
+    metadata_mock.assert_not_called()
+
+
+def test_sample_query():
+    sql = sample_query('SELECT id FROM metadata -- a comment\n;', limit=10, seed=42)
+    assert sql == ('SELECT * FROM (\nSELECT id FROM metadata -- a comment\n\n) AS iguazu_query'
+                   """ ORDER BY md5(CAST(iguazu_query."id" AS TEXT) || '42') LIMIT 10""")
+    assert sample_query('SELECT 1', limit=5) == 'SELECT * FROM (\nSELECT 1\n) AS iguazu_query LIMIT 5'
+
+
+def test_query_server_side_sampling(mocker, fake_files):
+    query_mock = mocker.patch('quetzal.client.helpers.query')
+    query_mock.return_value = fake_files[:2], 2
+
+    query_task = Query(url='https://localhost/api/v1',
+                       username='admin',
+                       password='secret',
+                       insecure=True,
+                       limit=2,
+                       shuffle=True,
+                       seed=1234)
+
+    with Flow('test_query_server_side_sampling flow') as flow:
+        sql = Parameter('input_sql')
+        rows = query_task(query=sql)
+
+    state = flow.run(parameters=dict(input_sql='SELECT id FROM metadata'))
+
+    assert state.is_successful()
+    assert state.result[rows].result == fake_files[:2]
+    args, kwargs = query_mock.call_args
+    assert args[2] == sample_query('SELECT id FROM metadata', limit=2, seed=1234)
+    assert kwargs['limit'] == 2
+
+
+def test_query_cache(mocker, fake_files, tmpdir):
+    query_mock = mocker.patch('quetzal.client.helpers.query')
+    query_mock.return_value = fake_files, len(fake_files)
+
+    query_task = Query(url='https://localhost/api/v1',
+                       username='admin',
+                       password='secret',
+                       insecure=True,
+                       cache_ttl=60)
+
+    with Flow('test_query_cache flow') as flow:
+        sql = Parameter('input_sql')
+        rows = query_task(query=sql, workspace_id=1)
+
+    with prefect.context(temp_dir=str(tmpdir)):
+        for _ in range(2):
+            state = flow.run(parameters=dict(input_sql='SELECT id FROM metadata'))
+            assert state.is_successful()
+            assert state.result[rows].result == fake_files
+        assert query_mock.call_count == 1
+
+        # A modification of the workspace invalidates the cache
+        mark_workspace_modified(1)
+        state = flow.run(parameters=dict(input_sql='SELECT id FROM metadata'))
+        assert state.is_successful()
+        assert query_mock.call_count == 2
+
+
+def test_scan_workspace_cache(mocker, tmpdir):
+    scan_mock = mocker.Mock(return_value=collections.namedtuple('Workspace', ['id'])(1))
+    mocker.patch.dict('iguazu.tasks.quetzal._WorkspaceOperation._known_operations',
+                      scan=scan_mock)
+
+    scan_task = ScanWorkspace(url='https://localhost/api/v1',
+                              username='admin',
+                              password='secret',
+                              insecure=True,
+                              cache_ttl=60)
+    with Flow('test_scan_workspace_cache flow') as flow:
+        wid = scan_task(workspace_id=1)
+
+    with prefect.context(temp_dir=str(tmpdir)):
+        for _ in range(2):
+            state = flow.run()
+            assert state.is_successful()
+            assert state.result[wid].result == 1
+        assert scan_mock.call_count == 1
+
+        mark_workspace_modified(1)
+        state = flow.run()
+        assert state.is_successful()
+        assert scan_mock.call_count == 2
+
+
 def test_create_workspace(mocker):
     list_mock = mocker.patch('quetzal.client.helpers.workspace.list_')
     list_mock.return_value = [], 0